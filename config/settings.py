@@ -147,6 +147,39 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# PFA schedule cache
+# How often each worker checks the schedule version for changes made by other workers
+PFA_SCHEDULE_REVALIDATE_SECONDS = 10
+
+# PFA schedule changes older than this are pruned by prune_schedule_changes
+PFA_SCHEDULE_CHANGE_RETENTION_DAYS = 30
+
+# PFA dated occurrences, generated this many days ahead of today
+PFA_OCCURRENCE_HORIZON_DAYS = 56
+
+# PFA SQL profiling
+# Fraction of requests whose SQL is captured, and the query count above which it is profiled
+PFA_SQL_PROFILE_SAMPLE_RATE = 0.05
+PFA_SQL_QUERY_BUDGET = 10
+
+# PFA metrics endpoint, open to staff users or requests bearing this token
+PFA_METRICS_TOKEN = os.environ.get('PFA_METRICS_TOKEN')
+
+# PFA structured logging, one JSON line per /pfa request in logs/pfa.log
+PFA_STRUCTURED_LOGGING = os.environ.get('PFA_STRUCTURED_LOGGING') == '1'
+
+# Pokedex data source, point it at a local stand-in server for testing
+POKEAPI_BASE_URL = os.environ.get('POKEAPI_BASE_URL', 'https://pokeapi.co/api/v2')
+
+# How often each worker checks pokedex/cache/pokemon.json for changes
+POKEDEX_REVALIDATE_SECONDS = 10
+
+# Where pokedex_view reads from, 'json' (the cache file) or 'db' (filled by fetch_pokemon_data --db)
+POKEDEX_SOURCE = os.environ.get('POKEDEX_SOURCE', 'json')
+
+# Pokémon cards per page of pokedex_view
+POKEDEX_PAGE_SIZE = 48
+
 # Logging Configuration
 LOGGING = {
     'version': 1,
@@ -160,6 +193,9 @@ LOGGING = {
             'format': '{asctime} {levelname} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'pfa.request_log.JsonFormatter',
+        },
     },
     'handlers': {
         'console': {
@@ -167,22 +203,32 @@ LOGGING = {
             'class': 'logging.StreamHandler',
             'formatter': 'simple',
         },
+        # Request threads only enqueue, see pfa/log_handlers.py
         'file_pfa': {
             'level': 'DEBUG',
-            'class': 'logging.FileHandler',
+            '()': 'pfa.log_handlers.QueuedFileHandler',
             'filename': LOGS_DIR / 'pfa.log',
-            'formatter': 'verbose',
+            'max_bytes': 50 * 1024 * 1024,
+            'backup_count': 10,
+            'compress': True,
+            'formatter': 'json' if PFA_STRUCTURED_LOGGING else 'verbose',
         },
         'file_db': {
             'level': 'DEBUG',
-            'class': 'logging.FileHandler',
+            '()': 'pfa.log_handlers.QueuedFileHandler',
             'filename': LOGS_DIR / 'db_operations.log',
+            'max_bytes': 20 * 1024 * 1024,
+            'backup_count': 5,
+            'compress': True,
             'formatter': 'verbose',
         },
         'file_admin': {
             'level': 'INFO',
-            'class': 'logging.FileHandler',
+            '()': 'pfa.log_handlers.QueuedFileHandler',
             'filename': LOGS_DIR / 'admin_actions.log',
+            'when': 'midnight',
+            'backup_count': 30,
+            'compress': True,
             'formatter': 'verbose',
         },
     },
@@ -194,7 +240,7 @@ LOGGING = {
         },
         'django.db.backends': {
             'handlers': ['file_db'],
-            'level': 'DEBUG',
+            'level': 'INFO',
             'propagate': False,
         },
         'django.contrib.admin': {
@@ -207,5 +253,10 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': False,
         },
+        'pokedex': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
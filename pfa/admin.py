@@ -1,41 +1,127 @@
+from django import forms
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.admin.models import LogEntry
 from django.utils.html import format_html
-from django.db.models import Q
+from django.db.models import Count, Q
 from django.shortcuts import render
 from django.urls import path
 from django.http import HttpResponse
 from django.template.response import TemplateResponse
-from .models import Class, ClassCategory, ClassInstance
+from django.forms.models import BaseInlineFormSet
+from . import conflicts
+from .models import Class, ClassCategory, ClassException, ClassInstance
+from .profiling import profile
+from .schedule import revalidate
 import logging
 
 logger = logging.getLogger('pfa')
 
 class LoggingAdmin(admin.ModelAdmin):
+    def get_queryset(self, request):
+        """Include soft deleted rows so they can still be reviewed and restored"""
+        manager = getattr(self.model, 'all_objects', self.model._default_manager)
+        qs = manager.get_queryset()
+        ordering = self.get_ordering(request)
+        if ordering:
+            qs = qs.order_by(*ordering)
+        return qs
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        """Offer soft deleted rows too, so editing a row that points at one still validates"""
+        manager = getattr(db_field.related_model, 'all_objects', None)
+        if manager is not None and 'queryset' not in kwargs:
+            kwargs['queryset'] = manager.all()
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
     def save_model(self, request, obj, form, change):
         if change:
             operation = 'Updated'
-            logger.info(f"ADMIN ACTION: {operation} {obj._meta.model_name} {obj.pk} by {request.user.username}")
+            logger.info("ADMIN ACTION: %s %s %s by %s", operation, obj._meta.model_name, obj.pk, request.user.username)
         else:
             operation = 'Created'
-            logger.info(f"ADMIN ACTION: {operation} {obj._meta.model_name} by {request.user.username}")
+            logger.info("ADMIN ACTION: %s %s by %s", operation, obj._meta.model_name, request.user.username)
         super().save_model(request, obj, form, change)
     
     def delete_model(self, request, obj):
-        logger.info(f"ADMIN ACTION: Deleted {obj._meta.model_name} {obj.pk} by {request.user.username}")
+        logger.info("ADMIN ACTION: Deleted %s %s by %s", obj._meta.model_name, obj.pk, request.user.username)
         super().delete_model(request, obj)
 
+def edited_slot(cleaned_data, key, training_class, name):
+    """Slot for submitted form data, None if the times didn't validate"""
+    if not all(cleaned_data.get(field) for field in ('weekday', 'start_time', 'end_time')):
+        return None
+    instance = ClassInstance(
+        weekday=cleaned_data['weekday'],
+        start_time=cleaned_data['start_time'],
+        end_time=cleaned_data['end_time'],
+        room=cleaned_data.get('room', ''),
+        coach=cleaned_data.get('coach', ''),
+    )
+    return conflicts.slot_for(instance, key=key, name=name)._replace(training_class_id=training_class)
+
+class ClassInstanceAdminForm(forms.ModelForm):
+    class Meta:
+        model = ClassInstance
+        fields = '__all__'
+
+    def clean(self):
+        """Reject slots overlapping another one of the same class, room or coach"""
+        cleaned_data = super().clean()
+        training_class = cleaned_data.get('training_class')
+        if training_class is None or cleaned_data.get('deleted'):
+            return cleaned_data
+        slot = edited_slot(cleaned_data, self.instance.pk or 'new', training_class.pk, training_class.name)
+        if slot is not None:
+            errors = conflicts.check([slot], revalidate().conflict_index())
+            if errors:
+                raise forms.ValidationError(errors[slot.key])
+        return cleaned_data
+
+class ClassInstanceInlineFormSet(BaseInlineFormSet):
+    def clean(self):
+        """Check the submitted slots against the schedule and each other"""
+        super().clean()
+        if any(self.errors):
+            return
+        # A class being added has no pk yet, its slots can still clash with each other
+        training_class = self.instance.pk or 'new'
+        slots, changed, deleted = [], {}, []
+        for number, form in enumerate(self.forms):
+            if not form.cleaned_data:
+                continue
+            if self._should_delete_form(form) or form.cleaned_data.get('deleted'):
+                if form.instance.pk:
+                    deleted.append(form.instance.pk)
+                continue
+            slot = edited_slot(form.cleaned_data, form.instance.pk or f'new-{number}', training_class, self.instance.name)
+            if slot is not None:
+                slots.append(slot)
+                if form.has_changed():
+                    changed[slot.key] = form
+        if not changed and not deleted:
+            return
+
+        # Unchanged rows take part too, but only edited ones are reported
+        errors = conflicts.check(slots, revalidate().conflict_index(), exclude=deleted)
+        for key, form in changed.items():
+            if key in errors:
+                form.add_error(None, errors[key])
+
 class ClassInstanceInline(admin.TabularInline):
     model = ClassInstance
+    formset = ClassInstanceInlineFormSet
     extra = 1
-    fields = ('weekday', 'start_time', 'end_time', 'time_span')
+    fields = ('weekday', 'start_time', 'end_time', 'room', 'coach', 'time_span')
     readonly_fields = ('time_span',)
     
     def get_queryset(self, request):
-        """Order instances by weekday and start time"""
+        """Order live instances by weekday and start time, deleted ones are restored from their own admin page"""
         return super().get_queryset(request).order_by('weekday', 'start_time')
 
 class ClassInstanceAdmin(LoggingAdmin):
+    form = ClassInstanceAdminForm
+    readonly_fields = ('time_span',)
     list_display = (
         'class_name_colored', 'weekday_display', 'time_display', 
         'duration_display', 'categories_display', 'last_updated'
@@ -45,8 +131,10 @@ class ClassInstanceAdmin(LoggingAdmin):
         'training_class__class_categories',
         'training_class',
         'start_time',
+        'room',
+        'coach',
     )
-    search_fields = ('training_class__name',)
+    search_fields = ('training_class__name', 'room', 'coach')
     ordering = ('weekday', 'start_time')
     list_per_page = 50
     
@@ -54,22 +142,20 @@ class ClassInstanceAdmin(LoggingAdmin):
         urls = super().get_urls()
         custom_urls = [
             path('schedule/', self.admin_site.admin_view(weekly_schedule_view), name='pfa_weekly_schedule'),
+            path('sql-profile/', self.admin_site.admin_view(sql_profile_view), name='pfa_sql_profile'),
         ]
         return custom_urls + urls
     
+    def get_queryset(self, request):
+        """Join the class up front, categories come from the denormalized category_mask"""
+        return super().get_queryset(request).select_related('training_class')
+    
     # Custom display methods
     def class_name_colored(self, obj):
         """Display class name with color coding by category"""
-        categories = obj.training_class.class_categories.all()
+        categories = ClassCategory.names_for(obj.category_mask)
         if categories:
-            category = categories.first().category
-            colors = {
-                'Striking': '#e74c3c',    # Red
-                'Grappling': '#3498db',   # Blue  
-                'Fitness': '#27ae60',     # Green
-                'Lifestyle': '#f39c12'    # Orange
-            }
-            color = colors.get(category, '#34495e')
+            color = ClassCategory.CATEGORY_COLORS.get(categories[0], '#34495e')
             return format_html(
                 '<span style="color: {}; font-weight: bold;">{}</span>',
                 color, obj.training_class.name
@@ -115,9 +201,9 @@ class ClassInstanceAdmin(LoggingAdmin):
     
     def categories_display(self, obj):
         """Display all categories for the class"""
-        categories = obj.training_class.class_categories.all()
+        categories = ClassCategory.names_for(obj.category_mask)
         if categories:
-            return " + ".join([cat.category for cat in categories])
+            return " + ".join(categories)
         return "-"
     categories_display.short_description = 'Categories'
     
@@ -134,6 +220,12 @@ class ClassAdmin(LoggingAdmin):
     filter_horizontal = ('class_categories',)
     inlines = [ClassInstanceInline]
     
+    def get_queryset(self, request):
+        """Prefetch categories and count live slots in the changelist query"""
+        return super().get_queryset(request).prefetch_related('class_categories').annotate(
+            _instance_count=Count('classinstance', filter=Q(classinstance__deleted=0)),
+        )
+    
     def categories_display(self, obj):
         """Display categories with color coding"""
         categories = obj.class_categories.all()
@@ -141,15 +233,8 @@ class ClassAdmin(LoggingAdmin):
             return "-"
         
         colored_cats = []
-        colors = {
-            'Striking': '#e74c3c',
-            'Grappling': '#3498db', 
-            'Fitness': '#27ae60',
-            'Lifestyle': '#f39c12'
-        }
-        
         for cat in categories:
-            color = colors.get(cat.category, '#34495e')
+            color = ClassCategory.CATEGORY_COLORS.get(cat.category, '#34495e')
             colored_cats.append(
                 format_html('<span style="color: {};">{}</span>', color, cat.category)
             )
@@ -158,9 +243,9 @@ class ClassAdmin(LoggingAdmin):
     
     def instance_count(self, obj):
         """Show how many instances (schedule slots) this class has"""
-        count = obj.classinstance_set.count()
-        return format_html('<strong>{}</strong> slots', count)
+        return format_html('<strong>{}</strong> slots', obj._instance_count)
     instance_count.short_description = 'Schedule Slots'
+    instance_count.admin_order_field = '_instance_count'
     
     def last_updated(self, obj):
         return obj.updated.strftime('%Y-%m-%d %H:%M')
@@ -170,19 +255,32 @@ class ClassAdmin(LoggingAdmin):
 class ClassCategoryAdmin(LoggingAdmin):
     list_display = ('category', 'class_count', 'total_instances')
     
+    def get_queryset(self, request):
+        """Count live classes and slots in the changelist query"""
+        return super().get_queryset(request).annotate(
+            _class_count=Count('class', filter=Q(class__deleted=0), distinct=True),
+            _instance_count=Count('class__classinstance', filter=Q(class__classinstance__deleted=0), distinct=True),
+        )
+    
     def class_count(self, obj):
         """Show how many classes use this category"""
-        count = obj.class_set.count()
-        return f"{count} classes"
+        return f"{obj._class_count} classes"
     class_count.short_description = 'Classes Using'
+    class_count.admin_order_field = '_class_count'
     
     def total_instances(self, obj):
         """Show total schedule instances for this category"""
-        count = ClassInstance.objects.filter(
-            training_class__class_categories=obj
-        ).count()
-        return f"{count} schedule slots"
+        return f"{obj._instance_count} schedule slots"
     total_instances.short_description = 'Total Schedule Slots'
+    total_instances.admin_order_field = '_instance_count'
+
+class ClassExceptionAdmin(LoggingAdmin):
+    list_display = ('date', 'class_instance', 'cancelled', 'start_time', 'end_time', 'note')
+    list_filter = ('cancelled', 'date')
+    list_select_related = ('class_instance__training_class',)
+    raw_id_fields = ('class_instance',)
+    date_hierarchy = 'date'
+    ordering = ('-date',)
 
 # Register custom admin log entry view
 class LogEntryAdmin(admin.ModelAdmin):
@@ -206,29 +304,8 @@ from django.contrib.admin.views.decorators import staff_member_required
 @staff_member_required
 def weekly_schedule_view(request):
     """Custom weekly schedule grid view"""
-    # Get all class instances grouped by weekday
-    schedule_data = {}
-    weekdays = [
-        ('1', 'Monday'),
-        ('2', 'Tuesday'), 
-        ('3', 'Wednesday'),
-        ('4', 'Thursday'),
-        ('5', 'Friday'),
-        ('6', 'Saturday'),
-        ('7', 'Sunday')
-    ]
-    
-    for day_num, day_name in weekdays:
-        instances = ClassInstance.objects.filter(
-            weekday=day_num, deleted=0
-        ).select_related('training_class').prefetch_related(
-            'training_class__class_categories'
-        ).order_by('start_time')
-        
-        schedule_data[day_name] = {
-            'day_num': day_num,
-            'classes': instances
-        }
+    # Shared with the app index, built once per schedule version
+    schedule_data = revalidate().grid
     
     context = {
         'title': 'Weekly Schedule Overview',
@@ -240,28 +317,37 @@ def weekly_schedule_view(request):
     
     return render(request, 'admin/pfa/weekly_schedule.html', context)
 
+@staff_member_required
+def sql_profile_view(request):
+    """Top SQL fingerprints from sampled over-budget requests in this worker"""
+    if request.method == 'POST':
+        profile.reset()
+        logger.info("ADMIN ACTION: SQL profile reset by %s", request.user.username)
+    
+    order_by = request.GET.get('o', 'total_ms')
+    if order_by not in ('total_ms', 'count', 'p95_ms', 'max_ms'):
+        order_by = 'total_ms'
+    
+    context = {
+        'title': 'SQL Profile',
+        'statements': profile.top(order_by=order_by),
+        'profiled_requests': profile.requests,
+        'order_by': order_by,
+        'sample_rate': settings.PFA_SQL_PROFILE_SAMPLE_RATE,
+        'query_budget': settings.PFA_SQL_QUERY_BUDGET,
+        'site_title': admin.site.site_title,
+        'site_header': admin.site.site_header,
+        'has_permission': True,
+    }
+    
+    return render(request, 'admin/pfa/sql_profile.html', context)
+
 # Override the main admin site to customize PFA app index
 class CustomAdminSite(admin.AdminSite):
     def app_index(self, request, app_label, extra_context=None):
         if app_label == 'pfa':
             # Get schedule data for PFA app index
-            schedule_data = {}
-            weekdays = [
-                ('1', 'Monday'), ('2', 'Tuesday'), ('3', 'Wednesday'),
-                ('4', 'Thursday'), ('5', 'Friday'), ('6', 'Saturday'), ('7', 'Sunday')
-            ]
-            
-            for day_num, day_name in weekdays:
-                instances = ClassInstance.objects.filter(
-                    weekday=day_num, deleted=0
-                ).select_related('training_class').prefetch_related(
-                    'training_class__class_categories'
-                ).order_by('start_time')
-                
-                schedule_data[day_name] = {
-                    'day_num': day_num,
-                    'classes': instances
-                }
+            schedule_data = revalidate().grid
             
             if extra_context is None:
                 extra_context = {}
@@ -276,3 +362,4 @@ admin.site.register(LogEntry, LogEntryAdmin)
 admin.site.register(ClassInstance, ClassInstanceAdmin)
 admin.site.register(Class, ClassAdmin)
 admin.site.register(ClassCategory, ClassCategoryAdmin)
+admin.site.register(ClassException, ClassExceptionAdmin)
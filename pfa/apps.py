@@ -6,5 +6,7 @@ class PfaConfig(AppConfig):
     name = 'pfa'
     
     def ready(self):
-        """Import signal handlers when the app is ready."""
+        """Import signal handlers and start the log writers when the app is ready."""
         import pfa.models  # This imports the signal handlers
+        from pfa.log_handlers import start_writers
+        start_writers()  # Drains records queued by the logging handlers
@@ -0,0 +1,167 @@
+"""
+Overlap detection for the weekly schedule.
+
+Two slots conflict when their times overlap on the same weekday and they
+share a training class, a room or a coach. Classes on different mats are
+allowed to run side by side, so overlap alone is not a conflict.
+
+Every (dimension, value, weekday) gets an IntervalIndex: the intervals
+sorted by start, read as an implicit balanced tree where each node keeps the
+latest end in its subtree. A lookup skips every subtree that ends before the
+queried start and stops going right once starts pass the queried end, which
+is O(log n + k) for k hits. Classes running past midnight are split over two
+days.
+
+The cached WeekSchedule builds one ConflictIndex lazily, so the admin forms
+validate against it without scanning the table. The check_schedule_conflicts
+command builds its own from a single pass over the rows.
+"""
+from collections import namedtuple
+
+from .models import ClassInstance, derive_time_span
+from .schedule import MINUTES_PER_DAY, minutes
+
+DAYS = dict(ClassInstance.DAY_OF_THE_WEEK)
+
+# Slot attribute -> how it reads in a conflict message
+DIMENSIONS = {
+    'training_class_id': 'same class',
+    'room': 'same room',
+    'coach': 'same coach',
+}
+
+# key identifies the slot (the pk, or anything unique for unsaved ones)
+Slot = namedtuple('Slot', 'key name weekday start end training_class_id room coach')
+
+
+def slot_for(instance, key=None, name=None):
+    """Slot for a ClassInstance, saved or not"""
+    return Slot(
+        key=instance.pk if key is None else key,
+        name=name if name is not None else instance.training_class.name,
+        weekday=int(instance.weekday),
+        start=minutes(instance.start_time),
+        end=minutes(instance.start_time) + derive_time_span(instance.start_time, instance.end_time),
+        training_class_id=instance.training_class_id,
+        room=instance.room,
+        coach=instance.coach,
+    )
+
+
+def segments(slot):
+    """(weekday, start, end) pieces of a slot, end may run into the next day"""
+    if slot.end <= slot.start:
+        return []
+    if slot.end <= MINUTES_PER_DAY:
+        return [(slot.weekday, slot.start, slot.end)]
+    return [(slot.weekday, slot.start, MINUTES_PER_DAY), (slot.weekday % 7 + 1, 0, slot.end - MINUTES_PER_DAY)]
+
+
+def dimensions(slot):
+    """(dimension, value) pairs a slot can conflict on, blank rooms and coaches never do"""
+    found = []
+    for dimension in DIMENSIONS:
+        value = getattr(slot, dimension)
+        if isinstance(value, str):
+            value = value.strip().lower()
+        if value not in (None, ''):
+            found.append((dimension, value))
+    return found
+
+
+def describe(other, matched):
+    start, end = other.start % MINUTES_PER_DAY, other.end % MINUTES_PER_DAY
+    reasons = []
+    for dimension in matched:
+        if dimension == 'training_class_id':
+            reasons.append(DIMENSIONS[dimension])
+        else:
+            reasons.append(f"{DIMENSIONS[dimension]} '{getattr(other, dimension)}'")
+    return (
+        f"Overlaps {other.name} on {DAYS.get(str(other.weekday), other.weekday)} "
+        f"{start // 60:02d}:{start % 60:02d}-{end // 60:02d}:{end % 60:02d} ({', '.join(reasons)})"
+    )
+
+
+class IntervalIndex:
+    """Static interval tree over (start, end, item), half-open intervals"""
+
+    def __init__(self, intervals):
+        intervals = sorted(intervals, key=lambda interval: interval[:2])
+        self.starts = [start for start, _, _ in intervals]
+        self.ends = [end for _, end, _ in intervals]
+        self.items = [item for _, _, item in intervals]
+        # Latest end within the subtree rooted at each middle index
+        self.max_ends = [0] * len(intervals)
+        self._build(0, len(intervals))
+
+    def _build(self, low, high):
+        if low >= high:
+            return -1
+        middle = (low + high) // 2
+        latest = max(self.ends[middle], self._build(low, middle), self._build(middle + 1, high))
+        self.max_ends[middle] = latest
+        return latest
+
+    def overlapping(self, start, end):
+        """Items with item_start < end and item_end > start, in start order"""
+        found = []
+        self._search(0, len(self.starts), start, end, found)
+        return found
+
+    def _search(self, low, high, start, end, found):
+        if low >= high:
+            return
+        middle = (low + high) // 2
+        if self.max_ends[middle] <= start:
+            return
+        self._search(low, middle, start, end, found)
+        if self.starts[middle] >= end:
+            return
+        if self.ends[middle] > start:
+            found.append(self.items[middle])
+        self._search(middle + 1, high, start, end, found)
+
+
+class ConflictIndex:
+    """IntervalIndex per (dimension, value, weekday)"""
+
+    def __init__(self, slots):
+        groups = {}
+        for slot in slots:
+            for dimension, value in dimensions(slot):
+                for weekday, start, end in segments(slot):
+                    groups.setdefault((dimension, value, weekday), []).append((start, end, slot))
+        self.trees = {key: IntervalIndex(intervals) for key, intervals in groups.items()}
+
+    def conflicts(self, slot, exclude=()):
+        """[(other slot, [dimensions])] overlapping slot, other than itself and exclude"""
+        found = {}
+        for dimension, value in dimensions(slot):
+            for weekday, start, end in segments(slot):
+                tree = self.trees.get((dimension, value, weekday))
+                if tree is None:
+                    continue
+                for other in tree.overlapping(start, end):
+                    if other.key == slot.key or other.key in exclude:
+                        continue
+                    matched = found.setdefault(other.key, (other, []))[1]
+                    if dimension not in matched:
+                        matched.append(dimension)
+        return list(found.values())
+
+
+def check(slots, index, exclude=()):
+    """{slot key: [messages]} for edited slots, against the index and each other
+
+    The stored versions of the edited slots, and of anything in exclude (say
+    slots being deleted), are ignored since they are being replaced.
+    """
+    edited = {slot.key for slot in slots} | set(exclude)
+    among = ConflictIndex(slots)
+    errors = {}
+    for slot in slots:
+        found = index.conflicts(slot, exclude=edited) + among.conflicts(slot)
+        if found:
+            errors[slot.key] = [describe(other, matched) for other, matched in found]
+    return errors
@@ -0,0 +1,152 @@
+"""
+Non-blocking file logging.
+
+QueuedFileHandler is what LOGGING in config/settings.py wires up for the
+pfa, db and admin log files. Request threads only put records on a bounded
+in-memory queue; a background writer started from PfaConfig.ready() drains
+it in batches into a size- or time-rotated file, optionally gzipping the
+rotated files. When the queue is full records are dropped and counted
+instead of blocking the request.
+
+Rotation happens per process, so when several workers share one log file
+prefer time-based rotation or let an external tool rotate it.
+"""
+import copy
+import gzip
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import sys
+import threading
+import weakref
+
+_STOP = object()
+
+# Every QueuedFileHandler created by dictConfig, so ready() can start them
+_handlers = weakref.WeakSet()
+
+
+def _gzip_namer(name):
+    return name + '.gz'
+
+
+def _gzip_rotator(source, dest):
+    with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+class _BatchingMixin:
+    """Rotating file handler that leaves flushing to the end of a batch."""
+
+    def emit(self, record):
+        try:
+            if self.shouldRollover(record):
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+
+class BatchingRotatingFileHandler(_BatchingMixin, logging.handlers.RotatingFileHandler):
+    pass
+
+
+class BatchingTimedRotatingFileHandler(_BatchingMixin, logging.handlers.TimedRotatingFileHandler):
+    pass
+
+
+class QueuedFileHandler(logging.handlers.QueueHandler):
+    """Enqueue records for a background writer that owns the rotating file."""
+
+    def __init__(self, filename, max_bytes=10 * 1024 * 1024, backup_count=5, when=None,
+                 compress=False, queue_size=10000, batch_size=500, encoding='utf-8'):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        if when:
+            self.target = BatchingTimedRotatingFileHandler(
+                filename, when=when, backupCount=backup_count, encoding=encoding, delay=True
+            )
+        else:
+            self.target = BatchingRotatingFileHandler(
+                filename, maxBytes=max_bytes, backupCount=backup_count, encoding=encoding, delay=True
+            )
+        if compress:
+            self.target.namer = _gzip_namer
+            self.target.rotator = _gzip_rotator
+
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._reported_dropped = 0
+        self._writer = None
+        _handlers.add(self)
+
+    def setFormatter(self, fmt):
+        # Formatting happens on the writer thread, not in the request
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        """Resolve the message now, while its arguments are still valid."""
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        """Start the background writer, records logged so far are already queued."""
+        if self._writer is None:
+            self._writer = threading.Thread(
+                target=self._run, name=f'log-writer:{os.path.basename(self.target.baseFilename)}', daemon=True
+            )
+            self._writer.start()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for record in batch:
+                if record is _STOP:
+                    self.target.flush()
+                    return
+                self.target.handle(record)
+
+            if self.dropped != self._reported_dropped:
+                lost = self.dropped - self._reported_dropped
+                self._reported_dropped = self.dropped
+                self.target.handle(logging.makeLogRecord({
+                    'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': f'Log queue full, dropped {lost} records ({self.dropped} total)',
+                }))
+            self.target.flush()
+
+    def close(self):
+        """Drain the queue and stop the writer, called by logging.shutdown() at exit."""
+        if self._writer is not None and self._writer.is_alive():
+            try:
+                self.queue.put(_STOP, timeout=5)
+                self._writer.join(timeout=5)
+            except queue.Full:
+                print(f'Log writer for {self.target.baseFilename} did not drain in time', file=sys.stderr)
+        self._writer = None
+        self.target.close()
+        super().close()
+
+
+def start_writers():
+    """Start the background writer of every queued handler, see PfaConfig.ready()."""
+    for handler in list(_handlers):
+        handler.start()
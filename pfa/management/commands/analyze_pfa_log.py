@@ -0,0 +1,346 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from pfa.metrics import RouteStats
+from pfa.models import ClassInstance
+import datetime
+import glob
+import gzip
+import heapq
+import json
+import mmap
+import os
+import re
+
+# Lines as written by the 'verbose' formatter, see LOGGING in config/settings.py
+LINE = re.compile(rb'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) \w+ \w+ (\d+) (\d+) (.*)$')
+REQUEST = re.compile(rb'REQUEST: (\S+) (\S+) from user=\S* ip=\S* query=(.*)$')
+RESPONSE = re.compile(rb'RESPONSE: (\S+) (\S+) status=(\d+) time=([\d.]+)ms')
+DB = re.compile(rb'DB: (\S+) (\S+) - (\d+) queries in ([\d.]+)ms')
+TIMESTAMP = re.compile(rb'\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}')
+RELATIVE = re.compile(r'^(\d+)([mhd])$')
+
+# Bounds that keep memory flat whatever ends up in the log
+MAX_ROUTES = 500
+MAX_FILTERS = 1000
+MAX_PENDING = 10000
+OTHER = '(other)'
+
+
+def parse_time(value):
+    """Turn '2h', '7d', a date or a datetime into a log timestamp string"""
+    match = RELATIVE.match(value)
+    if match:
+        amount, unit = int(match.group(1)), match.group(2)
+        delta = {'m': datetime.timedelta(minutes=amount), 'h': datetime.timedelta(hours=amount),
+                 'd': datetime.timedelta(days=amount)}[unit]
+        moment = datetime.datetime.now() - delta
+    else:
+        try:
+            moment = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            raise CommandError(f"Invalid time '{value}', use e.g. 2h, 7d, 2025-01-31 or 2025-01-31T18:00")
+    # Log timestamps sort as strings, so the range check is a string compare
+    return moment.strftime('%Y-%m-%d %H:%M:%S,000')
+
+
+def line_time(line):
+    """Timestamp of a legacy or JSON log line, None for continuation lines"""
+    if line[:1] == b'{':
+        index = line.find(b'"time": "')
+        match = TIMESTAMP.match(line, index + 9) if index >= 0 else None
+    else:
+        match = TIMESTAMP.match(line)
+    return match.group().decode() if match else None
+
+
+def rotated_files(path):
+    """The log file and its rotated copies, oldest first"""
+    def age(name):
+        suffix = name[len(path) + 1:]
+        if suffix.endswith('.gz'):
+            suffix = suffix[:-3]
+        # Size rotation numbers up from the newest, time rotation uses dates
+        return (0, -int(suffix), '') if suffix.isdigit() else (1, 0, suffix)
+
+    files = sorted(glob.glob(glob.escape(path) + '.*'), key=age)
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def seek_since(f, size, since):
+    """Binary search a time ordered file for the first line at or after since"""
+    def first_time_after(offset):
+        f.seek(offset)
+        if offset:
+            f.readline()
+        # Skip traceback lines until one carries a timestamp
+        for _ in range(100):
+            line = f.readline()
+            if not line:
+                return None
+            timestamp = line_time(line)
+            if timestamp:
+                return timestamp
+        return None
+
+    low, high = 0, size
+    while high - low > 4096:
+        middle = (low + high) // 2
+        timestamp = first_time_after(middle)
+        if timestamp is None or timestamp >= since:
+            high = middle
+        else:
+            low = middle
+    f.seek(low)
+    if low:
+        f.readline()
+
+
+class LogStats:
+    """Aggregates requests in bounded memory"""
+
+    def __init__(self, slow_count):
+        self.routes = {}
+        self.filters = {}
+        self.slow = []
+        self.slow_count = slow_count
+        self.requests = 0
+        self.first = None
+        self.last = None
+        self._seq = 0
+
+    def add(self, timestamp, method, path, status, duration_ms, queries, query):
+        self.requests += 1
+        self.first = self.first or timestamp
+        self.last = timestamp
+
+        key = (path, status)
+        stats = self.routes.get(key)
+        if stats is None:
+            if len(self.routes) >= MAX_ROUTES:
+                key = (OTHER, status)
+                stats = self.routes.get(key)
+            if stats is None:
+                stats = self.routes[key] = RouteStats()
+        stats.record(duration_ms * 1000, queries or 0)
+
+        if query and ('day' in query or 'category' in query):
+            key = (str(query.get('day', '-')), str(query.get('category', '-')))
+            if key not in self.filters and len(self.filters) >= MAX_FILTERS:
+                key = (OTHER, OTHER)
+            self.filters[key] = self.filters.get(key, 0) + 1
+
+        # Min-heap of the slowest requests seen so far
+        self._seq += 1
+        entry = (duration_ms, self._seq, {
+            'time': timestamp, 'method': method, 'path': path, 'status': status,
+            'duration_ms': duration_ms, 'db_queries': queries, 'query': query,
+        })
+        if len(self.slow) < self.slow_count:
+            heapq.heappush(self.slow, entry)
+        elif self.slow and duration_ms > self.slow[0][0]:
+            heapq.heapreplace(self.slow, entry)
+
+    def as_dict(self):
+        days = dict(ClassInstance.DAY_OF_THE_WEEK)
+        routes = []
+        for (path, status), stats in sorted(self.routes.items()):
+            latency = stats.latency_us
+            routes.append({
+                'path': path,
+                'status': status,
+                'count': latency.count,
+                'p50_ms': round(latency.percentile(0.5) / 1000, 3),
+                'p90_ms': round(latency.percentile(0.9) / 1000, 3),
+                'p99_ms': round(latency.percentile(0.99) / 1000, 3),
+                'max_ms': round(latency.max / 1000, 3),
+                'mean_ms': round(latency.mean / 1000, 3),
+                'db_queries_mean': round(stats.db_queries / latency.count, 2) if latency.count else 0,
+                'db_queries_max': stats.db_queries_max,
+            })
+        filters = [
+            {'day': day, 'day_name': days.get(day, day), 'category': category, 'count': count}
+            for (day, category), count in sorted(self.filters.items(), key=lambda item: -item[1])
+        ]
+        slow = [entry for _, _, entry in sorted(self.slow, reverse=True)]
+        return {
+            'requests': self.requests,
+            'first': self.first,
+            'last': self.last,
+            'routes': routes,
+            'filters': filters,
+            'slowest': slow,
+        }
+
+
+class Command(BaseCommand):
+    help = 'Summarizes request latency, filter usage and slow requests from the pfa log'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'files',
+            nargs='*',
+            help='Log files to read (default: logs/pfa.log and its rotated copies)'
+        )
+        parser.add_argument(
+            '--no-rotated',
+            action='store_true',
+            help='Only read the given files, not their rotated .N/.gz copies'
+        )
+        parser.add_argument('--since', help='Start of the time range, e.g. 2h, 7d or 2025-01-31T18:00')
+        parser.add_argument('--until', help='End of the time range, same formats as --since')
+        parser.add_argument(
+            '--slow',
+            type=int,
+            default=20,
+            help='Number of slowest requests to list'
+        )
+        parser.add_argument(
+            '--mmap',
+            action='store_true',
+            help='Memory-map uncompressed files instead of buffered reads'
+        )
+        parser.add_argument(
+            '--format',
+            choices=['table', 'json'],
+            default='table',
+            help='Output format'
+        )
+
+    def handle(self, *args, **options):
+        since = parse_time(options['since']) if options['since'] else None
+        until = parse_time(options['until']) if options['until'] else None
+
+        paths = options['files'] or [str(settings.LOGS_DIR / 'pfa.log')]
+        files = []
+        for path in paths:
+            files.extend([path] if options['no_rotated'] else rotated_files(path))
+        if not files:
+            raise CommandError(f"No log files found for {', '.join(paths)}")
+
+        self.stats = LogStats(options['slow'])
+        # Legacy lines of one request share a (process, thread) and arrive in order
+        self.pending = {}
+        self.lines = 0
+
+        for path in files:
+            if not self.read_file(path, since, until, options['mmap']):
+                break
+
+        report = self.stats.as_dict()
+        report['lines'] = self.lines
+        report['files'] = files
+        if options['format'] == 'json':
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.write_table(report)
+
+    def read_file(self, path, since, until, use_mmap):
+        """Feed one file through the parser, returns False once past until"""
+        if path.endswith('.gz'):
+            # No random access into gzip, the time range is checked line by line
+            with gzip.open(path, 'rb') as f:
+                return self.read_lines(f, since, until)
+
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if not size:
+                return True
+            if use_mmap:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    if since:
+                        seek_since(mapped, size, since)
+                    return self.read_lines(iter(mapped.readline, b''), since, until)
+            if since:
+                seek_since(f, size, since)
+            return self.read_lines(f, since, until)
+
+    def read_lines(self, lines, since, until):
+        for line in lines:
+            self.lines += 1
+            if line[:1] == b'{':
+                if b'"duration_ms"' not in line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                timestamp = record.get('time', '')
+                if since and timestamp < since:
+                    continue
+                if until and timestamp > until:
+                    return False
+                self.stats.add(
+                    timestamp, record.get('method'), record.get('path'), record.get('status'),
+                    float(record['duration_ms']), record.get('db_queries'), record.get('query'),
+                )
+                continue
+
+            if b'REQUEST: ' not in line and b'RESPONSE: ' not in line and b'DB: ' not in line:
+                continue
+            match = LINE.match(line.rstrip(b'\r\n'))
+            if not match:
+                continue
+            timestamp = match.group(1).decode()
+            if since and timestamp < since:
+                continue
+            if until and timestamp > until:
+                return False
+            self.parse_legacy(timestamp, (match.group(2), match.group(3)), match.group(4))
+        return True
+
+    def parse_legacy(self, timestamp, thread, message):
+        match = RESPONSE.match(message)
+        if match:
+            method, path, status, duration = match.groups()
+            pending = self.pending.pop(thread, {})
+            self.stats.add(
+                timestamp, method.decode(), path.decode(errors='replace'), int(status),
+                float(duration), pending.get('queries'), pending.get('query'),
+            )
+            return
+
+        match = REQUEST.match(message)
+        if match:
+            try:
+                query = json.loads(match.group(3))
+            except ValueError:
+                query = None
+            if len(self.pending) >= MAX_PENDING:
+                # Requests that never logged a response, drop the oldest
+                self.pending.pop(next(iter(self.pending)))
+            self.pending[thread] = {'query': query}
+            return
+
+        match = DB.match(message)
+        if match and thread in self.pending:
+            self.pending[thread]['queries'] = int(match.group(3))
+
+    def write_table(self, report):
+        self.stdout.write(
+            f"{report['requests']} requests from {report['lines']} lines "
+            f"in {len(report['files'])} files ({report['first']} - {report['last']})"
+        )
+
+        self.stdout.write("\nLatency by path and status (ms):")
+        self.stdout.write(
+            f"  {'path':<40} {'status':>6} {'count':>8} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9} {'queries':>8}"
+        )
+        for route in report['routes']:
+            self.stdout.write(
+                f"  {route['path'][:40]:<40} {route['status']!s:>6} {route['count']:>8} "
+                f"{route['p50_ms']:>9.1f} {route['p90_ms']:>9.1f} {route['p99_ms']:>9.1f} "
+                f"{route['max_ms']:>9.1f} {route['db_queries_mean']:>8.1f}"
+            )
+
+        self.stdout.write("\nMost requested filters:")
+        for row in report['filters'][:20]:
+            self.stdout.write(f"  {row['day_name']:<10} {row['category']:<12} {row['count']:>8}")
+
+        self.stdout.write(f"\nSlowest {len(report['slowest'])} requests:")
+        for entry in report['slowest']:
+            self.stdout.write(
+                f"  {entry['time']} {entry['duration_ms']:>9.1f}ms {entry['status']} "
+                f"{entry['method']} {entry['path']} {json.dumps(entry['query'])}"
+            )
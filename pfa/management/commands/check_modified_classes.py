@@ -1,11 +1,14 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from pfa.models import ClassInstance
+from pfa.models import AuditWatermark, ClassInstance
 import logging
 import datetime
+import json
 
 logger = logging.getLogger('pfa')
 
+WATERMARK = 'check_modified_classes'
+
 class Command(BaseCommand):
     help = 'Checks for class instances that have been modified recently'
 
@@ -16,21 +19,84 @@ class Command(BaseCommand):
             default=7,
             help='Number of days to look back for modifications'
         )
+        parser.add_argument(
+            '--since-last-run',
+            action='store_true',
+            help='Only report modifications since the previous --since-last-run (falls back to --days)'
+        )
+        parser.add_argument(
+            '--format',
+            choices=['text', 'json'],
+            default='text',
+            help='Output format'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of rows fetched from the database at a time'
+        )
 
     def handle(self, *args, **options):
         days = options['days']
-        cutoff_date = timezone.now() - datetime.timedelta(days=days)
-        
-        # Find all classes modified in the last N days
-        modified_classes = ClassInstance.objects.filter(updated__gte=cutoff_date)
-        
-        if modified_classes.exists():
-            self.stdout.write(f"Found {modified_classes.count()} classes modified in the last {days} days:")
-            logger.info(f"AUDIT: Found {modified_classes.count()} classes modified in the last {days} days")
-            
-            for cls in modified_classes:
-                self.stdout.write(f"  - {cls} (last updated: {cls.updated})")
-                logger.info(f"AUDIT: Class {cls.pk} ({cls}) was last updated on {cls.updated}")
+        started = timezone.now()
+        cutoff_date = started - datetime.timedelta(days=days)
+        period = f"in the last {days} days"
+
+        watermark = None
+        if options['since_last_run']:
+            watermark, _ = AuditWatermark.objects.get_or_create(name=WATERMARK)
+            if watermark.timestamp:
+                cutoff_date = watermark.timestamp
+                period = f"since {cutoff_date.isoformat()}"
+
+        # One streamed pass over the updated index, the class comes along in the same query
+        modified_classes = ClassInstance.objects.filter(
+            updated__gte=cutoff_date
+        ).select_related('training_class').order_by('updated', 'pk').iterator(chunk_size=options['chunk_size'])
+
+        if options['format'] == 'json':
+            count = self.write_json(modified_classes, cutoff_date)
         else:
-            self.stdout.write(f"No classes have been modified in the last {days} days.")
-            logger.info(f"AUDIT: No classes have been modified in the last {days} days")
\ No newline at end of file
+            count = self.write_text(modified_classes, period)
+
+        if count:
+            logger.info("AUDIT: Found %s classes modified %s", count, period)
+        else:
+            logger.info("AUDIT: No classes have been modified %s", period)
+
+        # Only move on once the whole range has been reported
+        if watermark is not None:
+            watermark.timestamp = started
+            watermark.save(update_fields=['timestamp', 'updated'])
+
+    def write_text(self, modified_classes, period):
+        count = 0
+        for cls in modified_classes:
+            count += 1
+            self.stdout.write(f"  - {cls} (last updated: {cls.updated})")
+            logger.info("AUDIT: Class %s (%s) was last updated on %s", cls.pk, cls, cls.updated)
+
+        if count:
+            self.stdout.write(f"Found {count} classes modified {period}.")
+        else:
+            self.stdout.write(f"No classes have been modified {period}.")
+        return count
+
+    def write_json(self, modified_classes, cutoff_date):
+        # Written row by row so the document never has to fit in memory
+        self.stdout.write(f'{{"since": {json.dumps(cutoff_date.isoformat())}, "classes": [', ending='')
+        count = 0
+        for cls in modified_classes:
+            entry = {
+                'id': cls.pk,
+                'training_class': cls.training_class.name,
+                'weekday': cls.weekday,
+                'start_time': cls.start_time.strftime('%H:%M:%S'),
+                'end_time': cls.end_time.strftime('%H:%M:%S'),
+                'updated': cls.updated.isoformat(),
+            }
+            self.stdout.write(('\n  ' if not count else ',\n  ') + json.dumps(entry), ending='')
+            count += 1
+        self.stdout.write(f'\n], "count": {count}}}')
+        return count
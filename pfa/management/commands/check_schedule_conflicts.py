@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from pfa.conflicts import ConflictIndex, describe, slot_for
+from pfa.models import ChangeLog, ClassInstance, derive_time_span, invalidate_schedule, record_instance_changes
+import logging
+
+logger = logging.getLogger('pfa')
+
+class Command(BaseCommand):
+    help = 'Reports overlapping classes sharing a class, room or coach, and stale time_span values'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix-time-span',
+            action='store_true',
+            help='Rewrite time_span wherever it disagrees with start_time and end_time'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Number of rows fetched from the database at a time'
+        )
+
+    def handle(self, *args, **options):
+        # One pass builds the slots and checks the derived durations
+        slots, stale = [], {}
+        instances = ClassInstance.objects.filter(
+            training_class__deleted=0
+        ).select_related('training_class').order_by('pk').iterator(chunk_size=options['chunk_size'])
+        for instance in instances:
+            slots.append(slot_for(instance))
+            span = derive_time_span(instance.start_time, instance.end_time)
+            if span != instance.time_span:
+                stale[instance.pk] = (instance.time_span, span)
+                self.stdout.write(f"  - {instance}: time_span {instance.time_span}, should be {span}")
+
+        # Each pair is reported once, from its lower key
+        index = ConflictIndex(slots)
+        found = 0
+        for slot in slots:
+            for other, matched in index.conflicts(slot):
+                if other.key > slot.key:
+                    found += 1
+                    self.stdout.write(f"  - {slot.name} ({slot.key}): {describe(other, matched)} ({other.key})")
+                    logger.warning("SCHEDULE CONFLICT: %s %s overlaps %s %s on %s", slot.name, slot.key, other.name, other.key, matched)
+
+        self.stdout.write(f"Checked {len(slots)} class instances: {found} conflicts, {len(stale)} stale time spans")
+        logger.info("AUDIT: Checked %s class instances, %s conflicts, %s stale time spans", len(slots), found, len(stale))
+
+        if stale and options['fix_time_span']:
+            self.fix_time_spans(stale)
+            self.stdout.write(f"Fixed {len(stale)} time spans")
+
+    def fix_time_spans(self, stale):
+        """One UPDATE per distinct duration, audited like an admin edit"""
+        by_span = {}
+        for pk, (_, span) in stale.items():
+            by_span.setdefault(span, []).append(pk)
+        now = timezone.now()
+        with transaction.atomic():
+            for span, pks in by_span.items():
+                ClassInstance.all_objects.filter(pk__in=pks).update(time_span=span, updated=now)
+            ChangeLog.write([
+                ChangeLog(model_name='classinstance', object_id=pk, action='update', changes={'time_span': [old, new]})
+                for pk, (old, new) in stale.items()
+            ])
+            record_instance_changes(stale)
+            invalidate_schedule()
+        logger.info("AUDIT: Fixed time_span of %s class instances", len(stale))
@@ -1,90 +1,116 @@
 from django.core.management.base import BaseCommand
-from django.utils import timezone
-from pfa.models import ClassInstance
-from django.db.models import F
+from django.db.models import Max
+from pfa.models import AuditWatermark, ChangeLog, Class, ClassInstance
 import logging
-import datetime
-import json
 
 logger = logging.getLogger('pfa')
 
+WATERMARK = 'detect_schedule_changes'
+
 class Command(BaseCommand):
     help = 'Detects any unexpected changes to class schedules'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of changelog rows read per query'
+        )
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Start over from the current end of the changelog without reporting'
+        )
+
     def handle(self, *args, **options):
         self.stdout.write("Running schedule change detection...")
         logger.info("AUDIT: Running schedule change detection")
-        
-        # Get all current classes
-        current_classes = {}
-        for cls in ClassInstance.objects.all():
-            key = f"{cls.pk}"
-            current_classes[key] = {
-                'training_class': cls.training_class.name,
-                'weekday': cls.weekday,
-                'start_time': cls.start_time.strftime('%H:%M:%S'),
-                'end_time': cls.end_time.strftime('%H:%M:%S'),
-                'updated': cls.updated.isoformat(),
-            }
-        
-        # Check if we have a previous snapshot to compare against
-        try:
-            with open('logs/schedule_snapshot.json', 'r') as f:
-                previous_snapshot = json.load(f)
-                
-                # Compare current with previous
-                for key, previous_data in previous_snapshot.items():
-                    if key in current_classes:
-                        current_data = current_classes[key]
-                        
-                        # Check for changes
-                        changes = []
-                        if previous_data['training_class'] != current_data['training_class']:
-                            changes.append(f"training_class: {previous_data['training_class']} -> {current_data['training_class']}")
-                        
-                        if previous_data['weekday'] != current_data['weekday']:
-                            changes.append(f"weekday: {previous_data['weekday']} -> {current_data['weekday']}")
-                        
-                        if previous_data['start_time'] != current_data['start_time']:
-                            changes.append(f"start_time: {previous_data['start_time']} -> {current_data['start_time']}")
-                        
-                        if previous_data['end_time'] != current_data['end_time']:
-                            changes.append(f"end_time: {previous_data['end_time']} -> {current_data['end_time']}")
-                        
-                        if changes:
-                            self.stdout.write(f"Detected changes to class {key}:")
-                            for change in changes:
-                                self.stdout.write(f"  - {change}")
-                            
-                            logger.warning(f"SCHEDULE CHANGE DETECTED: Class {key} changed: {', '.join(changes)}")
-                    else:
-                        # Class was deleted
-                        self.stdout.write(f"Class {key} ({previous_data['training_class']}) was deleted")
-                        logger.warning(f"SCHEDULE CHANGE DETECTED: Class {key} ({previous_data['training_class']}) was deleted")
-                
-                # Check for new classes
-                for key in current_classes:
-                    if key not in previous_snapshot:
-                        self.stdout.write(f"New class detected: {key} ({current_classes[key]['training_class']})")
-                        logger.info(f"SCHEDULE CHANGE DETECTED: New class {key} ({current_classes[key]['training_class']})")
-                        
-        except FileNotFoundError:
-            self.stdout.write("No previous snapshot found. Creating initial snapshot.")
-            logger.info("AUDIT: Creating initial schedule snapshot")
-        except Exception as e:
-            self.stdout.write(f"Error comparing snapshots: {str(e)}")
-            logger.error(f"AUDIT ERROR: Failed to compare schedule snapshots: {str(e)}", exc_info=True)
-            
-        # Always save current snapshot
-        try:
-            # Ensure logs directory exists
-            import os
-            os.makedirs('logs', exist_ok=True)
-            
-            with open('logs/schedule_snapshot.json', 'w') as f:
-                json.dump(current_classes, f, indent=2)
-                self.stdout.write("Schedule snapshot saved")
-                logger.info("AUDIT: Schedule snapshot saved")
-        except Exception as e:
-            self.stdout.write(f"Error saving snapshot: {str(e)}")
-            logger.error(f"AUDIT ERROR: Failed to save schedule snapshot: {str(e)}", exc_info=True)
\ No newline at end of file
+
+        watermark = AuditWatermark.objects.filter(name=WATERMARK).first()
+        if watermark is None or options['reset']:
+            # Nothing to compare against yet, later runs report from here on
+            position = ChangeLog.objects.aggregate(last=Max('sequence'))['last'] or 0
+            AuditWatermark.objects.update_or_create(name=WATERMARK, defaults={'position': position})
+            self.stdout.write("No previous watermark found. Starting from the current changelog position.")
+            logger.info("AUDIT: Schedule change watermark set to %s", position)
+            return
+
+        # Sequences are handed out in commit order, so nothing can still land behind the watermark
+        changes = ChangeLog.objects.filter(
+            model_name__in=('classinstance', 'class', 'import'),
+        ).order_by('sequence')
+        processed = 0
+
+        # Chunks keyed on the sequence, each one moves the watermark forward
+        while True:
+            entries = list(changes.filter(sequence__gt=watermark.position)[:options['batch_size']])
+            if not entries:
+                break
+
+            # Two lookups per chunk for the names, whatever its size
+            instance_ids, class_ids = set(), set()
+            for entry in entries:
+                if entry.model_name == 'classinstance':
+                    instance_ids.add(entry.object_id)
+                    class_ids.update(value for value in (entry.changes or {}).get('training_class_id', []) if value)
+            instance_classes = dict(ClassInstance.all_objects.filter(
+                pk__in=instance_ids
+            ).values_list('pk', 'training_class_id'))
+            class_ids.update(instance_classes.values())
+            class_names = dict(Class.all_objects.filter(pk__in=class_ids).values_list('pk', 'name'))
+
+            for entry in entries:
+                self.report(entry, instance_classes, class_names)
+
+            watermark.position = entries[-1].sequence
+            watermark.save(update_fields=['position', 'updated'])
+            processed += len(entries)
+
+        self.stdout.write(f"Checked {processed} changes, watermark at {watermark.position}")
+        logger.info("AUDIT: Checked %s schedule changes, watermark at %s", processed, watermark.position)
+
+    def report(self, entry, instance_classes, class_names):
+        changes = entry.changes or {}
+        if entry.model_name == 'import':
+            # Imported with --summary-audit, there are no per-row entries to report
+            self.stdout.write(
+                f"Bulk import from {changes.get('source')}: created {changes.get('created')}, updated {changes.get('updated')}"
+            )
+            logger.warning("SCHEDULE CHANGE DETECTED: Bulk import from %s", changes.get('source'))
+            return
+        if entry.model_name == 'class':
+            if entry.action == 'update' and 'name' in changes:
+                old, new = changes['name']
+                self.stdout.write(f"Training class {entry.object_id} renamed: {old} -> {new}")
+                logger.warning("SCHEDULE CHANGE DETECTED: Training class %s renamed: %s -> %s", entry.object_id, old, new)
+            return
+
+        key = entry.object_id
+        # Tombstones of hard deleted instances still carry their class
+        old_class, new_class = changes.get('training_class_id', [None, None])
+        class_id = instance_classes.get(key) or new_class or old_class
+        name = class_names.get(class_id, 'unknown class')
+
+        if entry.action == 'create':
+            self.stdout.write(f"New class detected: {key} ({name})")
+            logger.info("SCHEDULE CHANGE DETECTED: New class %s (%s)", key, name)
+        elif entry.action == 'delete' or changes.get('deleted', [0, 0])[1]:
+            # Hard deletes leave a tombstone, soft deletes flip the deleted flag
+            self.stdout.write(f"Class {key} ({name}) was deleted")
+            logger.warning("SCHEDULE CHANGE DETECTED: Class %s (%s) was deleted", key, name)
+        elif changes:
+            lines = []
+            for field, (old, new) in changes.items():
+                if field == 'training_class_id':
+                    field, old, new = 'training_class', class_names.get(old, old), class_names.get(new, new)
+                lines.append(f"{field}: {old} -> {new}")
+
+            self.stdout.write(f"Detected changes to class {key}:")
+            for line in lines:
+                self.stdout.write(f"  - {line}")
+            logger.warning("SCHEDULE CHANGE DETECTED: Class %s changed: %s", key, ', '.join(lines))
+        else:
+            # Written before the old values were known
+            self.stdout.write(f"Class {key} ({name}) was updated")
+            logger.info("SCHEDULE CHANGE DETECTED: Class %s (%s) was updated", key, name)
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from pfa.schedule_io import export_rows, write_csv, write_jsonl
+import logging
+
+logger = logging.getLogger('pfa')
+
+class Command(BaseCommand):
+    help = 'Streams the class schedule to a JSON-lines or CSV file'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'output',
+            nargs='?',
+            default='-',
+            help='File to write, - for stdout'
+        )
+        parser.add_argument(
+            '--format',
+            choices=['jsonl', 'csv'],
+            help='Output format (default: from the file extension, otherwise jsonl)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Number of rows fetched from the database at a time'
+        )
+
+    def handle(self, *args, **options):
+        output = options['output']
+        file_format = options['format'] or ('csv' if output.endswith('.csv') else 'jsonl')
+        write = write_csv if file_format == 'csv' else write_jsonl
+        rows = export_rows(options['chunk_size'])
+
+        if output == '-':
+            self.stdout.ending = ''
+            count = write(self.stdout, rows)
+        else:
+            with open(output, 'w', newline='', encoding='utf-8') as f:
+                count = write(f, rows)
+            self.stderr.write(f"Exported {count} rows to {output}")
+        logger.info("EXPORT: %s rows to %s as %s", count, output, file_format)
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from pfa import occurrences
+from pfa.models import ClassInstance
+import logging
+
+logger = logging.getLogger('pfa')
+
+class Command(BaseCommand):
+    help = 'Rolls the dated class occurrences forward to the configured horizon, run it daily'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            help='Generate this many days ahead instead of PFA_OCCURRENCE_HORIZON_DAYS'
+        )
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Regenerate every upcoming occurrence, not only the missing dates'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of class instances handled per query'
+        )
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            instance_ids = list(ClassInstance.all_objects.values_list('pk', flat=True))
+            for i in range(0, len(instance_ids), options['batch_size']):
+                occurrences.regenerate(instance_ids[i:i + options['batch_size']])
+            self.stdout.write(f"Regenerated upcoming occurrences of {len(instance_ids)} class instances")
+            logger.info("OCCURRENCES: rebuilt upcoming occurrences of %s class instances", len(instance_ids))
+
+        added = occurrences.extend(options['days'], options['batch_size'])
+        self.stdout.write(f"Generated {added} new occurrences")
@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand, CommandError
+from pfa.schedule_io import ScheduleImporter, read_csv, read_jsonl
+import logging
+import sys
+import time
+
+logger = logging.getLogger('pfa')
+
+class Command(BaseCommand):
+    help = 'Upserts the class schedule from a JSON-lines or CSV file, as written by export_schedule'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'input',
+            help='File to read, - for stdin'
+        )
+        parser.add_argument(
+            '--format',
+            choices=['jsonl', 'csv'],
+            help='Input format (default: from the file extension, otherwise jsonl)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of rows saved per transaction'
+        )
+        parser.add_argument(
+            '--summary-audit',
+            action='store_true',
+            help='Record one summary change for the whole import instead of one per row'
+        )
+        parser.add_argument(
+            '--no-occurrences',
+            action='store_true',
+            help="Don't regenerate dated occurrences, run generate_occurrences --rebuild afterwards"
+        )
+
+    def handle(self, *args, **options):
+        source = options['input']
+        file_format = options['format'] or ('csv' if source.endswith('.csv') else 'jsonl')
+        read = read_csv if file_format == 'csv' else read_jsonl
+        importer = ScheduleImporter(
+            options['batch_size'], options['summary_audit'], source, occurrences=not options['no_occurrences']
+        )
+        started = time.perf_counter()
+
+        try:
+            if source == '-':
+                for row in read(sys.stdin):
+                    importer.add(row)
+            else:
+                with open(source, newline='', encoding='utf-8') as f:
+                    for row in read(f):
+                        importer.add(row)
+        except (OSError, ValueError) as e:
+            # Batches already saved stay saved, the file can simply be imported again
+            raise CommandError(f"Import of {source} stopped: {e}")
+        importer.finish()
+
+        elapsed = time.perf_counter() - started
+        total = sum(importer.created.values()) + sum(importer.updated.values()) + sum(importer.unchanged.values())
+        self.stdout.write(f"Imported {total} rows from {source} in {elapsed:.2f}s")
+        for label in importer.created:
+            self.stdout.write(
+                f"  {label}: {importer.created[label]} created, {importer.updated[label]} updated, "
+                f"{importer.unchanged[label]} unchanged"
+            )
+        if importer.skipped:
+            self.stdout.write(f"  skipped {importer.skipped} rows of other models")
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from pfa.models import ScheduleChange
+import datetime
+import logging
+
+logger = logging.getLogger('pfa')
+
+class Command(BaseCommand):
+    help = 'Deletes old schedule changes, clients synced before them get the whole week again'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.PFA_SCHEDULE_CHANGE_RETENTION_DAYS,
+            help='Keep changes from this many days (default: PFA_SCHEDULE_CHANGE_RETENTION_DAYS)'
+        )
+
+    def handle(self, *args, **options):
+        before = timezone.now() - datetime.timedelta(days=options['days'])
+        deleted = ScheduleChange.prune(before)
+        self.stdout.write(f"Pruned {deleted} schedule changes, pruned through version {ScheduleChange.pruned_version()}")
+        logger.info("SCHEDULE: Pruned %s schedule changes recorded before %s", deleted, before)
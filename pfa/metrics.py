@@ -0,0 +1,136 @@
+"""
+In-process request metrics.
+
+RequestLoggingMiddleware records every request's duration into a log-linear
+(HDR-style) histogram per route and status, together with the number of
+database queries it ran. Histograms have a fixed relative error (about 3%)
+and a bounded number of buckets, so memory stays flat however many requests
+are recorded. The /pfa/metrics endpoint renders them as plain text.
+"""
+import os
+import threading
+import time
+
+# 2**SUB_BUCKET_BITS linear sub-buckets per power of two, about 3% relative error
+SUB_BUCKET_BITS = 5
+SUB_BUCKET_MASK = (1 << SUB_BUCKET_BITS) - 1
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class LatencyHistogram:
+    """Log-linear histogram of non-negative integer values (microseconds here)."""
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    @staticmethod
+    def bucket_index(value):
+        if value <= SUB_BUCKET_MASK:
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS
+        return (shift << SUB_BUCKET_BITS) + (value >> shift)
+
+    @staticmethod
+    def bucket_value(index):
+        """Midpoint of the values that fall into a bucket."""
+        shift = index >> SUB_BUCKET_BITS
+        if shift == 0:
+            return index
+        low = (index & SUB_BUCKET_MASK) << shift
+        return low + ((1 << shift) - 1) / 2
+
+    def record(self, value, count=1):
+        value = max(0, int(value))
+        index = self.bucket_index(value)
+        self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, quantile):
+        """Approximate value at a quantile between 0 and 1."""
+        if not self.count:
+            return 0
+        target = max(1, round(quantile * self.count))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= target:
+                return min(self.bucket_value(index), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+
+class RouteStats:
+    """Latency histogram and query totals for one (route, status) pair."""
+
+    def __init__(self):
+        self.latency_us = LatencyHistogram()
+        self.db_queries = 0
+        self.db_queries_max = 0
+
+    def record(self, duration_us, queries):
+        self.latency_us.record(duration_us)
+        self.db_queries += queries
+        self.db_queries_max = max(self.db_queries_max, queries)
+
+
+class RequestMetrics:
+    """Per-process registry of RouteStats keyed by (route, status)."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.routes = {}
+        self._lock = threading.Lock()
+
+    def record(self, route, status, duration_ns, queries=0):
+        with self._lock:
+            stats = self.routes.get((route, status))
+            if stats is None:
+                stats = self.routes[(route, status)] = RouteStats()
+            stats.record(duration_ns // 1000, queries)
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.routes = {}
+
+    def render(self):
+        """Plain text exposition, one line per series."""
+        with self._lock:
+            routes = sorted(self.routes.items())
+            lines = [
+                f'# pfa request metrics for process {os.getpid()} since {int(self.started)}',
+                '# latency in milliseconds',
+            ]
+            for (route, status), stats in routes:
+                labels = f'route="{route}",status="{status}"'
+                latency = stats.latency_us
+                for quantile in QUANTILES:
+                    lines.append(
+                        f'pfa_request_duration_ms{{{labels},quantile="{quantile}"}} '
+                        f'{latency.percentile(quantile) / 1000:.3f}'
+                    )
+                lines.append(f'pfa_request_duration_ms_max{{{labels}}} {latency.max / 1000:.3f}')
+                lines.append(f'pfa_request_duration_ms_sum{{{labels}}} {latency.total / 1000:.3f}')
+                lines.append(f'pfa_request_count{{{labels}}} {latency.count}')
+                lines.append(f'pfa_request_db_queries_total{{{labels}}} {stats.db_queries}')
+                lines.append(f'pfa_request_db_queries_max{{{labels}}} {stats.db_queries_max}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = RequestMetrics()
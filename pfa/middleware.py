@@ -1,92 +1,115 @@
 import time
 import logging
 import json
+import random
+from django.conf import settings
 from django.utils.deprecation import MiddlewareMixin
+from .metrics import metrics
+from .profiling import QueryRecorder, profile
+from . import request_log
 
 logger = logging.getLogger('pfa')
 
 class RequestLoggingMiddleware(MiddlewareMixin):
-    """Middleware to log all requests and responses to the PFA app."""
+    """Middleware to time all requests and log requests and responses to the PFA app."""
     
     def process_request(self, request):
         """Set request start time and log incoming request."""
+        request.start_time_ns = time.perf_counter_ns()
+        
         # Only log requests to the PFA app
         if not request.path.startswith('/pfa'):
             return None
-            
-        request.start_time = time.time()
         
         # Extract request details
         user = request.user.username if request.user.is_authenticated else 'anonymous'
         method = request.method
         path = request.path
         query = dict(request.GET.items())
+        ip = request.META.get('REMOTE_ADDR')
+        
+        # In structured mode everything about the request goes into one record
+        if request_log.enabled():
+            request.log_token = request_log.begin(
+                method=method, path=path, user=user, ip=ip, query=query
+            )
+            return None
         
         # Log request
-        logger.info(
-            f"REQUEST: {method} {path} from user={user} "
-            f"ip={request.META.get('REMOTE_ADDR')} query={json.dumps(query)}"
-        )
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("REQUEST: %s %s from user=%s ip=%s query=%s", method, path, user, ip, json.dumps(query))
         return None
         
     def process_response(self, request, response):
-        """Log the response and timing."""
-        # Only log requests to the PFA app
-        if not request.path.startswith('/pfa'):
+        """Record the request in the latency histograms and log the PFA response."""
+        if not hasattr(request, 'start_time_ns'):
             return response
-            
+        
         # Calculate request duration
-        if hasattr(request, 'start_time'):
-            duration = time.time() - request.start_time
-            duration_ms = int(duration * 1000)
-            
-            # Only log status code and duration for PFA app responses
+        duration_ns = time.perf_counter_ns() - request.start_time_ns
+        
+        # Route names keep the number of series bounded, unlike raw paths
+        match = getattr(request, 'resolver_match', None)
+        route = match.view_name if match else 'unmatched'
+        recorder = getattr(request, 'query_recorder', None)
+        metrics.record(route, response.status_code, duration_ns, recorder.count if recorder else 0)
+        
+        # Emit the merged record for structured requests
+        token = getattr(request, 'log_token', None)
+        if token is not None:
+            request_log.note(status=response.status_code, duration_ms=round(duration_ns / 1_000_000, 3))
+            context = request_log.finish(token)
+            logger.info("%s %s %s", request.method, request.path, response.status_code, extra={'context': context})
+            return response
+        
+        # Only log status code and duration for PFA app responses
+        if request.path.startswith('/pfa'):
             logger.info(
-                f"RESPONSE: {request.method} {request.path} "
-                f"status={response.status_code} time={duration_ms}ms"
+                "RESPONSE: %s %s status=%s time=%sms",
+                request.method, request.path, response.status_code, duration_ns // 1_000_000
             )
             
         return response
 
 class DatabaseQueryLoggingMiddleware(MiddlewareMixin):
-    """Middleware to log database queries for PFA app."""
+    """Middleware to count database queries and profile a sample of requests."""
     
     def process_request(self, request):
-        """Enable query logging for PFA requests."""
-        # Only log queries for the PFA app
-        if not request.path.startswith('/pfa'):
-            return None
-        
+        """Install a query recorder, capturing SQL only for sampled requests."""
         from django.db import connection
-        connection.queries_log = []
-        connection.force_debug_cursor = True
+        
+        sampled = random.random() < settings.PFA_SQL_PROFILE_SAMPLE_RATE
+        request.query_recorder = QueryRecorder(capture=sampled)
+        connection.execute_wrappers.append(request.query_recorder)
         
         return None
         
     def process_response(self, request, response):
-        """Log database queries."""
-        # Only log queries for the PFA app
-        if not request.path.startswith('/pfa'):
+        """Log the query summary and profile over-budget sampled requests."""
+        recorder = getattr(request, 'query_recorder', None)
+        if recorder is None:
             return response
             
         from django.db import connection
         
-        if hasattr(connection, 'queries_log') and connection.queries_log:
-            total_time = 0
-            for query in connection.queries_log:
-                total_time += float(query.get('time', 0))
-                
-            # Only log summary of queries for PFA app
+        # Clean up
+        if recorder in connection.execute_wrappers:
+            connection.execute_wrappers.remove(recorder)
+        
+        # Only log summary of queries for PFA app
+        if getattr(request, 'log_token', None) is not None:
+            request_log.note(db_queries=recorder.count, db_ms=round(recorder.total_ms, 3))
+        elif request.path.startswith('/pfa') and recorder.count:
             logger.debug(
-                f"DB: {request.method} {request.path} - "
-                f"{len(connection.queries_log)} queries in {total_time:.2f}ms"
+                "DB: %s %s - %s queries in %.2fms",
+                request.method, request.path, recorder.count, recorder.total_ms
+            )
+        
+        if recorder.capture and recorder.count > settings.PFA_SQL_QUERY_BUDGET:
+            profile.record(recorder.statements)
+            logger.info(
+                "DB BUDGET EXCEEDED: %s %s - %s queries (budget %s)",
+                request.method, request.path, recorder.count, settings.PFA_SQL_QUERY_BUDGET
             )
             
-            # Log individual queries at trace level
-            for i, query in enumerate(connection.queries_log):
-                logger.debug(f"DB QUERY #{i+1}: {query.get('sql')} [{query.get('time')}ms]")
-                
-        # Clean up
-        connection.force_debug_cursor = False
-            
-        return response
\ No newline at end of file
+        return response
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:34
+
+from django.db import migrations, models
+
+# Mirrors ClassCategory.CATEGORY_BITS at the time of this migration
+CATEGORY_BITS = {
+    'Striking': 1,
+    'Grappling': 2,
+    'Fitness': 4,
+    'Lifestyle': 8,
+}
+
+
+def backfill_category_mask(apps, schema_editor):
+    Class = apps.get_model('pfa', 'Class')
+    ClassInstance = apps.get_model('pfa', 'ClassInstance')
+
+    masks = {}
+    memberships = Class.class_categories.through.objects.values_list('class_id', 'classcategory__category')
+    for class_id, category in memberships.iterator():
+        masks[class_id] = masks.get(class_id, 0) | CATEGORY_BITS.get(category, 0)
+
+    # One UPDATE per distinct mask rather than per row
+    classes_by_mask = {}
+    for class_id, mask in masks.items():
+        classes_by_mask.setdefault(mask, []).append(class_id)
+    for mask, class_ids in classes_by_mask.items():
+        ClassInstance.objects.filter(training_class__in=class_ids).update(category_mask=mask)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pfa', '0007_schedulechange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classinstance',
+            name='category_mask',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='classinstance',
+            index=models.Index(fields=['weekday', 'deleted', 'start_time'], name='pfa_ci_day_deleted_start_idx'),
+        ),
+        migrations.RunPython(backfill_category_mask, migrations.RunPython.noop),
+    ]
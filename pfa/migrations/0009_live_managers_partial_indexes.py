@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pfa', '0008_classinstance_category_mask'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='classinstance',
+            name='pfa_ci_day_deleted_start_idx',
+        ),
+        migrations.AddIndex(
+            model_name='class',
+            index=models.Index(condition=models.Q(('deleted', 0)), fields=['name'], name='pfa_class_live_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='classinstance',
+            index=models.Index(condition=models.Q(('deleted', 0)), fields=['weekday', 'start_time'], name='pfa_ci_live_day_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='classinstance',
+            index=models.Index(condition=models.Q(('deleted', 0)), fields=['training_class'], name='pfa_ci_live_class_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:47
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pfa', '0009_live_managers_partial_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='classinstance',
+            name='category_mask',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('action', models.CharField(choices=[('create', 'Create'), ('update', 'Update'), ('delete', 'Delete')], max_length=10)),
+                ('changes', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['model_name', 'object_id'], name='pfa_changelog_object_idx'), models.Index(fields=['created'], name='pfa_changelog_created_idx')],
+            },
+        ),
+    ]
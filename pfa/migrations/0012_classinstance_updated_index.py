@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pfa', '0011_auditwatermark'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='classinstance',
+            index=models.Index(fields=['updated'], name='pfa_ci_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pfa', '0013_bulk_import_actions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClassException',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('cancelled', models.BooleanField(default=False)),
+                ('start_time', models.TimeField(blank=True, null=True)),
+                ('end_time', models.TimeField(blank=True, null=True)),
+                ('note', models.CharField(blank=True, max_length=200)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('class_instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exceptions', to='pfa.classinstance')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('class_instance', 'date'), name='pfa_exception_instance_date_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ClassOccurrence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('start_time', models.TimeField()),
+                ('end_time', models.TimeField()),
+                ('cancelled', models.BooleanField(default=False)),
+                ('note', models.CharField(blank=True, max_length=200)),
+                ('class_instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occurrences', to='pfa.classinstance')),
+                ('training_class', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pfa.class')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date', 'start_time'], name='pfa_occurrence_date_start_idx')],
+                'constraints': [models.UniqueConstraint(fields=('class_instance', 'date'), name='pfa_occurrence_instance_date_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pfa', '0014_class_occurrences'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classinstance',
+            name='coach',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='classinstance',
+            name='room',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:18
+
+from django.db import migrations, models
+from django.db.models import F, Max
+
+
+def backfill_versions(apps, schema_editor):
+    """Existing changes keep their primary key as version, the counter starts after them"""
+    ScheduleChange = apps.get_model('pfa', 'ScheduleChange')
+    ScheduleVersion = apps.get_model('pfa', 'ScheduleVersion')
+    ScheduleChange.objects.update(version=F('pk'))
+    latest = ScheduleChange.objects.aggregate(latest=Max('pk'))['latest'] or 0
+    ScheduleVersion.objects.create(pk=1, version=latest)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pfa', '0015_classinstance_room_coach'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduleVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='schedulechange',
+            name='version',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='schedulechange',
+            index=models.Index(fields=['version'], name='pfa_schedulechange_version_idx'),
+        ),
+        migrations.RunPython(backfill_versions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pfa', '0016_schedule_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scheduleversion',
+            name='pruned',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:39
+
+from django.db import migrations, models
+from django.db.models import F, Max
+
+
+def backfill_sequences(apps, schema_editor):
+    """Existing rows keep their primary key as sequence, so watermarks stay valid"""
+    ChangeLog = apps.get_model('pfa', 'ChangeLog')
+    AuditWatermark = apps.get_model('pfa', 'AuditWatermark')
+    ChangeLog.objects.update(sequence=F('pk'))
+    latest = ChangeLog.objects.aggregate(latest=Max('pk'))['latest'] or 0
+    AuditWatermark.objects.update_or_create(name='changelog_sequence', defaults={'position': latest})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pfa', '0017_scheduleversion_pruned'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='changelog',
+            name='sequence',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='changelog',
+            index=models.Index(fields=['sequence'], name='pfa_changelog_sequence_idx'),
+        ),
+        migrations.RunPython(backfill_sequences, migrations.RunPython.noop),
+    ]
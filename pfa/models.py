@@ -1,10 +1,66 @@
-from django.db import models
-from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
 from django.dispatch import receiver
+from django.utils import timezone
+from . import occurrences, schedule
 import logging
 
 logger = logging.getLogger('pfa')
 
+# Default manager for soft-deletable models, use all_objects to include deleted rows
+class LiveManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted=0)
+
+
+# Remembers tracked field values as loaded, so saves are diffed without a query
+class TrackedFieldsMixin:
+    TRACKED_FIELDS = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {
+            name: value for name, value in zip(field_names, values) if name in cls.TRACKED_FIELDS
+        }
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        if fields is None:
+            self.reset_tracked_values()
+        elif hasattr(self, '_loaded_values'):
+            current = self.tracked_values()
+            for name in fields:
+                name = self._meta.get_field(name).attname
+                if name in current:
+                    self._loaded_values[name] = current[name]
+
+    def tracked_changes(self):
+        """{field: [old, new]} since the row was loaded, None if the old values aren't known"""
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return None
+        current = self.tracked_values()
+        if current.keys() - loaded.keys():
+            # A deferred field was assigned, its old value was never loaded
+            return None
+        return {name: [old, current[name]] for name, old in loaded.items() if current[name] != old}
+
+    def tracked_values(self):
+        # Through to_python, so '18:00' assigned in code compares equal to the loaded time.
+        # Deferred fields (.only()/.defer()) are skipped rather than loaded one query each.
+        deferred = self.get_deferred_fields()
+        return {
+            name: self._meta.get_field(name).to_python(getattr(self, name))
+            for name in self.TRACKED_FIELDS if name not in deferred
+        }
+
+    def reset_tracked_values(self):
+        self._loaded_values = self.tracked_values()
+
+
 # Categories of the classes
 class ClassCategory(models.Model):
     # Choice definition
@@ -15,6 +71,22 @@ class ClassCategory(models.Model):
         ("Lifestyle", "Lifestyle"),
     ]
 
+    # Bit of each category in ClassInstance.category_mask
+    CATEGORY_BITS = {
+        "Striking": 1,
+        "Grappling": 2,
+        "Fitness": 4,
+        "Lifestyle": 8,
+    }
+
+    # Colour of each category in the admin
+    CATEGORY_COLORS = {
+        "Striking": '#e74c3c',    # Red
+        "Grappling": '#3498db',   # Blue
+        "Fitness": '#27ae60',     # Green
+        "Lifestyle": '#f39c12',   # Orange
+    }
+
     # Table field definition
     category = models.CharField(max_length=10, choices=CLASS_CATEGORIES)
     created = models.DateTimeField(auto_now_add=True)
@@ -24,9 +96,24 @@ class ClassCategory(models.Model):
     def __str__(self):
         return self.category
 
+    @classmethod
+    def mask_for(cls, categories):
+        """Combine category names into a category_mask"""
+        mask = 0
+        for category in categories:
+            mask |= cls.CATEGORY_BITS.get(category, 0)
+        return mask
+
+    @classmethod
+    def names_for(cls, mask):
+        """Category names set in a category_mask, in CLASS_CATEGORIES order"""
+        return [category for category, bit in cls.CATEGORY_BITS.items() if mask & bit]
+
 
 # Training classes
-class Class(models.Model):
+class Class(TrackedFieldsMixin, models.Model):
+    TRACKED_FIELDS = ('name', 'deleted')
+
     # Table field definition
     class_categories = models.ManyToManyField(ClassCategory)
     name = models.CharField(max_length=100)
@@ -34,12 +121,23 @@ class Class(models.Model):
     updated = models.DateTimeField(auto_now=True)
     deleted = models.IntegerField(default=0)
 
+    # Managers
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['name'], condition=models.Q(deleted=0), name='pfa_class_live_name_idx'),
+        ]
+
     # Custom methods
     def __str__(self):
         return self.name
 
 
-class ClassInstance(models.Model):
+class ClassInstance(TrackedFieldsMixin, models.Model):
+    TRACKED_FIELDS = ('training_class_id', 'weekday', 'start_time', 'end_time', 'time_span', 'room', 'coach', 'deleted')
+
     # Choice definition
     DAY_OF_THE_WEEK = [
         ('1', "Monday"),
@@ -56,11 +154,30 @@ class ClassInstance(models.Model):
     weekday = models.CharField(max_length=10, choices=DAY_OF_THE_WEEK)
     start_time = models.TimeField()
     end_time = models.TimeField()
+    # Derived from start_time and end_time on save, see derive_time_span()
     time_span = models.IntegerField()
+    # Optional, overlapping slots only conflict when they share a room, coach or class
+    room = models.CharField(max_length=50, blank=True)
+    coach = models.CharField(max_length=50, blank=True)
+    # Denormalized copy of training_class.class_categories, see ClassCategory.CATEGORY_BITS
+    category_mask = models.PositiveSmallIntegerField(default=0, editable=False)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
     deleted = models.IntegerField(default=0)
 
+    # Managers
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        # Partial indexes, public queries only ever touch live rows
+        indexes = [
+            models.Index(fields=['weekday', 'start_time'], condition=models.Q(deleted=0), name='pfa_ci_live_day_start_idx'),
+            models.Index(fields=['training_class'], condition=models.Q(deleted=0), name='pfa_ci_live_class_idx'),
+            # Audit queries look back by modification time
+            models.Index(fields=['updated'], name='pfa_ci_updated_idx'),
+        ]
+
     def __str__(self):
         return f'{self.training_class} | {self.get_weekday_display()} | {self.start_time} - {self.end_time}'
     
@@ -68,78 +185,476 @@ class ClassInstance(models.Model):
         return dict(self.DAY_OF_THE_WEEK).get(self.weekday, "Unknown")
 
 
+def derive_time_span(start_time, end_time):
+    """Minutes from start to end, wrapping past midnight"""
+    start = start_time.hour * 60 + start_time.minute
+    end = end_time.hour * 60 + end_time.minute
+    return (end - start) % (24 * 60)
+
+
+# One-off change to a weekly slot on a given date, a cancellation or different times
+class ClassException(models.Model):
+    # Table field definition
+    class_instance = models.ForeignKey(ClassInstance, on_delete=models.CASCADE, related_name='exceptions')
+    date = models.DateField()
+    cancelled = models.BooleanField(default=False)
+    # Blank keeps the slot's own times
+    start_time = models.TimeField(null=True, blank=True)
+    end_time = models.TimeField(null=True, blank=True)
+    note = models.CharField(max_length=200, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['class_instance', 'date'], name='pfa_exception_instance_date_uniq'),
+        ]
+
+    # Custom methods
+    def __str__(self):
+        return f'{self.class_instance_id} | {self.date} | {"cancelled" if self.cancelled else "changed"}'
+
+
+# Dated classes expanded from the weekly slots, see pfa/occurrences.py
+class ClassOccurrence(models.Model):
+    # Table field definition
+    class_instance = models.ForeignKey(ClassInstance, on_delete=models.CASCADE, related_name='occurrences')
+    training_class = models.ForeignKey(Class, on_delete=models.CASCADE)
+    date = models.DateField()
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+    cancelled = models.BooleanField(default=False)
+    note = models.CharField(max_length=200, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date', 'start_time'], name='pfa_occurrence_date_start_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['class_instance', 'date'], name='pfa_occurrence_instance_date_uniq'),
+        ]
+
+    # Custom methods
+    def __str__(self):
+        return f'{self.date} | {self.start_time} - {self.end_time} | {self.class_instance_id}'
+
+
+# Single row counter of schedule versions. Bumping it locks the row until the
+# transaction commits, so versions become visible in commit order, which
+# autoincrement primary keys don't guarantee under concurrent writers.
+class ScheduleVersion(models.Model):
+    # Table field definition
+    version = models.BigIntegerField(default=0)
+    # Changes up to this version have been pruned, older clients reload everything
+    pruned = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f'v{self.version}'
+
+    @classmethod
+    def bump(cls):
+        """Next schedule version, call inside the transaction recording the change"""
+        counter, _ = cls.objects.select_for_update().get_or_create(pk=1)
+        counter.version += 1
+        counter.save(update_fields=['version'])
+        return counter.version
+
+
+# Append-only log of schedule changes, tagged with the version that committed them
+class ScheduleChange(models.Model):
+    # Choice definition
+    ACTIONS = [
+        ('upsert', "Upsert"),
+        ('delete', "Delete"),
+        # Bulk changes without per-row entries, clients reload everything
+        ('reset', "Reset"),
+    ]
+
+    # Table field definition
+    model_name = models.CharField(max_length=20, default='classinstance')
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTIONS)
+    version = models.BigIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['version'], name='pfa_schedulechange_version_idx'),
+        ]
+
+    # Custom methods
+    def __str__(self):
+        return f'v{self.version} | {self.action} {self.model_name}(pk={self.object_id})'
+
+    @classmethod
+    def current_version(cls):
+        """Latest committed schedule version, 0 before anything has been recorded"""
+        return ScheduleVersion.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+
+    @classmethod
+    def pruned_version(cls):
+        """Latest version whose changes have been pruned, 0 if none have"""
+        return ScheduleVersion.objects.filter(pk=1).values_list('pruned', flat=True).first() or 0
+
+    @classmethod
+    def prune(cls, before):
+        """Delete changes recorded before a datetime, returns how many were deleted"""
+        with transaction.atomic():
+            counter, _ = ScheduleVersion.objects.select_for_update().get_or_create(pk=1)
+            # Whole versions only, a client is either before the cut or after it
+            latest = cls.objects.filter(created__lt=before).aggregate(latest=models.Max('version'))['latest']
+            if latest is None or latest <= counter.pruned:
+                return 0
+            deleted, _ = cls.objects.filter(version__lte=latest).delete()
+            counter.pruned = latest
+            counter.save(update_fields=['pruned'])
+        return deleted
+
+    @classmethod
+    def record(cls, changes):
+        """Save unsaved ScheduleChange rows under one new version"""
+        changes = list(changes)
+        if not changes:
+            return
+        with transaction.atomic():
+            version = ScheduleVersion.bump()
+            for change in changes:
+                change.version = version
+            cls.objects.bulk_create(changes)
+
+
+# Append-only audit trail of pfa model changes, written in batches on commit.
+# Rows are numbered from a locked counter like ScheduleVersion, so readers can
+# follow sequence instead of the primary key, which isn't in commit order.
+class ChangeLog(models.Model):
+    # Choice definition
+    ACTIONS = [
+        ('create', "Create"),
+        ('update', "Update"),
+        ('delete', "Delete"),
+        # One summary row for a whole bulk import
+        ('import', "Import"),
+    ]
+
+    # AuditWatermark row holding the last sequence handed out
+    SEQUENCE = 'changelog_sequence'
+
+    # Table field definition
+    model_name = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTIONS)
+    # {field: [old, new]}, null when the old values weren't known
+    changes = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    sequence = models.BigIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['model_name', 'object_id'], name='pfa_changelog_object_idx'),
+            models.Index(fields=['created'], name='pfa_changelog_created_idx'),
+            models.Index(fields=['sequence'], name='pfa_changelog_sequence_idx'),
+        ]
+
+    # Custom methods
+    def __str__(self):
+        return f'{self.created} | {self.action} {self.model_name}(pk={self.object_id})'
+
+    @classmethod
+    def write(cls, entries):
+        """Insert unsaved rows numbered after every committed one"""
+        entries = list(entries)
+        if not entries:
+            return
+        with transaction.atomic():
+            # Locked until the transaction commits, like ScheduleVersion.bump()
+            counter, _ = AuditWatermark.objects.select_for_update().get_or_create(name=cls.SEQUENCE)
+            for entry in entries:
+                counter.position += 1
+                entry.sequence = counter.position
+            counter.save(update_fields=['position', 'updated'])
+            cls.objects.bulk_create(entries)
+
+
+# Where an incremental job got to, so the next run only reads what's new
+class AuditWatermark(models.Model):
+    # Table field definition
+    name = models.CharField(max_length=50, unique=True)
+    # Last processed position (a primary key or ChangeLog sequence), for jobs reading append-only tables
+    position = models.BigIntegerField(default=0)
+    # Last processed timestamp, for jobs reading by updated
+    timestamp = models.DateTimeField(null=True, blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    # Custom methods
+    def __str__(self):
+        return f'{self.name} | {self.position} | {self.timestamp}'
+
+
+class _ChangeBatch:
+    """ChangeLog rows logged in a row within one savepoint, inserted together on commit"""
+
+    def __init__(self):
+        self.entries = []
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        ChangeLog.write(self.entries)
+
+
+def log_change(model_name, object_id, action, changes=None):
+    """Queue a ChangeLog row, one INSERT per transaction (or savepoint) rather than per save"""
+    entry = ChangeLog(model_name=model_name, object_id=object_id, action=action, changes=changes)
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        ChangeLog.write([entry])
+        return
+
+    # Django drops the callbacks of a savepoint that rolls back, so a batch never
+    # spans savepoints. Only the latest batch is extended, batches run in logging order.
+    for savepoint_ids, callback, *_ in reversed(connection.run_on_commit):
+        if isinstance(callback, _ChangeBatch):
+            if not callback.done and savepoint_ids == set(connection.savepoint_ids):
+                callback.entries.append(entry)
+                return
+            break
+    batch = _ChangeBatch()
+    batch.entries.append(entry)
+    transaction.on_commit(batch)
+
+
+def invalidate_schedule():
+    """Drop the cached week schedule once the current transaction commits"""
+    transaction.on_commit(schedule.invalidate)
+
+
+def class_category_ids(class_ids):
+    """{class_id: sorted category ids} for some classes"""
+    current = {class_id: [] for class_id in class_ids}
+    for class_id, category_id in Class.class_categories.through.objects.filter(
+        class_id__in=current
+    ).order_by('classcategory_id').values_list('class_id', 'classcategory_id'):
+        current[class_id].append(category_id)
+    return current
+
+
+def category_class_ids(category):
+    """Ids of every class in a category, soft deleted ones included"""
+    return list(Class.class_categories.through.objects.filter(
+        classcategory=category
+    ).values_list('class_id', flat=True))
+
+
+def refresh_category_masks(class_ids):
+    """Recompute category_mask on the instances of the given classes"""
+    masks = dict.fromkeys(class_ids, 0)
+    memberships = Class.class_categories.through.objects.filter(
+        class_id__in=masks
+    ).values_list('class_id', 'classcategory__category')
+    for class_id, category in memberships:
+        masks[class_id] |= ClassCategory.CATEGORY_BITS.get(category, 0)
+
+    # One UPDATE per distinct mask rather than per class
+    classes_by_mask = {}
+    for class_id, mask in masks.items():
+        classes_by_mask.setdefault(mask, []).append(class_id)
+    now = timezone.now()
+    for mask, ids in classes_by_mask.items():
+        ClassInstance.all_objects.filter(training_class__in=ids).update(category_mask=mask, updated=now)
+
+
+class _Changes:
+    """Formats {field: [old, new]} only if the record is actually emitted"""
+
+    def __init__(self, changes):
+        self.changes = changes
+
+    def __str__(self):
+        if self.changes is None:
+            return 'unknown changes'
+        return ', '.join(f'{field}: {old} -> {new}' for field, (old, new) in self.changes.items())
+
+
+def record_instance_changes(instance_pks, action='upsert'):
+    """Bump the schedule version for the given ClassInstance rows"""
+    ScheduleChange.record(ScheduleChange(object_id=pk, action=action) for pk in instance_pks)
+
+
 # Signal handlers for logging model operations
 @receiver(pre_save, sender=ClassInstance)
 def log_class_instance_pre_save(sender, instance, **kwargs):
     """Log before saving a ClassInstance"""
-    if instance.pk:  # If this is an update
-        try:
-            old_instance = ClassInstance.objects.get(pk=instance.pk)
-            changes = []
-            
-            # Compare fields to find changes
-            if old_instance.training_class != instance.training_class:
-                changes.append(f"training_class: {old_instance.training_class} -> {instance.training_class}")
-            
-            if old_instance.weekday != instance.weekday:
-                changes.append(f"weekday: {old_instance.get_weekday_display()} -> {instance.get_weekday_display()}")
-            
-            if old_instance.start_time != instance.start_time:
-                changes.append(f"start_time: {old_instance.start_time} -> {instance.start_time}")
-            
-            if old_instance.end_time != instance.end_time:
-                changes.append(f"end_time: {old_instance.end_time} -> {instance.end_time}")
-            
-            logger.info(f"ABOUT TO UPDATE ClassInstance(pk={instance.pk}): {', '.join(changes)}")
-            
-        except ClassInstance.DoesNotExist:
-            logger.warning(f"Attempted to update ClassInstance(pk={instance.pk}) but it doesn't exist")
-    else:
-        # This is a new instance
-        logger.info(f"ABOUT TO CREATE ClassInstance: {instance.training_class} on {instance.get_weekday_display()} at {instance.start_time}-{instance.end_time}")
+    # Not on a .only() instance without the times, that would load them one query each
+    deferred = instance.get_deferred_fields() & {'start_time', 'end_time', 'time_span'}
+    if not deferred and instance.start_time and instance.end_time:
+        instance.time_span = derive_time_span(
+            ClassInstance._meta.get_field('start_time').to_python(instance.start_time),
+            ClassInstance._meta.get_field('end_time').to_python(instance.end_time),
+        )
+    changes = instance.tracked_changes()
+
+    # The mask only needs looking up when the instance is new or changes class
+    if instance._state.adding or changes is None or 'training_class_id' in changes:
+        instance.category_mask = ClassCategory.mask_for(
+            ClassCategory.objects.filter(class__pk=instance.training_class_id).values_list('category', flat=True)
+        )
+    
+    if instance._state.adding:
+        logger.info(
+            "ABOUT TO CREATE ClassInstance: class=%s on %s at %s-%s",
+            instance.training_class_id, instance.weekday, instance.start_time, instance.end_time
+        )
+    elif changes != {}:
+        logger.info("ABOUT TO UPDATE ClassInstance(pk=%s): %s", instance.pk, _Changes(changes))
 
 @receiver(post_save, sender=ClassInstance)
 def log_class_instance_post_save(sender, instance, created, **kwargs):
     """Log after saving a ClassInstance"""
     if created:
-        logger.info(f"CREATED ClassInstance(pk={instance.pk}): {instance}")
+        logger.info("CREATED ClassInstance(pk=%s)", instance.pk)
+        log_change('classinstance', instance.pk, 'create', {
+            name: [None, value] for name, value in instance.tracked_values().items()
+        })
     else:
-        logger.info(f"UPDATED ClassInstance(pk={instance.pk}): {instance}")
+        changes = instance.tracked_changes()
+        if changes == {}:
+            # Saved without changes, nothing to record or invalidate
+            return
+        logger.info("UPDATED ClassInstance(pk=%s)", instance.pk)
+        log_change('classinstance', instance.pk, 'update', changes)
+    instance.reset_tracked_values()
+    record_instance_changes([instance.pk])
+    occurrences.regenerate_on_commit([instance.pk])
+    invalidate_schedule()
 
 @receiver(pre_delete, sender=ClassInstance)
 def log_class_instance_pre_delete(sender, instance, **kwargs):
     """Log before deleting a ClassInstance"""
-    logger.info(f"ABOUT TO DELETE ClassInstance(pk={instance.pk}): {instance}")
+    logger.info("ABOUT TO DELETE ClassInstance(pk=%s)", instance.pk)
 
 @receiver(post_delete, sender=ClassInstance)
 def log_class_instance_post_delete(sender, instance, **kwargs):
     """Log after deleting a ClassInstance"""
-    logger.info(f"DELETED ClassInstance: {instance}")
+    logger.info(
+        "DELETED ClassInstance(pk=%s): class=%s on %s at %s-%s",
+        instance.pk, instance.training_class_id, instance.weekday, instance.start_time, instance.end_time
+    )
+    # The last known values stay behind as a tombstone
+    log_change('classinstance', instance.pk, 'delete', {
+        name: [value, None] for name, value in instance.tracked_values().items()
+    })
+    record_instance_changes([instance.pk], action='delete')
+    invalidate_schedule()
 
 # Similar signal handlers for Class model
 @receiver(pre_save, sender=Class)
 def log_class_pre_save(sender, instance, **kwargs):
-    if instance.pk:
-        try:
-            old_instance = Class.objects.get(pk=instance.pk)
-            if old_instance.name != instance.name:
-                logger.info(f"ABOUT TO UPDATE Class(pk={instance.pk}): name: {old_instance.name} -> {instance.name}")
-        except Class.DoesNotExist:
-            logger.warning(f"Attempted to update Class(pk={instance.pk}) but it doesn't exist")
+    if instance._state.adding:
+        logger.info("ABOUT TO CREATE Class: %s", instance.name)
     else:
-        logger.info(f"ABOUT TO CREATE Class: {instance.name}")
+        changes = instance.tracked_changes()
+        if changes != {}:
+            logger.info("ABOUT TO UPDATE Class(pk=%s): %s", instance.pk, _Changes(changes))
 
 @receiver(post_save, sender=Class)
 def log_class_post_save(sender, instance, created, **kwargs):
     if created:
-        logger.info(f"CREATED Class(pk={instance.pk}): {instance.name}")
+        logger.info("CREATED Class(pk=%s): %s", instance.pk, instance.name)
+        log_change('class', instance.pk, 'create', {
+            name: [None, value] for name, value in instance.tracked_values().items()
+        })
     else:
-        logger.info(f"UPDATED Class(pk={instance.pk}): {instance.name}")
+        changes = instance.tracked_changes()
+        if changes == {}:
+            return
+        logger.info("UPDATED Class(pk=%s): %s", instance.pk, instance.name)
+        log_change('class', instance.pk, 'update', changes)
+        # Instances embed the class name, so they change with it
+        if changes is None or 'name' in changes or 'deleted' in changes:
+            instance_ids = list(instance.classinstance_set.values_list('pk', flat=True))
+            record_instance_changes(instance_ids)
+            occurrences.regenerate_on_commit(instance_ids)
+    instance.reset_tracked_values()
+    invalidate_schedule()
 
 @receiver(pre_delete, sender=Class)
 def log_class_pre_delete(sender, instance, **kwargs):
-    logger.info(f"ABOUT TO DELETE Class(pk={instance.pk}): {instance.name}")
+    logger.info("ABOUT TO DELETE Class(pk=%s): %s", instance.pk, instance.name)
 
 @receiver(post_delete, sender=Class)
 def log_class_post_delete(sender, instance, **kwargs):
-    logger.info(f"DELETED Class: {instance.name}")
+    logger.info("DELETED Class: %s", instance.name)
+    log_change('class', instance.pk, 'delete', {
+        name: [value, None] for name, value in instance.tracked_values().items()
+    })
+    invalidate_schedule()
+
+@receiver(m2m_changed, sender=Class.class_categories.through)
+def log_class_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('pre_add', 'pre_remove', 'pre_clear'):
+        # Remember the memberships before, the ChangeLog records them as [old, new]
+        if not reverse:
+            class_ids = [instance.pk]
+        else:
+            class_ids = category_class_ids(instance) if action == 'pre_clear' else list(pk_set)
+        instance._category_ids_before = class_category_ids(class_ids)
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        logger.info("CATEGORIES CHANGED %s(pk=%s): %s %s", type(instance).__name__, instance.pk, action, sorted(pk_set or []))
+        before = instance._category_ids_before
+        changed = {instance.pk} if reverse else set(pk_set or [])
+        for class_id, old in before.items():
+            if action == 'post_add':
+                new = sorted(set(old) | changed)
+            elif action == 'post_remove' or reverse:
+                new = sorted(set(old) - changed)
+            else:
+                new = []
+            if new != old:
+                log_change('class', class_id, 'update', {'class_categories': [old, new]})
+        class_ids = list(before)
+        refresh_category_masks(class_ids)
+        record_instance_changes(ClassInstance.objects.filter(
+            training_class__in=class_ids
+        ).values_list('pk', flat=True))
+        invalidate_schedule()
+
+# Exceptions only touch the occurrences of their own slot
+@receiver(post_save, sender=ClassException)
+def log_class_exception_post_save(sender, instance, created, **kwargs):
+    logger.info(
+        "%s ClassException(pk=%s): ClassInstance(pk=%s) on %s",
+        'CREATED' if created else 'UPDATED', instance.pk, instance.class_instance_id, instance.date
+    )
+    occurrences.regenerate_on_commit([instance.class_instance_id])
+
+@receiver(post_delete, sender=ClassException)
+def log_class_exception_post_delete(sender, instance, **kwargs):
+    logger.info("DELETED ClassException(pk=%s): ClassInstance(pk=%s) on %s", instance.pk, instance.class_instance_id, instance.date)
+    occurrences.regenerate_on_commit([instance.class_instance_id])
+
+# Category changes affect which filters a class appears under
+@receiver(post_save, sender=ClassCategory)
+def log_class_category_post_save(sender, instance, created, **kwargs):
+    if not created:
+        class_ids = category_class_ids(instance)
+        refresh_category_masks(class_ids)
+        record_instance_changes(ClassInstance.objects.filter(
+            training_class__in=class_ids
+        ).values_list('pk', flat=True))
+    invalidate_schedule()
+
+@receiver(pre_delete, sender=ClassCategory)
+def log_class_category_pre_delete(sender, instance, **kwargs):
+    # Membership rows are gone by post_delete, so collect the affected classes first
+    instance._category_ids_before = class_category_ids(category_class_ids(instance))
+    record_instance_changes(ClassInstance.objects.filter(
+        training_class__in=list(instance._category_ids_before)
+    ).values_list('pk', flat=True))
+
+@receiver(post_delete, sender=ClassCategory)
+def log_class_category_post_delete(sender, instance, **kwargs):
+    # The cascade removes the memberships without an m2m_changed signal
+    for class_id, old in instance._category_ids_before.items():
+        log_change('class', class_id, 'update', {'class_categories': [old, [pk for pk in old if pk != instance.pk]]})
+    refresh_category_masks(list(instance._category_ids_before))
+    invalidate_schedule()
@@ -0,0 +1,119 @@
+"""
+Dated class occurrences.
+
+ClassInstance is a weekly template. ClassOccurrence holds its dated copies
+from today to PFA_OCCURRENCE_HORIZON_DAYS ahead, with ClassException
+cancellations and time changes applied. Calendar questions ("everything in
+the next 14 days") are then one scan of the (date, start_time) index.
+
+The model receivers regenerate only the slots a change touches, once the
+transaction commits. The generate_occurrences command rolls the horizon
+forward each day. Past occurrences are kept as history.
+"""
+import datetime
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger('pfa')
+
+
+def horizon():
+    """First and last date (exclusive) kept generated"""
+    today = timezone.localdate()
+    return today, today + datetime.timedelta(days=settings.PFA_OCCURRENCE_HORIZON_DAYS)
+
+
+def dates_for(weekday, start, end):
+    """Dates in [start, end) falling on a ClassInstance weekday ('1' is Monday)"""
+    offset = (int(weekday) - start.isoweekday()) % 7
+    date = start + datetime.timedelta(days=offset)
+    while date < end:
+        yield date
+        date += datetime.timedelta(days=7)
+
+
+def build(instances, start, end):
+    """Unsaved occurrences of the given live instances between two dates"""
+    from .models import ClassException, ClassOccurrence
+
+    exceptions = {
+        (exception.class_instance_id, exception.date): exception
+        for exception in ClassException.objects.filter(
+            class_instance__in=[instance.pk for instance in instances], date__gte=start, date__lt=end
+        )
+    }
+    occurrences = []
+    for instance in instances:
+        for date in dates_for(instance.weekday, start, end):
+            occurrence = ClassOccurrence(
+                class_instance_id=instance.pk, training_class_id=instance.training_class_id,
+                date=date, start_time=instance.start_time, end_time=instance.end_time,
+            )
+            exception = exceptions.get((instance.pk, date))
+            if exception:
+                occurrence.cancelled = exception.cancelled
+                occurrence.start_time = exception.start_time or occurrence.start_time
+                occurrence.end_time = exception.end_time or occurrence.end_time
+                occurrence.note = exception.note
+            occurrences.append(occurrence)
+    return occurrences
+
+
+def regenerate(instance_ids):
+    """Rebuild the upcoming occurrences of some ClassInstance rows"""
+    from .models import ClassInstance, ClassOccurrence
+
+    instance_ids = list(instance_ids)
+    if not instance_ids:
+        return
+    start, end = horizon()
+    instances = list(ClassInstance.objects.filter(pk__in=instance_ids, training_class__deleted=0))
+    with transaction.atomic():
+        # Deleted or soft deleted slots simply get nothing back
+        ClassOccurrence.objects.filter(class_instance__in=instance_ids, date__gte=start).delete()
+        ClassOccurrence.objects.bulk_create(build(instances, start, end), batch_size=1000)
+
+
+def regenerate_on_commit(instance_ids):
+    instance_ids = list(instance_ids)
+    transaction.on_commit(lambda: regenerate(instance_ids))
+
+
+def extend(days=None, batch_size=500):
+    """Generate every slot up to the horizon, returns how many occurrences were added"""
+    from .models import ClassInstance, ClassOccurrence
+
+    start, end = horizon()
+    if days is not None:
+        end = start + datetime.timedelta(days=days)
+    if start >= end:
+        return 0
+
+    # Slots regenerated by an edit can be ahead of the rest, so every slot gets
+    # the whole range and the unique (class_instance, date) skips what exists
+    upcoming = ClassOccurrence.objects.filter(date__gte=start, date__lt=end)
+    before = upcoming.count()
+    instances = ClassInstance.objects.filter(training_class__deleted=0).order_by('pk')
+    batch = []
+    for instance in instances.iterator(chunk_size=batch_size):
+        batch.append(instance)
+        if len(batch) >= batch_size:
+            ClassOccurrence.objects.bulk_create(build(batch, start, end), ignore_conflicts=True)
+            batch = []
+    if batch:
+        ClassOccurrence.objects.bulk_create(build(batch, start, end), ignore_conflicts=True)
+    added = upcoming.count() - before
+    logger.info("OCCURRENCES: generated %s occurrences from %s to %s", added, start, end)
+    return added
+
+
+def between(start, end):
+    """Occurrences from start to end (exclusive), in calendar order"""
+    from .models import ClassOccurrence
+
+    return ClassOccurrence.objects.filter(
+        date__gte=start, date__lt=end
+    ).select_related('training_class').order_by('date', 'start_time')
@@ -0,0 +1,126 @@
+"""
+Sampled SQL profiling.
+
+DatabaseQueryLoggingMiddleware counts queries on every request through a
+cheap execute wrapper, but only a sample of requests (PFA_SQL_PROFILE_SAMPLE_RATE)
+keep the SQL text. When a sampled request runs more queries than
+PFA_SQL_QUERY_BUDGET its statements are folded into the in-memory profile
+below, keyed by a normalized fingerprint. The admin SQL profile page shows
+the top offenders for the worker that serves it.
+"""
+import random
+import re
+import threading
+import time
+
+# Literals and placeholders collapse to ?, IN lists collapse to (...)
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%s|\?')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """Normalize a statement so queries differing only in values group together."""
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _IN_LIST.sub('(...)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+class StatementStats:
+    """Count, total and sampled durations for one fingerprint."""
+
+    def __init__(self, sample_size):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.samples = []
+        self.sample_size = sample_size
+
+    def add(self, duration_ms):
+        self.count += 1
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+
+        # Reservoir sampling keeps memory bounded while p95 stays representative
+        if len(self.samples) < self.sample_size:
+            self.samples.append(duration_ms)
+        else:
+            slot = random.randrange(self.count)
+            if slot < self.sample_size:
+                self.samples[slot] = duration_ms
+
+    @property
+    def mean_ms(self):
+        return self.total_ms / self.count if self.count else 0.0
+
+    @property
+    def p95_ms(self):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+class SQLProfile:
+    """Per-process aggregate of statements from over-budget sampled requests."""
+
+    def __init__(self, max_fingerprints=500, sample_size=200):
+        self.max_fingerprints = max_fingerprints
+        self.sample_size = sample_size
+        self.requests = 0
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, statements):
+        """Fold one request's (sql, duration_ms) pairs into the profile."""
+        with self._lock:
+            self.requests += 1
+            for sql, duration_ms in statements:
+                key = fingerprint(sql)
+                stats = self.stats.get(key)
+                if stats is None:
+                    # Stop tracking new shapes once full, known ones keep counting
+                    if len(self.stats) >= self.max_fingerprints:
+                        continue
+                    stats = self.stats[key] = StatementStats(self.sample_size)
+                stats.add(duration_ms)
+
+    def top(self, limit=25, order_by='total_ms'):
+        """Return the worst (fingerprint, stats) pairs, by total time by default."""
+        with self._lock:
+            items = list(self.stats.items())
+        items.sort(key=lambda item: getattr(item[1], order_by), reverse=True)
+        return items[:limit]
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.stats = {}
+
+
+profile = SQLProfile()
+
+
+class QueryRecorder:
+    """Execute wrapper that counts queries and, when sampled, keeps their SQL."""
+
+    def __init__(self, capture=False):
+        self.capture = capture
+        self.count = 0
+        self.total_ms = 0.0
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            self.count += 1
+            self.total_ms += duration_ms
+            if self.capture:
+                self.statements.append((sql, duration_ms))
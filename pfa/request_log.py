@@ -0,0 +1,73 @@
+"""
+Per-request structured logging for the pfa logger.
+
+With PFA_STRUCTURED_LOGGING on, RequestLoggingMiddleware opens a context for
+each /pfa request. The views and the timing and DB middlewares add fields
+to it with note(), and the middleware writes it out as one record when the
+response leaves, which JsonFormatter renders as a single JSON line.
+
+Without a context, note() falls back to a lazily formatted DEBUG line, so
+callers use the same API in both modes.
+"""
+import contextvars
+import json
+import logging
+
+from django.conf import settings
+
+logger = logging.getLogger('pfa')
+
+_current = contextvars.ContextVar('pfa_request_log', default=None)
+
+
+def enabled():
+    return settings.PFA_STRUCTURED_LOGGING
+
+
+def begin(**fields):
+    """Open the record for the current request, returns a token for finish()."""
+    return _current.set(dict(fields))
+
+
+def finish(token):
+    """Close the record for the current request and return its fields."""
+    fields = _current.get()
+    _current.reset(token)
+    return fields
+
+
+class _Fields:
+    """Formats key=value pairs only if the record is actually emitted."""
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def __str__(self):
+        return ' '.join(f'{key}={value}' for key, value in self.fields.items())
+
+
+def note(**fields):
+    """Attach fields to the current request record."""
+    context = _current.get()
+    if context is not None:
+        context.update(fields)
+    else:
+        logger.debug('%s', _Fields(fields))
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, merging the request context into the record."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'process': record.process,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'context', None) or {})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
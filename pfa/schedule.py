@@ -0,0 +1,269 @@
+"""
+Materialized weekly schedule for the public PFA page.
+
+The schedule only changes when an admin edits it, so instead of querying on
+every hit the whole week is loaded once per process, bucketed by weekday and
+category and sorted by start time. The model signal receivers in
+pfa/models.py call invalidate() whenever a class, instance or category
+changes, and the next read rebuilds the week.
+
+The whole week is also embedded in the page as a compact JSON payload, so
+script.js can switch day and category without another round trip.
+
+Every snapshot remembers the ScheduleChange version it was built from. Other
+worker processes do not see this process' signals, so the version is
+re-checked at most every PFA_SCHEDULE_REVALIDATE_SECONDS.
+
+For "what's on now / next" each weekday also gets a DayTimeline of sorted
+start and end minutes, searched with bisect. Admin edits are checked for
+overlaps against a ConflictIndex (pfa/conflicts.py) built on first use.
+"""
+import bisect
+import hashlib
+import itertools
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.utils.html import json_script
+
+logger = logging.getLogger('pfa')
+
+# Public category filters and the ClassCategory value they select
+FILTER_CATEGORIES = {
+    'striking': 'Striking',
+    'grappling': 'Grappling',
+}
+
+ALL_CATEGORIES = 'all'
+
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def minutes(value):
+    return value.hour * 60 + value.minute
+
+
+class DayTimeline:
+    """One weekday's classes as parallel arrays sorted by start minute."""
+
+    def __init__(self, segments, continued=()):
+        # continued are (0, end, entry) tails of classes that started the day before
+        segments = sorted(segments, key=lambda segment: segment[:2])
+        both = sorted(segments + list(continued), key=lambda segment: segment[:2])
+        self.starts = [start for start, _, _ in both]
+        self.ends = [end for _, end, _ in both]
+        self.entries = [entry for _, _, entry in both]
+        # Latest end among the first i segments, bounds the backwards scan in running()
+        self.max_ends = list(itertools.accumulate(self.ends, max))
+        # Only classes that really start today can be next
+        self.next_starts = [start for start, _, _ in segments]
+        self.next_entries = [entry for _, _, entry in segments]
+
+    def running(self, minute):
+        """Entries with start <= minute < end, in start order."""
+        found = []
+        index = bisect.bisect_right(self.starts, minute) - 1
+        while index >= 0 and self.max_ends[index] > minute:
+            if self.ends[index] > minute:
+                found.append(self.entries[index])
+            index -= 1
+        found.reverse()
+        return found
+
+    def upcoming(self, minute):
+        """Entries sharing the first start time after minute."""
+        index = bisect.bisect_right(self.next_starts, minute)
+        if index == len(self.next_starts):
+            return []
+        end = bisect.bisect_right(self.next_starts, self.next_starts[index])
+        return self.next_entries[index:end]
+
+
+class WeekSchedule:
+    """Immutable snapshot of the week, bucketed by weekday and category."""
+
+    def __init__(self, instances, version=0):
+        from .models import ClassCategory
+
+        self.version = version
+        self.days = {}
+        self.filter_bits = {key: ClassCategory.CATEGORY_BITS[category] for key, category in FILTER_CATEGORIES.items()}
+
+        for instance in instances:
+            # Precomputed for the admin grid, so templates never query categories per tile
+            instance.category_names = ClassCategory.names_for(instance.category_mask)
+            instance.primary_category = instance.category_names[0] if instance.category_names else None
+            instance.primary_color = ClassCategory.CATEGORY_COLORS.get(instance.primary_category)
+
+            buckets = self.days.setdefault(instance.weekday, {ALL_CATEGORIES: []})
+            buckets[ALL_CATEGORIES].append(instance)
+
+            for key, bit in self.filter_bits.items():
+                if instance.category_mask & bit:
+                    buckets.setdefault(key, []).append(instance)
+
+        # The page embeds the whole week, so one digest covers every filter
+        self.digest = self._digest(instances)
+        self.payload = self._payload(instances)
+        self.payload_script = json_script(self.payload, 'week-schedule')
+        self.entries = {entry['id']: entry for day in self.payload.values() for entry in day}
+        self.grid = self._grid()
+        self.timelines = self._timelines(instances)
+        self._conflict_index = None
+
+    @staticmethod
+    def _digest(instances):
+        """Digest of the week, changes with any edit, removal or deletion."""
+        # No Last-Modified: max(updated) doesn't move on deletes or when the default day rolls over
+        digest = hashlib.md5()
+        for instance in instances:
+            training_class = instance.training_class
+            digest.update(repr((
+                instance.pk, instance.updated.isoformat(), instance.category_mask,
+                training_class.pk, training_class.updated.isoformat(),
+            )).encode())
+        return digest.hexdigest()
+
+    def _payload(self, instances):
+        """Compact per-weekday class list that script.js filters client side."""
+        payload = {}
+        for instance in instances:
+            payload.setdefault(instance.weekday, []).append({
+                'id': instance.pk,
+                'day': instance.weekday,
+                'name': instance.training_class.name,
+                'start': instance.start_time.strftime('%H:%M'),
+                'end': instance.end_time.strftime('%H:%M'),
+                'span': instance.time_span,
+                'categories': [key for key, bit in self.filter_bits.items() if instance.category_mask & bit],
+            })
+        return payload
+
+    def _timelines(self, instances):
+        """Weekday number -> DayTimeline, classes past midnight continue on the next day."""
+        segments = {day: [] for day in range(1, 8)}
+        continued = {day: [] for day in range(1, 8)}
+        for instance in instances:
+            day = int(instance.weekday)
+            entry = self.entries[instance.pk]
+            start, end = minutes(instance.start_time), minutes(instance.end_time)
+            if end > start:
+                segments[day].append((start, end, entry))
+            elif end < start:
+                segments[day].append((start, MINUTES_PER_DAY, entry))
+                continued[day % 7 + 1].append((0, end, entry))
+        return {day: DayTimeline(segments[day], continued[day]) for day in segments}
+
+    def now_and_next(self, weekday, minute):
+        """(running entries, next entries, weekday of the next ones) at a weekday minute."""
+        running = self.timelines[weekday].running(minute)
+        # Nothing more today, the next class may be days away
+        for offset in range(8):
+            day = (weekday - 1 + offset) % 7 + 1
+            upcoming = self.timelines[day].upcoming(minute if offset == 0 else -1)
+            if upcoming:
+                return running, upcoming, day
+        return running, [], None
+
+    def conflict_index(self):
+        """ConflictIndex of the live week, built the first time it is needed."""
+        from .conflicts import ConflictIndex, slot_for
+
+        if self._conflict_index is None:
+            self._conflict_index = ConflictIndex(
+                slot_for(instance) for buckets in self.days.values() for instance in buckets[ALL_CATEGORIES]
+            )
+        return self._conflict_index
+
+    def _grid(self):
+        """Weekday name -> day number and classes, as used by the admin schedule pages."""
+        from .models import ClassInstance
+
+        return {
+            day_name: {
+                'day_num': day_num,
+                'classes': self.days.get(day_num, {}).get(ALL_CATEGORIES, []),
+            }
+            for day_num, day_name in ClassInstance.DAY_OF_THE_WEEK
+        }
+
+    @classmethod
+    def build(cls):
+        """Load the live week in one query, categories come from category_mask."""
+        from .models import ClassInstance, ScheduleChange
+
+        # Read the version first, the rows loaded below are at least this new
+        version = ScheduleChange.current_version()
+        instances = ClassInstance.objects.filter(
+            training_class__deleted=0
+        ).select_related('training_class').order_by('start_time')
+        return cls(list(instances), version)
+
+    def classes(self, weekday, category=ALL_CATEGORIES):
+        """Return the instances for a weekday, sorted by start time."""
+        buckets = self.days.get(str(weekday), {})
+        if category not in FILTER_CATEGORIES:
+            category = ALL_CATEGORIES
+        return buckets.get(category, [])
+
+    def etag(self, weekday, category=ALL_CATEGORIES):
+        """Return the ETag for the page rendered for a weekday and category."""
+        if category not in FILTER_CATEGORIES:
+            category = ALL_CATEGORIES
+        return f'{weekday}-{category}-{self.digest}'
+
+
+_lock = threading.Lock()
+_schedule = None
+_generation = 0
+_checked_at = 0.0
+
+
+def get_schedule():
+    """Return the current week, rebuilding it if it has been invalidated."""
+    global _schedule, _checked_at
+
+    schedule = _schedule
+    if schedule is not None:
+        if time.monotonic() - _checked_at < settings.PFA_SCHEDULE_REVALIDATE_SECONDS:
+            return schedule
+        return revalidate()
+
+    with _lock:
+        if _schedule is None:
+            generation = _generation
+            schedule = WeekSchedule.build()
+            # Only publish the snapshot if nothing changed while it was built
+            if generation == _generation:
+                _schedule = schedule
+                _checked_at = time.monotonic()
+            logger.debug("Schedule cache rebuilt at version %s", schedule.version)
+            return schedule
+        return _schedule
+
+
+def revalidate(version=None):
+    """Rebuild the cached week if the schedule version has moved past it."""
+    global _checked_at
+    from .models import ScheduleChange
+
+    schedule = _schedule
+    if version is None:
+        version = ScheduleChange.current_version()
+    _checked_at = time.monotonic()
+
+    if schedule is None or schedule.version < version:
+        invalidate()
+        return get_schedule()
+    return schedule
+
+
+def invalidate():
+    """Drop the cached week so the next read rebuilds it."""
+    global _schedule, _generation
+
+    _generation += 1
+    _schedule = None
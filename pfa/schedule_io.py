@@ -0,0 +1,316 @@
+"""
+Streaming import and export of the pfa schedule.
+
+Rows use Django's jsonl serialization shape, {"model", "pk", "fields"}, so the
+output of `dumpdata pfa --format jsonl` can be imported too. CSV files carry
+the same records with one column per field. Files are read and written one
+row at a time and saved in batches with bulk_create/bulk_update, so memory
+stays flat however large they get.
+
+Bulk saves don't send model signals. The importer writes the ChangeLog and
+ScheduleChange rows itself, either per row or as one summary record plus a
+schedule reset. Dated occurrences of every touched slot are regenerated once
+at the end rather than per batch, or not at all with occurrences=False (run
+generate_occurrences --rebuild afterwards).
+"""
+import csv
+import json
+import logging
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from . import occurrences
+from .models import (
+    ChangeLog, Class, ClassCategory, ClassInstance, ScheduleChange,
+    derive_time_span, invalidate_schedule, refresh_category_masks,
+)
+
+logger = logging.getLogger('pfa')
+
+# Fields per model, in the order the models have to be saved
+FIELDS = {
+    'pfa.classcategory': ('category',),
+    'pfa.class': ('name', 'deleted', 'class_categories'),
+    'pfa.classinstance': ('training_class', 'weekday', 'start_time', 'end_time', 'time_span', 'room', 'coach', 'deleted'),
+}
+
+MODELS = {
+    'pfa.classcategory': ClassCategory,
+    'pfa.class': Class,
+    'pfa.classinstance': ClassInstance,
+}
+
+CSV_COLUMNS = ['model', 'pk'] + list(dict.fromkeys(name for fields in FIELDS.values() for name in fields))
+
+
+def export_rows(chunk_size=2000):
+    """Yield a record for every schedule row, soft deleted ones included"""
+    for category in ClassCategory.objects.order_by('pk').iterator(chunk_size=chunk_size):
+        yield {'model': 'pfa.classcategory', 'pk': category.pk, 'fields': {'category': category.category}}
+
+    classes = Class.all_objects.prefetch_related('class_categories').order_by('pk')
+    for cls in classes.iterator(chunk_size=chunk_size):
+        yield {'model': 'pfa.class', 'pk': cls.pk, 'fields': {
+            'name': cls.name,
+            'deleted': cls.deleted,
+            'class_categories': sorted(category.pk for category in cls.class_categories.all()),
+        }}
+
+    instances = ClassInstance.all_objects.order_by('pk').values('pk', *FIELDS['pfa.classinstance'])
+    for values in instances.iterator(chunk_size=chunk_size):
+        pk = values.pop('pk')
+        yield {'model': 'pfa.classinstance', 'pk': pk, 'fields': values}
+
+
+def write_jsonl(stream, rows):
+    count = 0
+    for row in rows:
+        stream.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+        count += 1
+    return count
+
+
+def write_csv(stream, rows):
+    writer = csv.DictWriter(stream, CSV_COLUMNS)
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        flat = {'model': row['model'], 'pk': row['pk'], **row['fields']}
+        if 'class_categories' in flat:
+            flat['class_categories'] = ' '.join(str(pk) for pk in flat['class_categories'])
+        writer.writerow(flat)
+        count += 1
+    return count
+
+
+def read_jsonl(stream):
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def read_csv(stream):
+    for flat in csv.DictReader(stream):
+        model = flat.get('model', '').lower()
+        fields = {
+            name: flat[name] for name in FIELDS.get(model, ()) if flat.get(name) not in (None, '')
+        }
+        # An empty category list is still a list
+        if model == 'pfa.class' and flat.get('class_categories') is not None:
+            fields['class_categories'] = [int(pk) for pk in flat['class_categories'].split()]
+        yield {'model': model, 'pk': flat.get('pk') or None, 'fields': fields}
+
+
+class ScheduleImporter:
+    """Upserts records by primary key, batch_size rows per transaction"""
+
+    def __init__(self, batch_size=1000, summary_audit=False, source='', occurrences=True):
+        self.batch_size = batch_size
+        self.summary_audit = summary_audit
+        self.source = source
+        self.occurrences = occurrences
+        # Instances whose occurrences are regenerated by finish()
+        self.touched = set()
+        self.buffers = {label: [] for label in FIELDS}
+        self.buffered = 0
+        self.created = dict.fromkeys(FIELDS, 0)
+        self.updated = dict.fromkeys(FIELDS, 0)
+        self.unchanged = dict.fromkeys(FIELDS, 0)
+        self.skipped = 0
+        self.category_names = None
+        # category_mask of every class seen so far
+        self.masks = {}
+
+    def add(self, row):
+        label = str(row.get('model', '')).lower()
+        if label not in FIELDS:
+            self.skipped += 1
+            return
+        self.buffers[label].append(row)
+        self.buffered += 1
+        if self.buffered >= self.batch_size:
+            self.flush()
+
+    def finish(self):
+        self.flush()
+        if self.occurrences and self.touched:
+            touched, self.touched = sorted(self.touched), set()
+            for i in range(0, len(touched), self.batch_size):
+                occurrences.regenerate_on_commit(touched[i:i + self.batch_size])
+        if self.summary_audit and (any(self.created.values()) or any(self.updated.values())):
+            with transaction.atomic():
+                ChangeLog.write([ChangeLog(model_name='import', object_id=0, action='import', changes={
+                    'source': self.source, 'created': self.created, 'updated': self.updated,
+                })])
+                ScheduleChange.record([ScheduleChange(model_name='import', object_id=0, action='reset')])
+                invalidate_schedule()
+        logger.info(
+            "IMPORT: %s created %s, updated %s, unchanged %s, skipped %s",
+            self.source, self.created, self.updated, self.unchanged, self.skipped
+        )
+
+    def flush(self):
+        if not self.buffered:
+            return
+        with transaction.atomic():
+            audit, instance_ids, changed_class_ids = [], [], set()
+            for label in FIELDS:
+                rows, self.buffers[label] = self.buffers[label], []
+                if rows:
+                    self.save(label, rows, audit, instance_ids, changed_class_ids)
+
+            if changed_class_ids:
+                # Instances outside this batch follow their class too
+                refresh_category_masks(changed_class_ids)
+                instance_ids.extend(ClassInstance.all_objects.filter(
+                    training_class__in=changed_class_ids
+                ).values_list('pk', flat=True))
+            self.touched.update(instance_ids)
+            if not self.summary_audit:
+                ChangeLog.write(audit)
+                ScheduleChange.record(
+                    ScheduleChange(object_id=pk, action='upsert') for pk in dict.fromkeys(instance_ids)
+                )
+            invalidate_schedule()
+        self.buffered = 0
+
+    def save(self, label, rows, audit, instance_ids, changed_class_ids):
+        model = MODELS[label]
+        manager = getattr(model, 'all_objects', model.objects)
+        tracked = hasattr(model, 'tracked_changes')
+        now = timezone.now()
+
+        existing = manager.in_bulk([self.to_pk(model, row.get('pk')) for row in rows if row.get('pk')])
+        new, changed, memberships = [], [], []
+        update_fields = set()
+        for row in rows:
+            # Anything else, like the created/updated of a dumpdata file, is ignored
+            fields = {name: value for name, value in (row.get('fields') or {}).items() if name in FIELDS[label]}
+            category_ids = fields.pop('class_categories', None)
+            pk = self.to_pk(model, row.get('pk'))
+            obj = existing.get(pk)
+            if obj is None:
+                obj = model(pk=pk)
+                self.assign(obj, fields)
+                new.append(obj)
+            else:
+                # Diffed in memory, tracked models remember what they were loaded with
+                before = None if tracked else {name: getattr(obj, name) for name in fields}
+                self.assign(obj, fields)
+                if tracked:
+                    changes = obj.tracked_changes()
+                else:
+                    changes = {name: [old, getattr(obj, name)] for name, old in before.items() if getattr(obj, name) != old}
+                if changes:
+                    obj.updated = now
+                    changed.append((obj, changes))
+                    update_fields.update(self.field_names(model, fields))
+            if category_ids is not None:
+                memberships.append((obj, [int(pk) for pk in category_ids]))
+
+        if label == 'pfa.classinstance':
+            self.set_masks(new + [obj for obj, _ in changed])
+            update_fields.add('category_mask')
+
+        model.objects.bulk_create(new, batch_size=self.batch_size)
+        if changed:
+            # An upsert on the primary key, much cheaper than bulk_update's CASE per field
+            model.objects.bulk_create(
+                [obj for obj, _ in changed], batch_size=self.batch_size, update_conflicts=True,
+                unique_fields=['pk'], update_fields=sorted(update_fields | {'updated'}),
+            )
+        self.created[label] += len(new)
+        self.updated[label] += len(changed)
+        self.unchanged[label] += len(rows) - len(new) - len(changed)
+
+        changed_categories = {}
+        if label == 'pfa.classcategory':
+            self.category_names = None
+        elif label == 'pfa.class':
+            changed_categories = self.save_categories(memberships)
+            changed_class_ids.update(changed_categories)
+            changed_class_ids.update(
+                obj.pk for obj, changes in changed if 'name' in changes or 'deleted' in changes
+            )
+        else:
+            instance_ids.extend(obj.pk for obj in new)
+            instance_ids.extend(obj.pk for obj, _ in changed)
+
+        if tracked and not self.summary_audit:
+            name = model._meta.model_name
+            for obj in new:
+                audit.append(ChangeLog(model_name=name, object_id=obj.pk, action='create', changes={
+                    field: [None, value] for field, value in obj.tracked_values().items()
+                }))
+            for obj, changes in changed:
+                audit.append(ChangeLog(model_name=name, object_id=obj.pk, action='update', changes=changes))
+            for class_id, change in changed_categories.items():
+                audit.append(ChangeLog(model_name=name, object_id=class_id, action='update', changes={
+                    'class_categories': change,
+                }))
+
+    def save_categories(self, memberships):
+        """Replace changed class memberships, returns {class_id: [old, new]}"""
+        if not memberships:
+            return {}
+        through = Class.class_categories.through
+        wanted = {obj.pk: sorted(set(pks)) for obj, pks in memberships}
+        current = {class_id: [] for class_id in wanted}
+        for class_id, category_id in through.objects.filter(
+            class_id__in=wanted
+        ).order_by('classcategory_id').values_list('class_id', 'classcategory_id'):
+            current[class_id].append(category_id)
+
+        changed = {class_id: [current[class_id], pks] for class_id, pks in wanted.items() if current[class_id] != pks}
+        if changed:
+            through.objects.filter(class_id__in=changed).delete()
+            through.objects.bulk_create([
+                through(class_id=class_id, classcategory_id=category_id)
+                for class_id, (_, pks) in changed.items() for category_id in pks
+            ])
+
+        names = self.get_category_names()
+        for class_id, pks in wanted.items():
+            self.masks[class_id] = ClassCategory.mask_for(names.get(pk) for pk in pks)
+        return changed
+
+    def set_masks(self, instances):
+        missing = {obj.training_class_id for obj in instances} - set(self.masks)
+        if missing:
+            for class_id in missing:
+                self.masks[class_id] = 0
+            for class_id, category in Class.class_categories.through.objects.filter(
+                class_id__in=missing
+            ).values_list('class_id', 'classcategory__category'):
+                self.masks[class_id] |= ClassCategory.CATEGORY_BITS.get(category, 0)
+        for obj in instances:
+            obj.category_mask = self.masks[obj.training_class_id]
+
+    def get_category_names(self):
+        if self.category_names is None:
+            self.category_names = dict(ClassCategory.objects.values_list('pk', 'category'))
+        return self.category_names
+
+    @staticmethod
+    def to_pk(model, value):
+        return None if value in (None, '') else model._meta.pk.to_python(value)
+
+    @staticmethod
+    def field_names(model, fields):
+        return [model._meta.get_field(name).name for name in fields if name in {
+            field.name for field in model._meta.concrete_fields
+        }]
+
+    @staticmethod
+    def assign(obj, fields):
+        for name, value in fields.items():
+            field = obj._meta.get_field(name)
+            if field.is_relation:
+                setattr(obj, field.attname, None if value in (None, '') else field.target_field.to_python(value))
+            else:
+                setattr(obj, name, field.to_python(value))
+        if isinstance(obj, ClassInstance) and obj.start_time and obj.end_time:
+            obj.time_span = derive_time_span(obj.start_time, obj.end_time)
@@ -1,3 +1,1108 @@
-from django.test import TestCase
+import datetime
+import gzip
+import io
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import occurrences, request_log, schedule
+from .conflicts import ConflictIndex, IntervalIndex, Slot, check
+from .log_handlers import QueuedFileHandler
+from .management.commands.analyze_pfa_log import LogStats, line_time, seek_since
+from .metrics import LatencyHistogram
+from .models import AuditWatermark, ChangeLog, Class, ClassCategory, ClassException, ClassInstance, ClassOccurrence, ScheduleChange, log_change
+from .profiling import QueryRecorder, SQLProfile, fingerprint, profile
+from .schedule import MINUTES_PER_DAY, DayTimeline
+from .schedule_io import ScheduleImporter, export_rows, read_csv, read_jsonl, write_csv, write_jsonl
+
+
+class LatencyHistogramTests(SimpleTestCase):
+    def test_percentiles_within_relative_error(self):
+        values = list(range(1, 100001))
+        random.Random(1).shuffle(values)
+        histogram = LatencyHistogram()
+        for value in values:
+            histogram.record(value)
+        values.sort()
+        for quantile in (0.5, 0.9, 0.99):
+            exact = values[round(quantile * len(values)) - 1]
+            self.assertAlmostEqual(histogram.percentile(quantile), exact, delta=exact * 0.03)
+        self.assertEqual(histogram.max, 100000)
+        self.assertEqual(histogram.count, 100000)
+
+    def test_small_values_are_exact(self):
+        histogram = LatencyHistogram()
+        for value in (3, 1, 2):
+            histogram.record(value)
+        self.assertEqual(histogram.percentile(0.5), 2)
+        self.assertEqual(histogram.percentile(1), 3)
+        self.assertEqual(LatencyHistogram().percentile(0.5), 0)
+
+    def test_merge(self):
+        a, b, both = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+        for value in range(0, 5000, 7):
+            (a if value % 2 else b).record(value)
+            both.record(value)
+        a.merge(b)
+        self.assertEqual(a.buckets, both.buckets)
+        self.assertEqual((a.count, a.total, a.max), (both.count, both.total, both.max))
+
+
+def legacy_request(time, thread, path, query, status, duration_ms, queries):
+    return (
+        f"2025-01-31 {time},000 INFO middleware 100 {thread} REQUEST: GET {path} from user=anonymous ip=127.0.0.1 query={json.dumps(query)}\n"
+        f"2025-01-31 {time},001 DEBUG middleware 100 {thread} DB: GET {path} - {queries} queries in 1.50ms\n"
+        f"2025-01-31 {time},002 INFO middleware 100 {thread} RESPONSE: GET {path} status={status} time={duration_ms}ms\n"
+    )
+
+
+class AnalyzePfaLogTests(SimpleTestCase):
+    def write_log(self, text):
+        f = tempfile.NamedTemporaryFile('w', suffix='.log', delete=False)
+        self.addCleanup(os.unlink, f.name)
+        with f:
+            f.write(text)
+        return f.name
+
+    def analyze(self, path, *args):
+        out = io.StringIO()
+        call_command('analyze_pfa_log', path, '--no-rotated', '--format', 'json', *args, stdout=out)
+        return json.loads(out.getvalue())
+
+    def test_legacy_and_json_lines(self):
+        structured = {
+            'time': '2025-01-31 10:00:05,000', 'message': 'GET /pfa/ 200', 'method': 'GET', 'path': '/pfa/',
+            'query': {'day': '2'}, 'db_queries': 4, 'status': 200, 'duration_ms': 30.0,
+        }
+        path = self.write_log(
+            legacy_request('10:00:00', 1, '/pfa/', {'day': '1', 'category': 'striking'}, 200, 10, 2)
+            # Interleaved with another thread and a traceback
+            + legacy_request('10:00:01', 2, '/pfa/', {}, 500, 90, 7)
+            + "Traceback (most recent call last):\n  File \"x.py\", line 1\n"
+            + json.dumps(structured) + "\n"
+            + '{"time": "2025-01-31 10:00:06,000", "message": "Schedule cache rebuilt"}\n'
+        )
+        report = self.analyze(path)
+        self.assertEqual(report['requests'], 3)
+        routes = {(route['path'], route['status']): route for route in report['routes']}
+        self.assertEqual(routes['/pfa/', 200]['count'], 2)
+        self.assertEqual(routes['/pfa/', 200]['db_queries_max'], 4)
+        self.assertEqual(routes['/pfa/', 500]['db_queries_mean'], 7)
+        self.assertEqual(report['slowest'][0]['duration_ms'], 90)
+        filters = {(row['day'], row['category']): row['count'] for row in report['filters']}
+        self.assertEqual(filters, {('1', 'striking'): 1, ('2', '-'): 1})
+
+    def test_since_and_until(self):
+        lines = ''.join(
+            legacy_request(f'10:{minute:02d}:00', 1, '/pfa/', {}, 200, minute, 1) for minute in range(60)
+        )
+        path = self.write_log(lines)
+        report = self.analyze(path, '--since', '2025-01-31T10:15', '--until', '2025-01-31T10:44:30')
+        self.assertEqual(report['requests'], 30)
+        self.assertEqual((report['first'], report['last']), ('2025-01-31 10:15:00,002', '2025-01-31 10:44:00,002'))
+        self.assertEqual(self.analyze(path, '--since', '2025-01-31T10:15', '--mmap')['requests'], 45)
+
+    def test_seek_since_lands_before_the_first_match(self):
+        lines = [f"2025-01-31 {second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d},000 INFO x 1 1 line\n"
+                 for second in range(0, 86400, 3)]
+        data = ''.join(lines).encode()
+        with tempfile.TemporaryFile() as f:
+            f.write(data)
+            for since in ('2025-01-31 00:00:00,000', '2025-01-31 13:20:01,000', '2025-01-31 23:59:50,000'):
+                seek_since(f, len(data), since)
+                skipped = data[:f.tell()].count(b'\n')
+                # Never past the first match, and within one 4KB block of it
+                first = next(i for i, line in enumerate(lines) if line[:23] >= since)
+                self.assertLessEqual(skipped, first)
+                self.assertLess(len(''.join(lines[skipped:first])), 4096 + len(lines[0]))
+
+    def test_line_time(self):
+        self.assertEqual(line_time(b'2025-01-31 10:00:00,123 INFO x'), '2025-01-31 10:00:00,123')
+        self.assertEqual(line_time(b'{"time": "2025-01-31 10:00:00,123", "level": "INFO"}'), '2025-01-31 10:00:00,123')
+        self.assertIsNone(line_time(b'  File "x.py", line 1'))
+
+    def test_slowest_are_kept_in_bounded_memory(self):
+        stats = LogStats(slow_count=3)
+        for duration in (5, 50, 1, 40, 30, 2):
+            stats.add('t', 'GET', '/pfa/', 200, duration, 1, None)
+        self.assertEqual([entry['duration_ms'] for entry in stats.as_dict()['slowest']], [50, 40, 30])
+
+
+class SQLProfileTests(TestCase):
+    def setUp(self):
+        profile.reset()
+        self.addCleanup(profile.reset)
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id IN (1, 2,3) AND name = 'it''s'\n  AND x = %s"),
+            'SELECT * FROM t WHERE id IN (...) AND name = ? AND x = ?',
+        )
+
+    @override_settings(PFA_SQL_PROFILE_SAMPLE_RATE=1, PFA_SQL_QUERY_BUDGET=0)
+    def test_sampled_request_over_budget(self):
+        self.client.get(reverse('pfa_schedule_api'))
+        self.assertEqual(profile.requests, 1)
+        self.assertTrue(profile.top())
+
+    @override_settings(PFA_SQL_PROFILE_SAMPLE_RATE=0, PFA_SQL_QUERY_BUDGET=0)
+    def test_nothing_recorded_at_rate_zero(self):
+        self.client.get(reverse('pfa_schedule_api'))
+        self.assertEqual(profile.requests, 0)
+        self.assertEqual(profile.top(), [])
+
+    @override_settings(PFA_SQL_PROFILE_SAMPLE_RATE=1, PFA_SQL_QUERY_BUDGET=1000)
+    def test_within_budget(self):
+        self.client.get(reverse('pfa_schedule_api'))
+        self.assertEqual(profile.requests, 0)
+
+    def test_recorder_only_keeps_sql_when_sampled(self):
+        for capture in (False, True):
+            recorder = QueryRecorder(capture=capture)
+            with connection.execute_wrapper(recorder):
+                Class.objects.count()
+                Class.objects.count()
+            self.assertEqual(recorder.count, 2)
+            self.assertEqual(len(recorder.statements), 2 if capture else 0)
+
+    def test_fingerprints_are_capped(self):
+        capped = SQLProfile(max_fingerprints=2)
+        capped.record([('SELECT a', 1.0), ('SELECT b', 2.0), ('SELECT c', 3.0), ('SELECT a', 4.0)])
+        self.assertEqual([(key, stats.count, stats.total_ms) for key, stats in capped.top()], [('SELECT a', 2, 5.0), ('SELECT b', 1, 2.0)])
+
+
+class QueuedFileHandlerTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.path = os.path.join(self.directory, 'pfa.log')
+
+    def handler(self, **kwargs):
+        handler = QueuedFileHandler(self.path, **kwargs)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self.addCleanup(handler.close)
+        return handler
+
+    def log(self, handler, msg, *args):
+        handler.handle(logging.makeLogRecord({'msg': msg, 'args': args, 'levelno': logging.INFO, 'levelname': 'INFO'}))
+
+    def read(self, path=None):
+        with open(path or self.path) as f:
+            return f.read().splitlines()
+
+    def test_close_drains_the_queue(self):
+        handler = self.handler()
+        # Queued before the writer starts, like records logged during startup
+        self.log(handler, 'line %s', 0)
+        handler.start()
+        values = [1]
+        self.log(handler, 'line %s', values)
+        # The message is resolved when logged, not when written
+        values.append(2)
+        for number in range(2, 100):
+            self.log(handler, 'line %s', number)
+        handler.close()
+        self.assertEqual(self.read(), ['line 0', 'line [1]'] + [f'line {number}' for number in range(2, 100)])
+
+    def test_flushed_after_each_batch(self):
+        handler = self.handler()
+        handler.start()
+        self.log(handler, 'first')
+        deadline = time.monotonic() + 5
+        while not (os.path.exists(self.path) and self.read()) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.read(), ['first'])
+
+    def test_full_queue_drops_records(self):
+        handler = self.handler(queue_size=2)
+        for number in range(5):
+            self.log(handler, 'line %s', number)
+        self.assertEqual(handler.dropped, 3)
+        handler.start()
+        handler.close()
+        self.assertEqual(self.read(), ['line 0', 'line 1', 'Log queue full, dropped 3 records (3 total)'])
+
+    def test_gzip_rotation(self):
+        handler = self.handler(max_bytes=100, backup_count=2, compress=True, batch_size=1)
+        handler.start()
+        for number in range(30):
+            self.log(handler, 'line %02d', number)
+        handler.close()
+        self.assertEqual(sorted(os.listdir(self.directory)), ['pfa.log', 'pfa.log.1.gz', 'pfa.log.2.gz'])
+        with gzip.open(self.path + '.1.gz', 'rt') as f:
+            rotated = f.read().splitlines()
+        self.assertTrue(rotated)
+        # The newest rotated file runs straight into the current one
+        self.assertEqual(int(rotated[-1].split()[1]) + 1, int(self.read()[0].split()[1]))
+        self.assertEqual(self.read()[-1], 'line 29')
+
+
+@override_settings(PFA_STRUCTURED_LOGGING=True)
+class StructuredRequestLogTests(TestCase):
+    def setUp(self):
+        self.addCleanup(schedule.invalidate)
+
+    def get(self, url, **params):
+        with self.assertLogs('pfa', 'INFO') as logs:
+            response = self.client.get(url, params)
+        records = [record for record in logs.records if hasattr(record, 'context')]
+        self.assertEqual(len(records), 1)
+        self.assertIsNone(request_log._current.get())
+        return response, records[0]
+
+    def test_one_record_per_request(self):
+        response, record = self.get(reverse('pfa'), day=2, category='striking')
+        context = record.context
+        self.assertEqual((context['method'], context['path'], context['status']), ('GET', '/pfa/', 200))
+        self.assertEqual((context['view'], context['day'], context['category']), ('pfa', 2, 'striking'))
+        self.assertEqual(context['query'], {'day': '2', 'category': 'striking'})
+        self.assertIn('duration_ms', context)
+        self.assertIn('db_queries', context)
+
+        # Nothing carries over into the next request
+        _, record = self.get(reverse('pfa_now_api'), day=1, at='10:00')
+        self.assertNotIn('view', record.context)
+        self.assertEqual(record.context['path'], '/pfa/api/now')
+
+    def test_json_line(self):
+        _, record = self.get(reverse('pfa_now_api'), day=1, at='10:00')
+        entry = json.loads(request_log.JsonFormatter().format(record))
+        self.assertEqual(entry['message'], 'GET /pfa/api/now 200')
+        self.assertEqual(entry['status'], 200)
+
+    def test_note_without_a_request(self):
+        with self.assertLogs('pfa', 'DEBUG') as logs:
+            request_log.note(day=1, category='all')
+        self.assertEqual(logs.output, ['DEBUG:pfa:day=1 category=all'])
+
+
+class ScheduleImporterTests(TestCase):
+    def setUp(self):
+        self.striking = ClassCategory.objects.create(category='Striking')
+        self.grappling = ClassCategory.objects.create(category='Grappling')
+
+    def rows(self, name='Boxing', end_time='19:00', categories=None):
+        return [
+            {'model': 'pfa.class', 'pk': 900, 'fields': {
+                'name': name, 'deleted': 0,
+                'class_categories': [self.striking.pk] if categories is None else categories,
+            }},
+            {'model': 'pfa.classinstance', 'pk': 901, 'fields': {
+                'training_class': 900, 'weekday': '1', 'start_time': '18:00', 'end_time': end_time,
+                'time_span': 0, 'room': 'Mat 1', 'coach': 'Sam', 'deleted': 0,
+            }},
+            {'model': 'auth.user', 'pk': 1, 'fields': {}},
+        ]
+
+    def run_import(self, rows, **kwargs):
+        importer = ScheduleImporter(batch_size=2, **kwargs)
+        with self.captureOnCommitCallbacks(execute=True):
+            for row in rows:
+                importer.add(row)
+            importer.finish()
+        return importer
+
+    def test_create_then_upsert(self):
+        importer = self.run_import(self.rows())
+        self.assertEqual(importer.created, {'pfa.classcategory': 0, 'pfa.class': 1, 'pfa.classinstance': 1})
+        self.assertEqual(importer.skipped, 1)
+        instance = ClassInstance.objects.get(pk=901)
+        self.assertEqual(instance.time_span, 60)
+        self.assertEqual(instance.category_mask, ClassCategory.CATEGORY_BITS['Striking'])
+        self.assertTrue(ClassOccurrence.objects.filter(class_instance=instance).exists())
+
+        logged = ChangeLog.objects.count()
+        importer = self.run_import(self.rows())
+        self.assertEqual(importer.unchanged, {'pfa.classcategory': 0, 'pfa.class': 1, 'pfa.classinstance': 1})
+        self.assertEqual(ChangeLog.objects.count(), logged)
+
+        version = ScheduleChange.current_version()
+        importer = self.run_import(self.rows(end_time='19:30', categories=[self.striking.pk, self.grappling.pk]))
+        self.assertEqual(importer.updated, {'pfa.classcategory': 0, 'pfa.class': 0, 'pfa.classinstance': 1})
+        instance.refresh_from_db()
+        self.assertEqual(instance.time_span, 90)
+        self.assertEqual(instance.category_mask, ClassCategory.mask_for(['Striking', 'Grappling']))
+        self.assertEqual(
+            ChangeLog.objects.filter(model_name='class', object_id=900, action='update').latest('pk').changes,
+            {'class_categories': [[self.striking.pk], [self.striking.pk, self.grappling.pk]]},
+        )
+        self.assertEqual(
+            ChangeLog.objects.get(model_name='classinstance', object_id=901, action='update').changes,
+            {'end_time': ['19:00:00', '19:30:00'], 'time_span': [60, 90]},
+        )
+        self.assertEqual(
+            list(ScheduleChange.objects.filter(version__gt=version).values_list('object_id', 'action')),
+            [(901, 'upsert')],
+        )
+
+    def test_summary_audit(self):
+        self.run_import(self.rows(), summary_audit=True, source='schedule.jsonl')
+        self.assertEqual(
+            list(ChangeLog.objects.values_list('model_name', 'action')), [('import', 'import')]
+        )
+        self.assertEqual(ScheduleChange.objects.latest('version').action, 'reset')
+
+    def test_round_trip(self):
+        self.run_import(self.rows())
+        for write, read in ((write_jsonl, read_jsonl), (write_csv, read_csv)):
+            stream = io.StringIO()
+            count = write(stream, export_rows())
+            stream.seek(0)
+            importer = self.run_import(read(stream))
+            self.assertEqual(sum(importer.unchanged.values()), count)
+            self.assertEqual(sum(importer.created.values()) + sum(importer.updated.values()), 0)
+
+
+class DayTimelineTests(SimpleTestCase):
+    def test_matches_brute_force(self):
+        rng = random.Random(2)
+        segments = []
+        for i in range(300):
+            start = rng.randrange(0, MINUTES_PER_DAY - 1)
+            segments.append((start, rng.randrange(start + 1, min(start + 240, MINUTES_PER_DAY) + 1), i))
+        continued = [(0, rng.randrange(1, 180), 300 + i) for i in range(10)]
+        timeline = DayTimeline(segments, continued)
+        both = sorted(segments + continued, key=lambda segment: segment[:2])
+        starts = sorted({start for start, _, _ in segments})
+        for minute in range(-1, MINUTES_PER_DAY):
+            running = [entry for start, end, entry in both if start <= minute < end]
+            self.assertEqual(timeline.running(minute), running)
+            later = [start for start in starts if start > minute]
+            upcoming = sorted(
+                (segment for segment in segments if later and segment[0] == later[0]), key=lambda segment: segment[:2]
+            )
+            self.assertEqual(timeline.upcoming(minute), [entry for _, _, entry in upcoming])
+
+    def test_empty_day(self):
+        timeline = DayTimeline([])
+        self.assertEqual((timeline.running(600), timeline.upcoming(600)), ([], []))
+
+
+class NowApiTests(TestCase):
+    def setUp(self):
+        self.addCleanup(schedule.invalidate)
+        late = Class.objects.create(name='Late Rolling')
+        morning = Class.objects.create(name='Morning Boxing')
+        self.late = ClassInstance.objects.create(
+            training_class=late, weekday='7', start_time=datetime.time(23), end_time=datetime.time(1), time_span=0
+        )
+        self.morning = ClassInstance.objects.create(
+            training_class=morning, weekday='1', start_time=datetime.time(6), end_time=datetime.time(7), time_span=0
+        )
+        schedule.invalidate()
+
+    def now(self, day, at):
+        response = self.client.get(reverse('pfa_now_api'), {'day': day, 'at': at})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        return [entry['id'] for entry in body['now']], [entry['id'] for entry in body['next']], body['next_day']
+
+    def test_running_and_next(self):
+        self.assertEqual(self.now(1, '06:30'), ([self.morning.pk], [self.late.pk], 7))
+        self.assertEqual(self.now(1, '05:59'), ([], [self.morning.pk], 1))
+
+    def test_past_midnight(self):
+        self.assertEqual(self.now(7, '23:30'), ([self.late.pk], [self.morning.pk], 1))
+        # Sunday's class is still running on Monday morning
+        self.assertEqual(self.now(1, '00:30'), ([self.late.pk], [self.morning.pk], 1))
+        self.assertEqual(self.now(1, '01:00'), ([], [self.morning.pk], 1))
+
+    def test_bad_parameters(self):
+        for params in ({'day': 8}, {'day': 'x'}, {'at': '25:00'}):
+            self.assertEqual(self.client.get(reverse('pfa_now_api'), params).status_code, 400)
+
+
+def slot(key, weekday, start, end, training_class_id=1, room='', coach=''):
+    return Slot(key, f'Class {key}', weekday, start, end, training_class_id, room, coach)
+
+
+class ConflictIndexTests(SimpleTestCase):
+    def test_interval_index_matches_brute_force(self):
+        rng = random.Random(3)
+        intervals = []
+        for i in range(500):
+            start = rng.randrange(0, 1400)
+            intervals.append((start, start + rng.randrange(1, 200), i))
+        index = IntervalIndex(intervals)
+        for _ in range(500):
+            start = rng.randrange(0, 1500)
+            end = start + rng.randrange(1, 120)
+            expected = {item for item_start, item_end, item in intervals if item_start < end and item_end > start}
+            self.assertEqual(set(index.overlapping(start, end)), expected)
+        self.assertEqual(IntervalIndex([]).overlapping(0, 100), [])
+
+    def test_dimensions(self):
+        index = ConflictIndex([
+            slot(1, 1, 600, 660, training_class_id=1, room='Mat 1', coach='Sam'),
+            slot(2, 1, 630, 690, training_class_id=2, room=' mat 1', coach=''),
+            slot(3, 1, 630, 690, training_class_id=3, room='Mat 2', coach='sam'),
+            slot(4, 1, 630, 690, training_class_id=4, room='', coach=''),
+            slot(5, 1, 660, 720, training_class_id=1, room='Mat 1', coach='Sam'),
+            slot(6, 2, 600, 660, training_class_id=1, room='Mat 1', coach='Sam'),
+        ])
+        found = {other.key: matched for other, matched in index.conflicts(slot(1, 1, 600, 660, 1, 'Mat 1', 'Sam'))}
+        # Blank rooms and coaches never conflict, touching intervals don't overlap
+        self.assertEqual(found, {2: ['room'], 3: ['coach']})
+        found = {other.key: matched for other, matched in index.conflicts(slot(7, 1, 640, 670, 1, 'Mat 1', 'Sam'))}
+        self.assertEqual(found, {1: ['training_class_id', 'room', 'coach'], 2: ['room'], 3: ['coach'],
+                                 5: ['training_class_id', 'room', 'coach']})
+
+    def test_past_midnight(self):
+        index = ConflictIndex([slot(1, 1, 30, 90, training_class_id=1, coach='Sam')])
+        sunday = slot(2, 7, 23 * 60, 25 * 60, training_class_id=2, coach='Sam')
+        self.assertEqual([(other.key, matched) for other, matched in index.conflicts(sunday)], [(1, ['coach'])])
+        self.assertEqual(ConflictIndex([sunday]).conflicts(slot(3, 1, 30, 120, 3, coach='Sam'))[0][0].key, 2)
+        self.assertEqual(ConflictIndex([sunday]).conflicts(slot(3, 1, 30, 120, 3, coach='Alex')), [])
+
+    def test_check(self):
+        index = ConflictIndex([
+            slot(1, 3, 600, 660, room='Mat 1'),
+            slot(2, 3, 700, 760, room='Mat 1'),
+        ])
+        # Moving slot 1 onto slot 2 conflicts, its stored time doesn't
+        errors = check([slot(1, 3, 690, 750, room='Mat 1')], index)
+        self.assertEqual(list(errors), [1])
+        self.assertEqual(len(errors[1]), 1)
+        self.assertIn('Class 2', errors[1][0])
+        self.assertEqual(check([slot(1, 3, 690, 750, room='Mat 1')], index, exclude=[2]), {})
+        # Edited slots are checked against each other too
+        errors = check([slot('new-1', 4, 600, 660, coach='Sam'), slot('new-2', 4, 630, 700, coach='Sam')], index)
+        self.assertEqual(set(errors), {'new-1', 'new-2'})
+
+
+class OccurrenceTests(TestCase):
+    def setUp(self):
+        self.today = occurrences.horizon()[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            boxing = Class.objects.create(name='Boxing')
+            self.a = ClassInstance.objects.create(
+                training_class=boxing, weekday=str(self.today.isoweekday()),
+                start_time=datetime.time(18), end_time=datetime.time(19), time_span=0,
+            )
+            self.b = ClassInstance.objects.create(
+                training_class=boxing, weekday=str(self.today.isoweekday() % 7 + 1),
+                start_time=datetime.time(7), end_time=datetime.time(8), time_span=0,
+            )
+
+    def dates(self, instance):
+        return list(instance.occurrences.order_by('date').values_list('date', flat=True))
+
+    def test_build(self):
+        monday = datetime.date(2026, 12, 7)
+        built = occurrences.build([self.a], monday, monday + datetime.timedelta(days=21))
+        self.assertEqual(len(built), 3)
+        self.assertTrue(all(occurrence.date.isoweekday() == int(self.a.weekday) for occurrence in built))
+        self.assertEqual(built[0].training_class_id, self.a.training_class_id)
+        self.assertEqual((built[0].start_time, built[0].end_time), (datetime.time(18), datetime.time(19)))
+
+    def test_saves_regenerate_the_slot(self):
+        weeks = settings.PFA_OCCURRENCE_HORIZON_DAYS // 7
+        self.assertEqual(self.dates(self.a)[0], self.today)
+        self.assertEqual(len(self.dates(self.a)), weeks)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.a.start_time = datetime.time(17)
+            self.a.save()
+        self.assertEqual(set(self.a.occurrences.values_list('start_time', flat=True)), {datetime.time(17)})
+        self.assertEqual(len(self.dates(self.a)), weeks)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.a.training_class.deleted = 1
+            self.a.training_class.save()
+        self.assertEqual(self.dates(self.a), [])
+
+    def test_exceptions(self):
+        next_week = self.today + datetime.timedelta(days=7)
+        later = self.today + datetime.timedelta(days=14)
+        with self.captureOnCommitCallbacks(execute=True):
+            ClassException.objects.create(class_instance=self.a, date=next_week, cancelled=True, note='Holiday')
+            moved = ClassException.objects.create(class_instance=self.a, date=later, start_time=datetime.time(20))
+        occurrence = self.a.occurrences.get(date=next_week)
+        self.assertTrue(occurrence.cancelled)
+        self.assertEqual(occurrence.note, 'Holiday')
+        occurrence = self.a.occurrences.get(date=later)
+        self.assertEqual((occurrence.start_time, occurrence.end_time), (datetime.time(20), datetime.time(19)))
+        with self.captureOnCommitCallbacks(execute=True):
+            moved.delete()
+        self.assertEqual(self.a.occurrences.get(date=later).start_time, datetime.time(18))
+
+    def test_extend(self):
+        ClassOccurrence.objects.all().delete()
+        self.assertEqual(occurrences.extend(days=14), 4)
+        self.assertEqual(occurrences.extend(days=14), 0)
+        self.assertEqual(occurrences.extend(days=28), 4)
+        self.assertEqual(self.dates(self.a)[-1], self.today + datetime.timedelta(days=21))
+
+    def test_extend_fills_slots_behind_an_edited_one(self):
+        ClassOccurrence.objects.all().delete()
+        occurrences.extend(days=14)
+        # An edit regenerates b up to the horizon, a still ends at two weeks
+        with self.captureOnCommitCallbacks(execute=True):
+            self.b.room = 'Mat 2'
+            self.b.save()
+        self.assertEqual(occurrences.extend(days=21), 1)
+        self.assertEqual(self.dates(self.a)[-1], self.today + datetime.timedelta(days=14))
+        occurrences.extend()
+        self.assertEqual(len(self.dates(self.a)), len(self.dates(self.b)))
+
+
+class ChangeLogTests(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.boxing = Class.objects.create(name='Boxing')
+
+    def logged(self):
+        return list(ChangeLog.objects.filter(model_name='test').order_by('pk').values_list('object_id', flat=True))
+
+    def test_one_insert_per_transaction(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            with transaction.atomic():
+                for object_id in range(5):
+                    log_change('test', object_id, 'update')
+        self.assertEqual(self.logged(), [])
+        with CaptureQueriesContext(connection) as queries:
+            for callback in callbacks:
+                callback()
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "pfa_changelog"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(self.logged(), [0, 1, 2, 3, 4])
+        sequences = list(ChangeLog.objects.filter(model_name='test').order_by('pk').values_list('sequence', flat=True))
+        self.assertEqual(sequences, list(range(sequences[0], sequences[0] + 5)))
+
+    def test_rolled_back_savepoint(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                log_change('test', 1, 'update')
+                try:
+                    with transaction.atomic():
+                        log_change('test', 2, 'update')
+                        raise ValueError
+                except ValueError:
+                    pass
+                with transaction.atomic():
+                    log_change('test', 3, 'update')
+                log_change('test', 4, 'update')
+        self.assertEqual(self.logged(), [1, 3, 4])
+
+    def test_saves_log_old_and_new(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            instance = ClassInstance.objects.create(
+                training_class=self.boxing, weekday='1', start_time=datetime.time(18), end_time=datetime.time(19), time_span=0
+            )
+        with self.captureOnCommitCallbacks(execute=True):
+            instance = ClassInstance.objects.get(pk=instance.pk)
+            instance.room = 'Mat 2'
+            instance.save()
+            instance.save()
+        entries = ChangeLog.objects.filter(model_name='classinstance', object_id=instance.pk).order_by('pk')
+        self.assertEqual([entry.action for entry in entries], ['create', 'update'])
+        self.assertEqual(entries[1].changes, {'room': ['', 'Mat 2']})
+
+    def test_deferred_fields_are_not_loaded(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            instance = ClassInstance.objects.create(
+                training_class=self.boxing, weekday='1', start_time=datetime.time(18), end_time=datetime.time(19), time_span=0
+            )
+        full = ClassInstance.objects.get(pk=instance.pk)
+        full.coach = 'Sam'
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            full.save()
+        only = ClassInstance.objects.only('pk', 'room').get(pk=instance.pk)
+        only.room = 'Mat 2'
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(len(queries)):
+            only.save()
+        self.assertEqual(
+            ChangeLog.objects.filter(model_name='classinstance', action='update').latest('pk').changes,
+            {'room': ['', 'Mat 2']},
+        )
+
+    def test_category_delete_logs_memberships(self):
+        striking = ClassCategory.objects.create(category='Striking')
+        fitness = ClassCategory.objects.create(category='Fitness')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.boxing.class_categories.set([striking, fitness])
+        striking_pk = striking.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            striking.delete()
+        self.assertEqual(
+            ChangeLog.objects.filter(model_name='class', object_id=self.boxing.pk).latest('pk').changes,
+            {'class_categories': [[striking_pk, fitness.pk], [fitness.pk]]},
+        )
+
+
+class ChangeLogAutocommitTests(TransactionTestCase):
+    def test_written_immediately(self):
+        log_change('test', 1, 'update')
+        self.assertTrue(ChangeLog.objects.filter(model_name='test', object_id=1).exists())
+
+
+class CategoryMaskTests(TestCase):
+    def setUp(self):
+        self.striking = ClassCategory.objects.create(category='Striking')
+        self.grappling = ClassCategory.objects.create(category='Grappling')
+        self.boxing = Class.objects.create(name='Boxing')
+        self.boxing.class_categories.add(self.striking)
+        self.instance = ClassInstance.objects.create(
+            training_class=self.boxing, weekday='1', start_time=datetime.time(18), end_time=datetime.time(19), time_span=0
+        )
+        # Soft deleted slots are kept in sync too, they can be restored
+        self.removed = ClassInstance.objects.create(
+            training_class=self.boxing, weekday='2', start_time=datetime.time(18), end_time=datetime.time(19),
+            time_span=0, deleted=1,
+        )
+
+    def assertMask(self, *categories):
+        mask = ClassCategory.mask_for(categories)
+        masks = ClassInstance.all_objects.filter(training_class=self.boxing).values_list('category_mask', flat=True)
+        self.assertEqual(list(masks), [mask, mask])
+
+    def test_new_instance(self):
+        self.assertMask('Striking')
+
+    def test_add_remove_clear(self):
+        self.boxing.class_categories.add(self.grappling)
+        self.assertMask('Striking', 'Grappling')
+        self.boxing.class_categories.remove(self.striking)
+        self.assertMask('Grappling')
+        self.boxing.class_categories.clear()
+        self.assertMask()
+
+    def test_reverse_side(self):
+        self.grappling.class_set.add(self.boxing)
+        self.assertMask('Striking', 'Grappling')
+        self.striking.class_set.remove(self.boxing)
+        self.assertMask('Grappling')
+        self.grappling.class_set.clear()
+        self.assertMask()
+
+    def test_category_renamed(self):
+        self.striking.category = 'Fitness'
+        self.striking.save()
+        self.assertMask('Fitness')
+
+    def test_category_deleted(self):
+        self.boxing.class_categories.add(self.grappling)
+        self.striking.delete()
+        self.assertMask('Grappling')
+
+    def test_instance_moved_to_another_class(self):
+        judo = Class.objects.create(name='Judo')
+        judo.class_categories.add(self.grappling)
+        self.instance.training_class = judo
+        self.instance.save()
+        self.instance.refresh_from_db()
+        self.assertEqual(self.instance.category_mask, ClassCategory.mask_for(['Grappling']))
+
+
+class AdminQueryCountTests(TestCase):
+    def setUp(self):
+        self.addCleanup(schedule.invalidate)
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        self.categories = [ClassCategory.objects.create(category=category) for category, _ in ClassCategory.CLASS_CATEGORIES]
+        self.classes = 0
+        self.add_classes(2)
+
+    def add_classes(self, count):
+        for _ in range(count):
+            self.classes += 1
+            training_class = Class.objects.create(name=f'Class {self.classes}')
+            training_class.class_categories.add(*self.categories[:self.classes % 3 + 1])
+            ClassInstance.objects.create(
+                training_class=training_class, weekday=str(self.classes % 7 + 1),
+                start_time=datetime.time(self.classes % 12 + 6), end_time=datetime.time(self.classes % 12 + 7), time_span=0,
+            )
+
+    def queries(self, url):
+        schedule.invalidate()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_counts_do_not_grow_with_rows(self):
+        urls = [
+            reverse('admin:pfa_classinstance_changelist'),
+            reverse('admin:pfa_class_changelist'),
+            reverse('admin:pfa_classcategory_changelist'),
+            reverse('admin:pfa_weekly_schedule'),
+            reverse('admin:app_list', args=['pfa']),
+        ]
+        before = {url: self.queries(url) for url in urls}
+        self.add_classes(4)
+        after = {url: self.queries(url) for url in urls}
+        self.assertEqual(after, before)
+
+
+class SoftDeleteTests(TestCase):
+    def setUp(self):
+        self.addCleanup(schedule.invalidate)
+        self.boxing = Class.objects.create(name='Boxing')
+        self.judo = Class.objects.create(name='Judo', deleted=1)
+        self.live = self.create(self.boxing)
+        # Both would clash with the live slot if they counted
+        self.removed = self.create(self.boxing, deleted=1)
+        self.orphaned = self.create(self.judo)
+        schedule.invalidate()
+
+    def create(self, training_class, **fields):
+        return ClassInstance.objects.create(
+            training_class=training_class, weekday='1', start_time=datetime.time(18), end_time=datetime.time(19),
+            time_span=0, room='Mat 1', **fields
+        )
+
+    def test_managers(self):
+        self.assertEqual(list(Class.objects.all()), [self.boxing])
+        self.assertEqual(set(Class.all_objects.all()), {self.boxing, self.judo})
+        self.assertEqual(set(ClassInstance.objects.all()), {self.live, self.orphaned})
+        self.assertEqual(set(ClassInstance.all_objects.all()), {self.live, self.removed, self.orphaned})
+
+    def test_public_views(self):
+        response = self.client.get(reverse('pfa'), {'day': 1})
+        self.assertEqual([instance.pk for instance in response.context['class_list']], [self.live.pk])
+        days = self.client.get(reverse('pfa_schedule_api')).json()['days']
+        self.assertEqual([entry['id'] for day in days.values() for entry in day], [self.live.pk])
+        now = self.client.get(reverse('pfa_now_api'), {'day': 1, 'at': '18:30'}).json()
+        self.assertEqual([entry['id'] for entry in now['now']], [self.live.pk])
+
+    def test_conflict_check(self):
+        out = io.StringIO()
+        call_command('check_schedule_conflicts', stdout=out)
+        self.assertIn('Checked 1 class instances: 0 conflicts', out.getvalue())
+
+    def test_admin_includes_deleted(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.get(reverse('admin:pfa_classinstance_changelist'))
+        self.assertEqual(
+            {instance.pk for instance in response.context['cl'].result_list},
+            {self.live.pk, self.removed.pk, self.orphaned.pk},
+        )
+        response = self.client.get(reverse('admin:pfa_class_changelist'))
+        self.assertEqual({obj.pk for obj in response.context['cl'].result_list}, {self.boxing.pk, self.judo.pk})
+        # A slot of a deleted class can still be edited
+        response = self.client.get(reverse('admin:pfa_classinstance_change', args=[self.orphaned.pk]))
+        self.assertIn(self.judo, response.context['adminform'].form.fields['training_class'].queryset)
+
+
+class ScheduleApiTests(TestCase):
+    def setUp(self):
+        self.addCleanup(schedule.invalidate)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.boxing = Class.objects.create(name='Boxing')
+            self.monday = self.create(weekday='1')
+            self.tuesday = self.create(weekday='2')
+
+    def create(self, **fields):
+        fields = dict({'weekday': '3', 'start_time': datetime.time(18), 'end_time': datetime.time(19)}, **fields)
+        return ClassInstance.objects.create(training_class=self.boxing, time_span=0, **fields)
+
+    def get(self, **params):
+        return self.client.get(reverse('pfa_schedule_api'), params)
+
+    def test_full_week(self):
+        body = self.get().json()
+        self.assertEqual(body['version'], ScheduleChange.current_version())
+        self.assertEqual([entry['id'] for entry in body['days']['1']], [self.monday.pk])
+
+    def test_delta(self):
+        since = self.get().json()['version']
+        with self.captureOnCommitCallbacks(execute=True):
+            added = self.create()
+            self.monday.room = 'Mat 2'
+            self.monday.save()
+            tuesday = self.tuesday.pk
+            self.tuesday.delete()
+        body = self.get(since=since).json()
+        self.assertEqual(body['since'], since)
+        self.assertEqual(body['version'], ScheduleChange.current_version())
+        self.assertEqual([entry['id'] for entry in body['changed']], sorted([self.monday.pk, added.pk]))
+        self.assertEqual(body['deleted'], [tuesday])
+        self.assertEqual(self.get(since=body['version']).json()['changed'], [])
+
+    def test_soft_delete_is_a_deletion(self):
+        since = self.get().json()['version']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.monday.deleted = 1
+            self.monday.save()
+        self.assertEqual(self.get(since=since).json()['deleted'], [self.monday.pk])
+
+    def test_reset_sends_the_week(self):
+        since = self.get().json()['version']
+        with self.captureOnCommitCallbacks(execute=True):
+            ScheduleChange.record([ScheduleChange(model_name='import', object_id=0, action='reset')])
+        body = self.get(since=since).json()
+        self.assertIn('days', body)
+        self.assertNotIn('changed', body)
+
+    def test_pruned_changes_send_the_week(self):
+        since = self.get().json()['version']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create()
+        synced = self.get().json()['version']
+        out = io.StringIO()
+        call_command('prune_schedule_changes', '--days', '0', stdout=out)
+        self.assertEqual(ScheduleChange.objects.count(), 0)
+        self.assertEqual(ScheduleChange.pruned_version(), synced)
+        self.assertIn('days', self.get(since=since).json())
+        # Clients already past the cut still get (empty) deltas
+        self.assertEqual(self.get(since=synced).json()['changed'], [])
+        self.assertEqual(ScheduleChange.prune(timezone.now()), 0)
+
+    def test_bad_since(self):
+        version = self.get().json()['version']
+        for since in (version + 1, -1, 'x'):
+            self.assertEqual(self.get(since=since).status_code, 400)
+
+    def test_one_version_per_transaction(self):
+        before = ScheduleChange.current_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                ScheduleChange.record(ScheduleChange(object_id=pk, action='upsert') for pk in (1, 2, 3))
+        self.assertEqual(ScheduleChange.current_version(), before + 1)
+        self.assertEqual(ScheduleChange.objects.filter(version=before + 1).count(), 3)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ScheduleVersionConcurrencyTests(TransactionTestCase):
+    def test_versions_follow_commit_order(self):
+        # The first transaction to bump holds the counter until it commits, so one
+        # started earlier but committing later can't get a version below a client's
+        first_bumped, second_started = threading.Event(), threading.Event()
+        versions = {}
+
+        def first():
+            try:
+                with transaction.atomic():
+                    ScheduleChange.record([ScheduleChange(object_id=1, action='upsert')])
+                    first_bumped.set()
+                    second_started.wait(5)
+                    time.sleep(0.2)
+                versions['first'] = ScheduleChange.objects.get(object_id=1).version
+            finally:
+                connection.close()
+
+        def second():
+            try:
+                first_bumped.wait(5)
+                with transaction.atomic():
+                    second_started.set()
+                    ScheduleChange.record([ScheduleChange(object_id=2, action='upsert')])
+                    versions['seen_at_commit'] = ScheduleChange.objects.filter(object_id=1).exists()
+                versions['second'] = ScheduleChange.objects.get(object_id=2).version
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=first), threading.Thread(target=second)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertTrue(versions['seen_at_commit'])
+        self.assertEqual(versions['second'], versions['first'] + 1)
+
+
+class WeekScheduleCacheTests(TestCase):
+    def setUp(self):
+        self.addCleanup(schedule.invalidate)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.striking = ClassCategory.objects.create(category='Striking')
+            self.boxing = Class.objects.create(name='Boxing')
+            self.boxing.class_categories.add(self.striking)
+            self.instance = ClassInstance.objects.create(
+                training_class=self.boxing, weekday='1', start_time=datetime.time(18), end_time=datetime.time(19), time_span=0
+            )
+        schedule.invalidate()
+        self.cached = schedule.get_schedule()
+
+    def assertInvalidatedOnCommit(self, change):
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+            # Not before the transaction commits
+            self.assertIs(schedule.get_schedule(), self.cached)
+        self.assertIsNot(schedule.get_schedule(), self.cached)
+
+    def test_cached(self):
+        with self.assertNumQueries(0):
+            self.assertIs(schedule.get_schedule(), self.cached)
+        self.assertEqual([instance.pk for instance in self.cached.classes(1)], [self.instance.pk])
+        self.assertEqual([instance.pk for instance in self.cached.classes(1, 'striking')], [self.instance.pk])
+
+    def test_save(self):
+        def change():
+            self.instance.start_time = datetime.time(17)
+            self.instance.save()
+        self.assertInvalidatedOnCommit(change)
+        self.assertEqual(schedule.get_schedule().classes(1)[0].start_time, datetime.time(17))
+
+    def test_delete(self):
+        self.assertInvalidatedOnCommit(self.instance.delete)
+        self.assertEqual(schedule.get_schedule().classes(1), [])
+
+    def test_class_rename(self):
+        def change():
+            self.boxing.name = 'Kickboxing'
+            self.boxing.save()
+        self.assertInvalidatedOnCommit(change)
+        self.assertEqual(schedule.get_schedule().payload['1'][0]['name'], 'Kickboxing')
+
+    def test_categories(self):
+        self.assertInvalidatedOnCommit(lambda: self.boxing.class_categories.remove(self.striking))
+        self.assertEqual(schedule.get_schedule().classes(1, 'striking'), [])
+
+    def test_rollback_keeps_the_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    self.instance.delete()
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertIs(schedule.get_schedule(), self.cached)
+
+    def test_unsaved_changes_are_not_an_invalidation(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.instance.save()
+        self.assertIs(schedule.get_schedule(), self.cached)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.addCleanup(schedule.invalidate)
+        with self.captureOnCommitCallbacks(execute=True):
+            boxing = Class.objects.create(name='Boxing')
+            self.instance = ClassInstance.objects.create(
+                training_class=boxing, weekday='1', start_time=datetime.time(18), end_time=datetime.time(19), time_span=0
+            )
+        schedule.invalidate()
+
+    def test_unchanged_refresh_is_a_304_without_queries(self):
+        url = reverse('pfa') + '?day=1'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # Another day or category is another page
+        self.assertEqual(self.client.get(reverse('pfa') + '?day=2', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_changes_move_the_etag(self):
+        url = reverse('pfa') + '?day=1'
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.instance.room = 'Mat 2'
+            self.instance.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class CheckModifiedClassesTests(TestCase):
+    def setUp(self):
+        boxing = Class.objects.create(name='Boxing')
+        self.recent, self.old = [
+            ClassInstance.objects.create(
+                training_class=boxing, weekday=weekday, start_time=datetime.time(18), end_time=datetime.time(19), time_span=0
+            )
+            for weekday in ('1', '2')
+        ]
+        ClassInstance.objects.filter(pk=self.old.pk).update(updated=timezone.now() - datetime.timedelta(days=10))
+
+    def check(self, *args):
+        out = io.StringIO()
+        call_command('check_modified_classes', *args, stdout=out)
+        return out.getvalue()
+
+    def test_days(self):
+        out = self.check()
+        self.assertIn(f'  - {self.recent} (last updated:', out)
+        self.assertIn('Found 1 classes modified in the last 7 days.', out)
+        self.assertIn('Found 2 classes modified in the last 30 days.', self.check('--days', '30'))
+
+    def test_since_last_run(self):
+        # The first run has nothing to go on but --days
+        self.assertIn('Found 1 classes modified in the last 7 days.', self.check('--since-last-run'))
+        self.assertIn('No classes have been modified since', self.check('--since-last-run'))
+        self.old.room = 'Mat 2'
+        self.old.save()
+        out = self.check('--since-last-run', '--chunk-size', '1')
+        self.assertIn(f'  - {self.old} (last updated:', out)
+        self.assertIn('Found 1 classes modified since', out)
+        # Without the flag the watermark is neither used nor moved
+        self.assertIn('Found 2 classes modified in the last 7 days.', self.check())
+        self.assertIn('No classes have been modified since', self.check('--since-last-run'))
+
+    def test_json(self):
+        report = json.loads(self.check('--format', 'json', '--days', '30'))
+        self.assertEqual(report['count'], 2)
+        self.assertEqual([entry['id'] for entry in report['classes']], [self.old.pk, self.recent.pk])
+        self.assertEqual(report['classes'][0]['training_class'], 'Boxing')
+        self.assertEqual(report['classes'][0]['start_time'], '18:00:00')
+        self.check('--since-last-run')
+        last_run = AuditWatermark.objects.get(name='check_modified_classes').timestamp
+        report = json.loads(self.check('--format', 'json', '--since-last-run'))
+        self.assertEqual((report['since'], report['classes'], report['count']), (last_run.isoformat(), [], 0))
+
+
+class DetectScheduleChangesTests(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.boxing = Class.objects.create(name='Boxing')
+            self.instance = ClassInstance.objects.create(
+                training_class=self.boxing, weekday='1', start_time=datetime.time(18), end_time=datetime.time(19), time_span=0
+            )
+
+    def detect(self, *args):
+        out = io.StringIO()
+        call_command('detect_schedule_changes', *args, stdout=out)
+        return out.getvalue()
+
+    def position(self):
+        return AuditWatermark.objects.get(name='detect_schedule_changes').position
+
+    def test_first_run_sets_the_watermark(self):
+        out = self.detect()
+        self.assertIn('No previous watermark found', out)
+        self.assertEqual(self.position(), ChangeLog.objects.latest('sequence').sequence)
+        self.assertIn('Checked 0 changes', self.detect())
+
+    def test_later_runs_report_what_changed(self):
+        self.detect()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.instance.start_time = datetime.time(17)
+            self.instance.save()
+            self.boxing.name = 'Kickboxing'
+            self.boxing.save()
+            added = ClassInstance.objects.create(
+                training_class=self.boxing, weekday='2', start_time=datetime.time(7), end_time=datetime.time(8), time_span=0
+            )
+            added_pk = added.pk
+            added.delete()
+        out = self.detect('--batch-size', '2')
+        self.assertIn(f'Detected changes to class {self.instance.pk}:', out)
+        self.assertIn('start_time: 18:00:00 -> 17:00:00', out)
+        self.assertIn(f'Training class {self.boxing.pk} renamed: Boxing -> Kickboxing', out)
+        self.assertIn(f'New class detected: {added_pk} (Kickboxing)', out)
+        self.assertIn(f'Class {added_pk} (Kickboxing) was deleted', out)
+        self.assertIn('Checked 4 changes', out)
+        self.assertEqual(self.position(), ChangeLog.objects.latest('sequence').sequence)
+        self.assertIn('Checked 0 changes', self.detect())
+
+    def test_reset_skips_what_is_pending(self):
+        self.detect()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.instance.room = 'Mat 2'
+            self.instance.save()
+        self.detect('--reset')
+        self.assertIn('Checked 0 changes', self.detect())
@@ -1,6 +1,10 @@
 from django.urls import path
-from .views import fitness_class_view
+from .views import fitness_class_view, schedule_api_view, now_api_view, occurrences_api_view, metrics_view
 
 urlpatterns = [
-    path('', fitness_class_view, name='pfa')
-]
\ No newline at end of file
+    path('', fitness_class_view, name='pfa'),
+    path('api/schedule', schedule_api_view, name='pfa_schedule_api'),
+    path('api/now', now_api_view, name='pfa_now_api'),
+    path('api/occurrences', occurrences_api_view, name='pfa_occurrences_api'),
+    path('metrics', metrics_view, name='pfa_metrics'),
+]
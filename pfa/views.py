@@ -1,112 +1,181 @@
-from django.http import HttpResponseRedirect
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
 from django.urls import reverse
 from django.shortcuts import render
 from django.utils import timezone
-from .models import ClassInstance
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from .forms import DayOfWeekForm, CategoryFilterForm
+from .metrics import metrics
+from .models import ScheduleChange
+from .schedule import get_schedule, revalidate
+from . import occurrences, request_log
 import urllib.parse
-import logging
-import json
-import socket
 import datetime
+import logging
+import hmac
 
 logger = logging.getLogger('pfa')
 
+def selected_filters(request):
+    """Return the (day, category) selected in the query string, defaulting to today and 'all'"""
+    try:
+        selected_day = int(request.GET.get('day', ''))
+    except ValueError:
+        selected_day = timezone.now().weekday() + 1
+    return selected_day, request.GET.get('category', 'all')
+
+def schedule_etag(request):
+    """ETag for the selected day and category, precomputed when the schedule is built"""
+    return get_schedule().etag(*selected_filters(request))
+
+# Always revalidate, so unchanged refreshes are answered with a 304 before rendering.
+# The ETag carries the selected day, so there is no Last-Modified to go stale at midnight.
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=schedule_etag)
 def fitness_class_view(request):
-    logger.info(f"Schedule view accessed by {request.user} from {request.META.get('REMOTE_ADDR')} via {request.META.get('HTTP_USER_AGENT')}")
+    request_log.note(view='pfa', user_agent=request.META.get('HTTP_USER_AGENT'))
     
     try:
-        class_list = ClassInstance.objects.all()
-        current_day = timezone.now().weekday() + 1
-        
         # Get the selected day and category from URL parameters or default to current day and 'all'
-        selected_day = int(request.GET.get('day', current_day))
-        selected_category = request.GET.get('category', 'all')
-
-        logger.debug(f"Initial query parameters: day={selected_day}, category={selected_category}")
+        selected_day, selected_category = selected_filters(request)
 
         if request.method == 'POST':
-            logger.info(f"POST request received with data: {json.dumps(dict(request.POST))}")
             day_form = DayOfWeekForm(request.POST)
             selected_category = request.POST.get('category', 'all')
+            request_log.note(form_day=request.POST.get('day_of_week'), form_category=selected_category)
             
             if day_form.is_valid():
                 selected_day = day_form.cleaned_data['day_of_week']
                 query_params = urllib.parse.urlencode({'day': selected_day, 'category': selected_category})
-                logger.debug(f"Form valid, redirecting with params: {query_params}")
+                request_log.note(redirect=query_params)
                 return HttpResponseRedirect(f"{reverse('pfa')}?{query_params}")
             else:
-                logger.warning(f"Form validation failed with errors: {day_form.errors}")
+                logger.warning("Form validation failed with errors: %s", day_form.errors)
         else:
             day_form = DayOfWeekForm(initial={'day_of_week': selected_day})
         
-        # Log filter operations
-        logger.debug(f"Filtering by day={selected_day}, category={selected_category}")
+        # Read the precomputed week instead of querying on every hit
+        schedule = get_schedule()
+        class_list = schedule.classes(selected_day, selected_category)
         
-        if selected_category == 'striking':
-            class_list = class_list.filter(training_class__class_categories__category='Striking')
-        elif selected_category == 'grappling':
-            class_list = class_list.filter(training_class__class_categories__category='Grappling')
-        
-        class_list = class_list.filter(weekday=selected_day).order_by('start_time')
-        
-        # Log query results
-        logger.debug(f"Query returned {class_list.count()} classes")
-        
-        for cls in class_list:
-            logger.debug(f"Class in view: {cls.training_class} | {cls.get_weekday_display()} | {cls.start_time}-{cls.end_time} | Last updated: {cls.updated}")
+        # Log filter results
+        request_log.note(day=selected_day, category=selected_category, classes=len(class_list))
         
         context = {
             'day_form': day_form,
             'class_list': class_list,
             'selected_day': selected_day,
             'selected_category': selected_category,
+            'schedule_script': schedule.payload_script,
         }
         
         return render(request, 'pfa/index.html', context)
         
     except Exception as e:
-        logger.error(f"Error in fitness_class_view: {str(e)}", exc_info=True)
+        logger.error("Error in fitness_class_view: %s", e, exc_info=True)
         raise
 
 
-# from django.shortcuts import render
-# from django.utils import timezone
-# from .models import ClassInstance
-# from .forms import DayOfWeekForm, CategoryFilterForm
-# import datetime
-# 
-# 	
-# def fitness_class_view(request):
-# 	class_list = ClassInstance.objects.all()
-# 	selected_day = None
-# 	selected_category = 'all'
-# 	
-# 	current_day = timezone.now().weekday() + 1
-# 	
-# 	if request.method == 'POST':
-# 		day_form = DayOfWeekForm(request.POST)
-# 		selected_category = request.POST.get('category', 'all')
-# 		
-# 		if day_form.is_valid():
-# 			selected_day = day_form.cleaned_data['day_of_week']
-# 			class_list = class_list.filter(weekday=selected_day).order_by('start_time')
-# 			
-# 		if selected_category == 'striking':
-# 			class_list = class_list.filter(training_class__class_categories__category='Striking')
-# 		elif selected_category == 'grappling':
-# 			class_list = class_list.filter(training_class__class_categories__category='Grappling')
-# 			
-# 	else:
-# 		day_form = DayOfWeekForm(initial={'day_of_week': current_day})
-# 		selected_day = current_day
-# 		class_list = class_list.filter(weekday=selected_day).order_by('start_time')
-# 	
-# 	context = {
-# 		'day_form': day_form,
-# 		'class_list': class_list,
-# 		'selected_day': selected_day,
-# 		'selected_category': selected_category,
-# 	}
-# 	return render(request, 'pfa/index.html', context)
-# 		
\ No newline at end of file
+@cache_control(private=True, no_cache=True)
+def schedule_api_view(request):
+    """Versioned week schedule, or only the rows changed since ?since=<version>"""
+    # Always answer from a snapshot at least as new as the latest recorded change
+    schedule = revalidate()
+    since = request.GET.get('since')
+
+    if since is None:
+        return JsonResponse({'version': schedule.version, 'days': schedule.payload})
+
+    try:
+        since = int(since)
+    except ValueError:
+        return JsonResponse({'error': 'since must be an integer version'}, status=400)
+    if since < 0 or since > schedule.version:
+        return JsonResponse({'error': f'since must be between 0 and {schedule.version}'}, status=400)
+
+    changes = ScheduleChange.objects.filter(version__gt=since, version__lte=schedule.version)
+    # A bulk import doesn't say what it touched, and pruned changes are gone, so send the whole week
+    if since < ScheduleChange.pruned_version() or changes.filter(action='reset').exists():
+        request_log.note(since=since, version=schedule.version, reset=True)
+        return JsonResponse({'version': schedule.version, 'days': schedule.payload})
+
+    changed_ids = set(changes.filter(model_name='classinstance').values_list('object_id', flat=True))
+    request_log.note(since=since, version=schedule.version, changed=len(changed_ids))
+
+    return JsonResponse({
+        'version': schedule.version,
+        'since': since,
+        'changed': [schedule.entries[pk] for pk in sorted(changed_ids) if pk in schedule.entries],
+        'deleted': sorted(pk for pk in changed_ids if pk not in schedule.entries),
+    })
+
+
+@cache_control(public=True, max_age=30)
+def now_api_view(request):
+    """Classes running now and the next ones to start, for screens and widgets that poll"""
+    # Served from the cached week, only a due revalidation touches the database
+    schedule = get_schedule()
+    now = timezone.localtime()
+    try:
+        weekday = int(request.GET.get('day', now.isoweekday()))
+        at = datetime.time.fromisoformat(request.GET['at']) if 'at' in request.GET else now.time()
+    except ValueError:
+        return JsonResponse({'error': 'day must be 1-7 and at HH:MM'}, status=400)
+    if not 1 <= weekday <= 7:
+        return JsonResponse({'error': 'day must be 1-7 and at HH:MM'}, status=400)
+
+    running, upcoming, next_day = schedule.now_and_next(weekday, at.hour * 60 + at.minute)
+    return JsonResponse({
+        'version': schedule.version,
+        'day': weekday,
+        'at': at.strftime('%H:%M'),
+        'now': running,
+        'next': upcoming,
+        'next_day': next_day,
+    })
+
+
+@cache_control(public=True, max_age=60)
+def occurrences_api_view(request):
+    """Dated classes from ?start=YYYY-MM-DD (default today) for ?days= days"""
+    today, _ = occurrences.horizon()
+    try:
+        start = datetime.date.fromisoformat(request.GET['start']) if 'start' in request.GET else today
+        days = int(request.GET.get('days', 14))
+    except ValueError:
+        return JsonResponse({'error': 'start must be YYYY-MM-DD and days an integer'}, status=400)
+    if not 1 <= days <= settings.PFA_OCCURRENCE_HORIZON_DAYS:
+        return JsonResponse({'error': f'days must be between 1 and {settings.PFA_OCCURRENCE_HORIZON_DAYS}'}, status=400)
+
+    end = start + datetime.timedelta(days=days)
+    rows = occurrences.between(start, end).values_list(
+        'class_instance_id', 'training_class__name', 'date', 'start_time', 'end_time', 'cancelled', 'note'
+    )
+    request_log.note(start=start, days=days)
+    return JsonResponse({
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'occurrences': [
+            {
+                'id': instance_id, 'name': name, 'date': date.isoformat(),
+                'start': start_time.strftime('%H:%M'), 'end': end_time.strftime('%H:%M'),
+                'cancelled': cancelled, 'note': note,
+            }
+            for instance_id, name, date, start_time, end_time, cancelled, note in rows
+        ],
+    })
+
+
+def metrics_view(request):
+    """Plain text latency and query metrics for this worker process"""
+    token = settings.PFA_METRICS_TOKEN
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    has_token = bool(token) and hmac.compare_digest(authorization, f'Bearer {token}')
+    
+    if not (has_token or request.user.is_active and request.user.is_staff):
+        return HttpResponse('Forbidden\n', status=403, content_type='text/plain')
+    
+    response = HttpResponse(metrics.render(), content_type='text/plain; charset=utf-8')
+    response['Cache-Control'] = 'no-store'
+    return response
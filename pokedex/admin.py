@@ -1,3 +1,15 @@
 from django.contrib import admin
+from .models import Pokemon, PokemonType, PokemonTypeMembership
 
-# Register your models here.
+class PokemonTypeMembershipInline(admin.TabularInline):
+    model = PokemonTypeMembership
+    extra = 0
+
+class PokemonAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'updated')
+    list_filter = ('types',)
+    search_fields = ('name',)
+    inlines = [PokemonTypeMembershipInline]
+
+admin.site.register(Pokemon, PokemonAdmin)
+admin.site.register(PokemonType)
@@ -0,0 +1,139 @@
+"""
+In-memory Pokémon data for the pokedex page.
+
+The data is loaded once per worker and kept as a PokedexData snapshot,
+from the cache file or, with POKEDEX_SOURCE = 'db', from the Pokemon
+tables. The source is re-checked at most every POKEDEX_REVALIDATE_SECONDS
+(the file's mtime and size, or the table's row count and latest update),
+and a change is loaded into a new snapshot that replaces the old one in a
+single assignment, so a request always sees one complete version. Warm
+requests touch neither the disk nor the JSON parser.
+
+fetch_pokemon_data replaces the file with a rename, so a reload never reads
+a half written file. A file that can't be read or parsed is logged and the
+previous snapshot kept, the load is retried at the next revalidation.
+
+Each snapshot also indexes the data for the page's filters: type -> sorted
+ids, and every suffix of every name in sorted order, so both name prefixes
+and substrings are a bisect plus the matches. Pages are cut from the sorted
+ids with an ?after=<id> cursor.
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from .utils import CACHE_FILE
+
+logger = logging.getLogger('pokedex')
+
+
+class PokedexData:
+    """Immutable snapshot of the data, with its filter indexes."""
+
+    def __init__(self, pokemon, stamp=None):
+        self.pokemon = sorted(pokemon, key=lambda entry: entry['id'])
+        # Whatever identifies the version of the source it was read from
+        self.stamp = stamp
+        self.by_id = {entry['id']: entry for entry in self.pokemon}
+        self.ids = [entry['id'] for entry in self.pokemon]
+
+        self.type_ids = {}
+        suffixes = []
+        for entry in self.pokemon:
+            for type_name in entry['types']:
+                self.type_ids.setdefault(type_name, []).append(entry['id'])
+            name = entry['name'].lower()
+            suffixes.extend((name[i:], entry['id']) for i in range(len(name)))
+        self.type_sets = {type_name: set(ids) for type_name, ids in self.type_ids.items()}
+        self.types = sorted(self.type_ids)
+
+        suffixes.sort()
+        self.suffixes = [suffix for suffix, _ in suffixes]
+        self.suffix_ids = [id for _, id in suffixes]
+
+    def search(self, query):
+        """Ids whose name contains query, names starting with it included"""
+        found = set()
+        index = bisect.bisect_left(self.suffixes, query)
+        while index < len(self.suffixes) and self.suffixes[index].startswith(query):
+            found.add(self.suffix_ids[index])
+            index += 1
+        return found
+
+    def matching(self, type_name='', query=''):
+        """Sorted ids of the Pokémon matching the filters"""
+        ids = self.type_ids.get(type_name, []) if type_name else self.ids
+        if not query:
+            return ids
+        found = self.search(query)
+        if type_name:
+            type_set = self.type_sets.get(type_name, set())
+            found = {id for id in found if id in type_set}
+        return sorted(found)
+
+    def page(self, type_name='', query='', after=0, size=None):
+        """(ids, cursor of the next page or None) for up to size ids after the cursor"""
+        ids = self.matching(type_name, query)
+        start = bisect.bisect_right(ids, after)
+        end = start + (size or settings.POKEDEX_PAGE_SIZE)
+        page = ids[start:end]
+        return page, page[-1] if end < len(ids) else None
+
+    @classmethod
+    def load(cls):
+        if settings.POKEDEX_SOURCE == 'db':
+            from . import store
+
+            stamp = store.version()
+            return cls(store.entries(), stamp)
+        stat = os.stat(CACHE_FILE)
+        with open(CACHE_FILE) as f:
+            pokemon = json.load(f)
+        return cls(pokemon, (stat.st_mtime_ns, stat.st_size))
+
+
+def current_stamp():
+    if settings.POKEDEX_SOURCE == 'db':
+        from . import store
+
+        return store.version()
+    try:
+        stat = os.stat(CACHE_FILE)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+_lock = threading.Lock()
+_data = None
+_checked_at = 0.0
+
+
+def get_data():
+    """Return the current snapshot, reloading it if the source changed."""
+    global _data, _checked_at
+
+    data = _data
+    if data is not None and time.monotonic() - _checked_at < settings.POKEDEX_REVALIDATE_SECONDS:
+        return data
+
+    with _lock:
+        # Another thread may have just done the check
+        if _data is not None and time.monotonic() - _checked_at < settings.POKEDEX_REVALIDATE_SECONDS:
+            return _data
+        try:
+            if _data is None or current_stamp() != _data.stamp:
+                _data = PokedexData.load()
+                logger.debug("POKEDEX: Loaded %s Pokémon", len(_data.pokemon))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # Serve what we had, an empty page if this is the first load
+            logger.error("POKEDEX: Could not load %s, keeping the previous data: %s", CACHE_FILE, e)
+            if _data is None:
+                _data = PokedexData([])
+        _checked_at = time.monotonic()
+        return _data
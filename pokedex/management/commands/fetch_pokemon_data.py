@@ -1,26 +1,84 @@
-import json
-from django.core.management.base import BaseCommand
-import requests
-
-def fetch_pokemon_data():
-    pokemon_list = []
-    for id in range(1, 152):
-        response = requests.get(f"https://pokeapi.co/api/v2/pokemon/{id}")
-        data = response.json()
-        pokemon_list.append({
-            "id": data["id"],
-            "name": data["name"],
-            "types": [t["type"]["name"] for t in data["types"]],
-            "image_url": data["sprites"]["other"]["official-artwork"]["front_default"]
-        })
-        print(f"Fetched data for Pokemon: {id}")
-    return pokemon_list
+import os
+from django.core.management.base import BaseCommand, CommandError
+from pokedex import store, utils
 
 class Command(BaseCommand):
     help = "Fetches Pokémon data from PokeAPI and saves it to a JSON file"
 
-    def handle(self, *args, **kwargs):
-        data = fetch_pokemon_data()
-        with open('pokedex/cache/pokemon.json', 'w') as f:
-            json.dump(data, f)
-        self.stdout.write("Successfully cached Pokémon data!")
\ No newline at end of file
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', help='PokeAPI root URL (default: settings.POKEAPI_BASE_URL)')
+        parser.add_argument('--first', type=int, default=utils.FIRST_ID, help='First Pokémon id')
+        parser.add_argument('--last', type=int, default=utils.LAST_ID, help='Last Pokémon id')
+        parser.add_argument('--workers', type=int, default=utils.WORKERS, help='Concurrent requests')
+        parser.add_argument('--rate', type=float, default=utils.RATE, help='Requests per second, 0 for no limit')
+        parser.add_argument('--retries', type=int, default=utils.RETRIES, help='Retries per request')
+        parser.add_argument(
+            '--refresh',
+            action='store_true',
+            help='Send conditional requests for cached entries and only rewrite the cache if something changed'
+        )
+        parser.add_argument(
+            '--db',
+            action='store_true',
+            help='Also upsert the entries into the Pokemon tables'
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore the progress of an unfinished run and fetch everything again'
+        )
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        if options['restart'] and os.path.exists(utils.CHECKPOINT_FILE):
+            os.remove(utils.CHECKPOINT_FILE)
+
+        ids = range(options['first'], options['last'] + 1)
+        # Entries outside --first/--last are kept as they are
+        existing, validators = utils.read_cache()
+        cached = existing if options['refresh'] else {}
+        entries, new_validators, failed = utils.fetch_pokemon_data(
+            ids,
+            base_url=options['base_url'],
+            workers=options['workers'],
+            rate=options['rate'],
+            retries=options['retries'],
+            checkpoint=utils.CHECKPOINT_FILE,
+            cached=cached,
+            validators=validators,
+            progress=self.progress,
+        )
+
+        if failed:
+            # The checkpoint stays, the next run only fetches these
+            raise CommandError(
+                f"Failed to fetch {len(failed)} Pokémon ({', '.join(str(id) for id in sorted(failed))}), "
+                f"run the command again to fetch the rest"
+            )
+
+        fetched = [entries[id] for id in ids]
+        changed = sum(1 for entry in fetched if existing.get(entry['id']) != entry)
+        merged = dict(existing)
+        merged.update((entry['id'], entry) for entry in fetched)
+        pokemon_list = [merged[id] for id in sorted(merged)]
+        merged_validators = {id: validator for id, validator in validators.items() if id not in ids}
+        merged_validators.update((id, new_validators[id]) for id in ids if new_validators.get(id))
+        if not options['refresh'] or pokemon_list != list(existing.values()):
+            utils.write_json(utils.CACHE_FILE, pokemon_list)
+        if merged_validators != validators:
+            utils.write_json(utils.VALIDATORS_FILE, merged_validators)
+        if options['db']:
+            saved = store.upsert(fetched)
+            self.stdout.write(f"Saved {saved} new or changed Pokémon to the database")
+        utils.clear_checkpoint(ids, utils.CHECKPOINT_FILE)
+
+        if options['refresh']:
+            self.stdout.write(f"Refreshed Pokémon data: {changed} changed, {len(fetched) - changed} unchanged")
+        else:
+            self.stdout.write("Successfully cached Pokémon data!")
+
+    def progress(self, id, entry, modified):
+        if modified:
+            self.stdout.write(f"Fetched data for Pokemon: {id}")
+        elif self.verbosity > 1:
+            self.stdout.write(f"Pokemon {id} not modified")
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Pokemon',
+            fields=[
+                ('id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=100)),
+                ('image_url', models.URLField(blank=True, max_length=300)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PokemonType',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=20, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PokemonTypeMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.PositiveSmallIntegerField()),
+                ('pokemon', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='pokedex.pokemon')),
+                ('type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='pokedex.pokemontype')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='pokemon',
+            name='types',
+            field=models.ManyToManyField(related_name='pokemon', through='pokedex.PokemonTypeMembership', to='pokedex.pokemontype'),
+        ),
+        migrations.AddIndex(
+            model_name='pokemontypemembership',
+            index=models.Index(fields=['type', 'pokemon'], name='pokedex_membership_type_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='pokemontypemembership',
+            constraint=models.UniqueConstraint(fields=('pokemon', 'slot'), name='pokedex_membership_slot_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='pokemon',
+            index=models.Index(fields=['name'], name='pokedex_pokemon_name_idx'),
+        ),
+    ]
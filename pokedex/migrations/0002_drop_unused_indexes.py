@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:44
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pokedex', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='pokemon',
+            name='pokedex_pokemon_name_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='pokemontypemembership',
+            name='pokedex_membership_type_idx',
+        ),
+    ]
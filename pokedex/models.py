@@ -1,3 +1,38 @@
 from django.db import models
 
-# Create your models here.
+
+class PokemonType(models.Model):
+    # Table field definition
+    name = models.CharField(max_length=20, unique=True)
+
+    def __str__(self):
+        return self.name
+
+
+class Pokemon(models.Model):
+    # Table field definition, the primary key is the national dex number
+    id = models.PositiveIntegerField(primary_key=True)
+    name = models.CharField(max_length=100)
+    image_url = models.URLField(max_length=300, blank=True)
+    types = models.ManyToManyField(PokemonType, through='PokemonTypeMembership', related_name='pokemon')
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'#{self.id} {self.name}'
+
+
+# A Pokémon's types in order, slot 1 is the primary type used for the card colour
+class PokemonTypeMembership(models.Model):
+    # Table field definition
+    pokemon = models.ForeignKey(Pokemon, on_delete=models.CASCADE, related_name='memberships')
+    type = models.ForeignKey(PokemonType, on_delete=models.CASCADE, related_name='memberships')
+    slot = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [
+            # Also the index for loading a Pokémon's types in slot order
+            models.UniqueConstraint(fields=['pokemon', 'slot'], name='pokedex_membership_slot_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.pokemon} | {self.slot}: {self.type}'
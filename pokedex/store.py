@@ -0,0 +1,73 @@
+"""
+Pokémon stored in the database.
+
+fetch_pokemon_data --db upserts the fetched entries here in bulk. Rows are
+diffed in memory first, so only new or changed Pokémon are written, and
+their type memberships are replaced in the same transaction.
+
+entries() reads back only the columns the page renders, as the same dicts
+the JSON cache holds: one query for the Pokémon and one for their types.
+pokedex/data.py loads them once per worker into its snapshot and serves
+every page from there, version() tells it when the snapshot is stale.
+"""
+import logging
+
+from django.db import transaction
+from django.db.models import Count, Max
+
+from .models import Pokemon, PokemonType, PokemonTypeMembership
+
+logger = logging.getLogger('pokedex')
+
+
+def entries(ids=None):
+    """Cache-shaped dicts in dex order, for the given ids or all of them"""
+    pokemon = Pokemon.objects.order_by('id')
+    memberships = PokemonTypeMembership.objects.order_by('pokemon_id', 'slot')
+    if ids is not None:
+        pokemon = pokemon.filter(id__in=ids)
+        memberships = memberships.filter(pokemon_id__in=ids)
+
+    rows = {row['id']: dict(row, types=[]) for row in pokemon.values('id', 'name', 'image_url')}
+    for pokemon_id, type_name in memberships.values_list('pokemon_id', 'type__name'):
+        rows[pokemon_id]['types'].append(type_name)
+    return list(rows.values())
+
+
+def version():
+    """(row count, latest update), changes with every upsert or delete"""
+    stats = Pokemon.objects.aggregate(count=Count('id'), updated=Max('updated'))
+    return stats['count'], stats['updated']
+
+
+def upsert(new_entries, batch_size=500):
+    """Insert or update cache-shaped entries, returns how many changed"""
+    new_entries = {entry['id']: entry for entry in new_entries}
+    current = {entry['id']: entry for entry in entries(list(new_entries))}
+    changed = [
+        entry for id, entry in new_entries.items()
+        if current.get(id) != dict(entry, image_url=entry['image_url'] or '')
+    ]
+    if not changed:
+        return 0
+
+    with transaction.atomic():
+        type_names = {name for entry in changed for name in entry['types']}
+        PokemonType.objects.bulk_create(
+            [PokemonType(name=name) for name in sorted(type_names)], ignore_conflicts=True
+        )
+        type_ids = dict(PokemonType.objects.filter(name__in=type_names).values_list('name', 'id'))
+
+        Pokemon.objects.bulk_create(
+            [Pokemon(id=entry['id'], name=entry['name'], image_url=entry['image_url'] or '') for entry in changed],
+            batch_size=batch_size, update_conflicts=True, unique_fields=['id'], update_fields=['name', 'image_url', 'updated'],
+        )
+        changed_ids = [entry['id'] for entry in changed]
+        PokemonTypeMembership.objects.filter(pokemon_id__in=changed_ids).delete()
+        PokemonTypeMembership.objects.bulk_create([
+            PokemonTypeMembership(pokemon_id=entry['id'], type_id=type_ids[name], slot=slot)
+            for entry in changed for slot, name in enumerate(entry['types'], 1)
+        ], batch_size=batch_size)
+
+    logger.info("POKEDEX: Saved %s changed Pokémon to the database", len(changed))
+    return len(changed)
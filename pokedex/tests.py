@@ -1,3 +1,356 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# Create your tests here.
+import requests
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+
+from . import data, utils
+from .data import PokedexData, get_data
+
+
+def payload(id, name=None):
+    return {
+        'id': id,
+        'name': name or f'pokemon-{id}',
+        'types': [{'slot': 1, 'type': {'name': 'fire' if id % 2 else 'water'}}],
+        'sprites': {'other': {'official-artwork': {'front_default': f'https://img.example/{id}.png'}}},
+    }
+
+
+class StandIn(ThreadingHTTPServer):
+    """Local PokeAPI stand-in, with failures and changes set per id"""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.names = {}
+        self.failures = {}
+        self.missing = set()
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_port}/api/v2'
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        id = int(self.path.rstrip('/').rsplit('/', 1)[1])
+        with server.lock:
+            server.requests.append((id, self.headers.get('If-None-Match')))
+            failures = server.failures.get(id, 0)
+            if failures:
+                server.failures[id] = failures - 1
+        if failures:
+            self.send_response(503)
+            self.end_headers()
+            return
+        if id in server.missing:
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = json.dumps(payload(id, server.names.get(id))).encode()
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FetcherTestCase(SimpleTestCase):
+    def setUp(self):
+        self.server = StandIn()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.checkpoint = os.path.join(self.directory, 'pokemon.json.partial')
+
+    def fetch(self, ids, **kwargs):
+        kwargs.setdefault('checkpoint', self.checkpoint)
+        return utils.fetch_pokemon_data(ids, base_url=self.server.base_url, workers=4, rate=0, retries=2, **kwargs)
+
+    def requested(self):
+        requested, self.server.requests = self.server.requests, []
+        return sorted(id for id, _ in requested)
+
+
+class FetchPokemonDataTests(FetcherTestCase):
+    def test_fetches_every_id(self):
+        entries, validators, failed = self.fetch(range(1, 21), checkpoint=None)
+        self.assertEqual(failed, {})
+        self.assertEqual(sorted(entries), list(range(1, 21)))
+        self.assertEqual(entries[4], {
+            'id': 4, 'name': 'pokemon-4', 'types': ['water'], 'image_url': 'https://img.example/4.png',
+        })
+        self.assertTrue(all(validators[id]['etag'] for id in entries))
+
+    def test_retries_server_errors(self):
+        self.server.failures = {3: 2, 5: 1}
+        entries, _, failed = self.fetch(range(1, 7), checkpoint=None)
+        self.assertEqual(failed, {})
+        self.assertEqual(len(entries), 6)
+        self.assertEqual(self.requested().count(3), 3)
+
+    def test_resumes_from_the_checkpoint(self):
+        self.server.missing = {7}
+        self.server.failures = {9: 10}
+        entries, _, failed = self.fetch(range(1, 11))
+        self.assertEqual(sorted(failed), [7, 9])
+        self.assertEqual(len(entries), 8)
+        # A line cut short by a crash is skipped
+        with open(self.checkpoint, 'a') as f:
+            f.write('{"id": 10, "entry": {"id"')
+
+        self.server.missing = set()
+        self.server.failures = {}
+        self.requested()
+        entries, _, failed = self.fetch(range(1, 11))
+        self.assertEqual(failed, {})
+        self.assertEqual(sorted(entries), list(range(1, 11)))
+        self.assertEqual(self.requested(), [7, 9])
+
+
+class CheckpointTests(FetcherTestCase):
+    def checkpointed(self, cached=False):
+        header = utils.checkpoint_header(self.server.base_url, cached)
+        saved = utils.read_checkpoint(self.checkpoint, header)
+        return None if saved is None else sorted(saved[0])
+
+    def test_another_base_url_starts_over(self):
+        with open(self.checkpoint, 'w') as f:
+            f.write(json.dumps(utils.checkpoint_header('http://elsewhere.example/api/v2', False)) + '\n')
+            f.write(json.dumps({'id': 1, 'entry': payload(1, 'stale'), 'validator': None}) + '\n')
+        entries, _, failed = self.fetch(range(1, 3))
+        self.assertEqual(failed, {})
+        self.assertEqual(entries[1]['name'], 'pokemon-1')
+        self.assertEqual(self.requested(), [1, 2])
+        self.assertEqual(self.checkpointed(), [1, 2])
+
+    def test_refresh_does_not_reuse_a_plain_run(self):
+        self.server.missing = {2}
+        entries, validators, _ = self.fetch(range(1, 3))
+        self.assertEqual(self.checkpointed(), [1])
+        self.server.missing = set()
+        self.requested()
+        self.fetch(range(1, 3), cached=entries, validators=validators)
+        self.assertEqual(self.requested(), [1, 2])
+        self.assertIsNone(self.checkpointed())
+        self.assertEqual(self.checkpointed(cached=True), [1, 2])
+
+    def test_clearing_keeps_other_ids(self):
+        self.server.missing = {9}
+        self.fetch(range(1, 11))
+        utils.clear_checkpoint(range(1, 5), self.checkpoint)
+        self.assertEqual(self.checkpointed(), [5, 6, 7, 8, 10])
+        utils.clear_checkpoint(range(1, 11), self.checkpoint)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+
+class CountingLimiter(utils.RateLimiter):
+    def __init__(self):
+        super().__init__(0)
+        self.waits = 0
+
+    def wait(self):
+        self.waits += 1
+        super().wait()
+
+
+class RetryTests(FetcherTestCase):
+    def test_retries_wait_for_the_rate_limit(self):
+        self.server.failures = {1: 2}
+        limiter = CountingLimiter()
+        session = utils.make_session(1)
+        self.addCleanup(session.close)
+        entry, _ = utils.fetch_pokemon(session, self.server.base_url, 1, limiter, retries=2)
+        self.assertEqual(entry['name'], 'pokemon-1')
+        self.assertEqual(limiter.waits, 3)
+
+    def test_gives_up_after_the_last_retry(self):
+        self.server.failures = {1: 5}
+        session = utils.make_session(1)
+        self.addCleanup(session.close)
+        with self.assertRaises(requests.HTTPError):
+            utils.fetch_pokemon(session, self.server.base_url, 1, retries=1)
+        self.assertEqual(self.requested(), [1, 1])
+
+    def test_retry_after(self):
+        response = requests.Response()
+        self.assertEqual(utils.retry_delay(2, response), utils.BACKOFF * 4)
+        response.headers['Retry-After'] = '3'
+        self.assertEqual(utils.retry_delay(0, response), 3)
+
+
+class RefreshTests(FetcherTestCase):
+    def test_unchanged_entries_cost_a_304(self):
+        cached, validators, _ = self.fetch(range(1, 6), checkpoint=None)
+        self.requested()
+        self.server.names = {2: 'renamed'}
+        # No cached entry for 5, a 304 would leave nothing to keep
+        del cached[5]
+        entries, new_validators, failed = self.fetch(range(1, 6), checkpoint=None, cached=cached, validators=validators)
+        self.assertEqual(failed, {})
+        conditional = {id: etag for id, etag in self.server.requests}
+        self.assertEqual(conditional[1], validators[1]['etag'])
+        self.assertIsNone(conditional[5])
+        self.assertIs(entries[1], cached[1])
+        self.assertEqual(entries[2]['name'], 'renamed')
+        self.assertNotEqual(new_validators[2], validators[2])
+        self.assertEqual(new_validators[3], validators[3])
+
+
+class WriteJsonTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.path = os.path.join(self.directory, 'pokemon.json')
+
+    def test_replaces_the_file_and_keeps_its_mode(self):
+        utils.write_json(self.path, [1])
+        umask = os.umask(0)
+        os.umask(umask)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o666 & ~umask)
+        os.chmod(self.path, 0o640)
+        utils.write_json(self.path, [2])
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o640)
+        self.assertEqual(utils.read_json(self.path, None), [2])
+        self.assertEqual(os.listdir(self.directory), ['pokemon.json'])
+
+    def test_failed_write_leaves_the_old_file(self):
+        utils.write_json(self.path, [1])
+        with self.assertRaises(TypeError):
+            utils.write_json(self.path, [object()])
+        self.assertEqual(utils.read_json(self.path, None), [1])
+        self.assertEqual(os.listdir(self.directory), ['pokemon.json'])
+
+
+class PokedexDataTests(SimpleTestCase):
+    def setUp(self):
+        names = ['bulbasaur', 'ivysaur', 'venusaur', 'charmander', 'charmeleon', 'charizard', 'pikachu', 'raichu']
+        types = [['grass', 'poison']] * 3 + [['fire']] * 2 + [['fire', 'flying']] + [['electric']] * 2
+        pokemon = [
+            {'id': id, 'name': name, 'types': entry_types, 'image_url': ''}
+            for id, name, entry_types in zip(range(1, 9), names, types)
+        ]
+        # Loaded out of order, like a merged cache could be
+        self.data = PokedexData(list(reversed(pokemon)))
+
+    def test_search(self):
+        self.assertEqual(self.data.search('char'), {4, 5, 6})
+        self.assertEqual(self.data.search('saur'), {1, 2, 3})
+        self.assertEqual(self.data.search('chu'), {7, 8})
+        self.assertEqual(self.data.search('mew'), set())
+
+    def test_matching(self):
+        self.assertEqual(self.data.matching(), list(range(1, 9)))
+        self.assertEqual(self.data.matching('fire'), [4, 5, 6])
+        self.assertEqual(self.data.matching('fire', 'char'), [4, 5, 6])
+        self.assertEqual(self.data.matching('flying', 'char'), [6])
+        self.assertEqual(self.data.matching('', 'a'), [1, 2, 3, 4, 5, 6, 7, 8])
+        self.assertEqual(self.data.matching('water'), [])
+        self.assertEqual(self.data.types, ['electric', 'fire', 'flying', 'grass', 'poison'])
+
+    def test_page_cursor(self):
+        seen, after = [], 0
+        while True:
+            ids, after = self.data.page('', 'a', after, size=3)
+            seen.extend(ids)
+            if after is None:
+                break
+            self.assertEqual(after, ids[-1])
+        self.assertEqual(seen, list(range(1, 9)))
+        self.assertEqual(self.data.page('fire', '', 4, size=2), ([5, 6], None))
+        self.assertEqual(self.data.page('fire', '', 6, size=2), ([], None))
+
+
+@override_settings(POKEDEX_SOURCE='json', POKEDEX_REVALIDATE_SECONDS=0)
+class SnapshotReloadTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'pokemon.json')
+        # Point the loader at a file of our own, and start without a snapshot
+        self.addCleanup(setattr, data, 'CACHE_FILE', data.CACHE_FILE)
+        self.addCleanup(setattr, data, '_data', None)
+        data.CACHE_FILE = self.path
+        data._data = None
+
+    def write(self, count):
+        utils.write_json(self.path, [utils.summarize(payload(id)) for id in range(1, count + 1)])
+
+    def test_reloads_when_the_file_changes(self):
+        self.write(2)
+        snapshot = get_data()
+        self.assertEqual(snapshot.ids, [1, 2])
+        self.assertIs(get_data(), snapshot)
+        self.write(3)
+        self.assertEqual(get_data().ids, [1, 2, 3])
+
+    @override_settings(POKEDEX_REVALIDATE_SECONDS=60)
+    def test_revalidates_at_most_every_interval(self):
+        self.write(2)
+        snapshot = get_data()
+        self.write(3)
+        self.assertIs(get_data(), snapshot)
+        data._checked_at = 0.0
+        self.assertEqual(get_data().ids, [1, 2, 3])
+
+    def test_failed_reload_keeps_the_snapshot(self):
+        self.write(2)
+        snapshot = get_data()
+        with open(self.path, 'w') as f:
+            f.write('[{"id": 1, "na')
+        with self.assertLogs('pokedex', 'ERROR'):
+            self.assertIs(get_data(), snapshot)
+        # Retried at the next check
+        self.write(3)
+        self.assertEqual(get_data().ids, [1, 2, 3])
+
+    def test_missing_file_on_first_load(self):
+        with self.assertLogs('pokedex', 'ERROR'):
+            self.assertEqual(get_data().pokemon, [])
+        self.write(1)
+        self.assertEqual(get_data().ids, [1])
+
+
+@override_settings(POKEDEX_SOURCE='json')
+class PokedexViewTests(SimpleTestCase):
+    def test_pages_through_the_cache(self):
+        # Served from the bundled cache file, never the network
+        pokemon = get_data().pokemon
+        seen, url = [], reverse('pokedex')
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(entry['id'] for entry in response.context['pokemon_data'])
+            next_url = response.context['next_url']
+            url = reverse('pokedex') + next_url if next_url else None
+        self.assertEqual(seen, [entry['id'] for entry in pokemon])
+
+        response = self.client.get(reverse('pokedex'), {'type': 'fire', 'q': 'char'})
+        self.assertEqual(
+            [entry['name'] for entry in response.context['pokemon_data']],
+            [entry['name'] for entry in pokemon if 'fire' in entry['types'] and 'char' in entry['name']],
+        )
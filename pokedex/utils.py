@@ -1,14 +1,297 @@
+"""
+Fetching Pokémon from PokeAPI.
+
+Requests go through one keep-alive session shared by a small thread pool,
+with timeouts, retries with exponential backoff (Retry-After is honoured)
+and a rate limit across all workers, retries included. Every entry is
+appended to a checkpoint file as soon as it arrives, so a failed run can be
+re-run and only fetches the IDs still missing. The checkpoint starts with
+the base URL and mode it was fetched with, a run with different ones
+doesn't reuse it.
+
+The ETag/Last-Modified of every entry is kept next to the cache. A refresh
+sends them back as conditional requests, so unchanged entries cost a 304
+with no body, and the cache is only rewritten when something changed.
+Files are replaced atomically, a crash never leaves a half written cache.
+"""
+import email.utils
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger('pokedex')
+
+CACHE_DIR = os.path.join(settings.BASE_DIR, 'pokedex', 'cache')
+CACHE_FILE = os.path.join(CACHE_DIR, 'pokemon.json')
+VALIDATORS_FILE = os.path.join(CACHE_DIR, 'validators.json')
+CHECKPOINT_FILE = CACHE_FILE + '.partial'
+
+FIRST_ID = 1
+LAST_ID = 151  # 151 Pokémon
+WORKERS = 8
+RATE = 20  # requests per second, across all workers
+RETRIES = 5
+BACKOFF = 0.5  # seconds before the first retry, doubled for each one after
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+TIMEOUT = (5, 30)  # connect, read
+
+
+class RateLimiter:
+    """Spaces calls to wait() at least 1/rate seconds apart, across threads"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_at = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            at = max(now, self.next_at)
+            self.next_at = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
+def make_session(workers=WORKERS):
+    """Session with a connection pool per worker, fetch_pokemon does the retrying"""
+    session = requests.Session()
+    # Retries inside the adapter would get past the rate limiter
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def retry_delay(attempt, response=None):
+    """Seconds to wait before retry number attempt, Retry-After if the server sent one"""
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        if retry_after.isdigit():
+            return int(retry_after)
+        try:
+            return max(0, email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return BACKOFF * 2 ** attempt
+
+
+def summarize(data):
+    """The four fields the pokedex keeps from a full API payload"""
+    return {
+        "id": data["id"],
+        "name": data["name"],
+        "types": [t["type"]["name"] for t in data["types"]],
+        "image_url": data["sprites"]["other"]["official-artwork"]["front_default"]
+    }
+
+
+def checkpoint_header(base_url, conditional):
+    """First line of a checkpoint, what its entries were fetched with"""
+    return {"checkpoint": {"base_url": base_url.rstrip('/'), "conditional": conditional}}
+
+
+def read_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+
+def file_mode(path):
+    """Mode for a rewritten file: the current one's, else what open() would use"""
+    try:
+        return os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def write_json(path, data):
+    """Write to a temporary file in the same directory, then rename over path"""
+    replace_file(path, lambda f: json.dump(data, f))
+
+
+def replace_file(path, write):
+    """Call write with a temporary file in the same directory, then rename it over path"""
+    directory = os.path.dirname(path)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path), suffix='.tmp')
+    try:
+        # mkstemp creates 0600, which the web worker may not be able to read
+        os.fchmod(fd, file_mode(path))
+        with os.fdopen(fd, 'w') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def read_cache():
+    """({id: entry}, {id: validator}) as saved by the last complete run"""
+    entries = {entry["id"]: entry for entry in read_json(CACHE_FILE, [])}
+    # JSON object keys are strings
+    validators = {int(id): validator for id, validator in read_json(VALIDATORS_FILE, {}).items()}
+    return entries, validators
+
+
+def read_checkpoint(path=CHECKPOINT_FILE, header=None):
+    """({id: entry}, {id: validator}) saved by an earlier, unfinished run
+
+    None if there is no checkpoint, or it was written with another header.
+    """
+    if not os.path.exists(path):
+        return None
+    entries, validators = {}, {}
+    with open(path) as f:
+        try:
+            if json.loads(f.readline()) != header:
+                return None
+        except ValueError:
+            return None
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by a crash, that id is simply fetched again
+                continue
+            entries[record["id"]] = record["entry"]
+            if record.get("validator"):
+                validators[record["id"]] = record["validator"]
+    return entries, validators
+
+
+def clear_checkpoint(ids, path=CHECKPOINT_FILE):
+    """Drop ids from the checkpoint once they are cached, the file goes when nothing else is left"""
+    if not os.path.exists(path):
+        return
+    ids = set(ids)
+    with open(path) as f:
+        header, *lines = f.readlines()
+    kept = []
+    for line in lines:
+        try:
+            if json.loads(line)["id"] in ids:
+                continue
+        except ValueError:
+            continue
+        kept.append(line)
+    if kept:
+        # Progress of a run over other ids stays for that run
+        replace_file(path, lambda f: f.writelines([header] + kept))
+    else:
+        os.remove(path)
+
+
+def fetch_pokemon(session, base_url, id, limiter=None, validator=None, timeout=TIMEOUT, retries=RETRIES):
+    """(entry, validator) for an id, entry is None if it hasn't changed since validator"""
+    headers = {}
+    if validator:
+        if validator.get("etag"):
+            headers["If-None-Match"] = validator["etag"]
+        if validator.get("last_modified"):
+            headers["If-Modified-Since"] = validator["last_modified"]
+    url = f"{base_url.rstrip('/')}/pokemon/{id}"
+    for attempt in range(retries + 1):
+        # Every attempt waits its turn, retries count against the rate too
+        if limiter:
+            limiter.wait()
+        try:
+            response = session.get(url, headers=headers, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+            time.sleep(retry_delay(attempt))
+            continue
+        if response.status_code not in RETRY_STATUSES or attempt == retries:
+            break
+        time.sleep(retry_delay(attempt, response))
+    if response.status_code == 304:
+        return None, validator
+    response.raise_for_status()
+    validator = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+    return summarize(response.json()), validator if any(validator.values()) else None
+
+
+def fetch_pokemon_data(ids=None, base_url=None, workers=WORKERS, rate=RATE, retries=RETRIES,
+                       checkpoint=CHECKPOINT_FILE, cached=None, validators=None, progress=None):
+    """Fetch ids concurrently, returns ({id: entry}, {id: validator}, {id: error})
+
+    Entries already in the checkpoint file are not fetched again, as long
+    as it was written for the same base URL and with or without a cache.
+    Otherwise it is started over. Pass checkpoint=None to fetch everything
+    without one. Ids with both a cached entry and a validator are requested
+    conditionally, and keep the cached entry when it hasn't changed.
+    """
+    ids = list(range(FIRST_ID, LAST_ID + 1) if ids is None else ids)
+    base_url = base_url or settings.POKEAPI_BASE_URL
+    cached = cached or {}
+    validators = dict(validators or {})
+    header = checkpoint_header(base_url, bool(cached))
+    saved = read_checkpoint(checkpoint, header) if checkpoint else None
+    entries, saved_validators = saved or ({}, {})
+    validators.update(saved_validators)
+    missing = [id for id in ids if id not in entries]
+    failed = {}
+    if not missing:
+        return entries, validators, failed
 
-def fetch_pokemon_data():
-    pokemon_list = []
-    for id in range(1, 152):  # 151 Pokémon
-        response = requests.get(f"https://pokeapi.co/api/v2/pokemon/{id}")
-        data = response.json()
-        pokemon_list.append({
-            "id": data["id"],
-            "name": data["name"],
-            "types": [t["type"]["name"] for t in data["types"]],
-            "image_url": data["sprites"]["other"]["official-artwork"]["front_default"]
-        })
-    return pokemon_list
\ No newline at end of file
+    session = make_session(workers)
+    limiter = RateLimiter(rate)
+    log = None
+    if checkpoint and saved is not None:
+        log = open(checkpoint, 'a')
+    elif checkpoint:
+        if os.path.exists(checkpoint):
+            logger.warning("POKEDEX: Starting over %s, it was written for another base URL or mode", checkpoint)
+        log = open(checkpoint, 'w')
+        log.write(json.dumps(header) + '\n')
+        log.flush()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                # Without a cached entry a 304 would leave nothing to keep
+                pool.submit(
+                    fetch_pokemon, session, base_url, id, limiter,
+                    validators.get(id) if id in cached else None, retries=retries,
+                ): id
+                for id in missing
+            }
+            for future in as_completed(futures):
+                id = futures[future]
+                try:
+                    entry, validator = future.result()
+                except (requests.RequestException, KeyError, ValueError) as e:
+                    failed[id] = e
+                    logger.warning("POKEDEX: Failed to fetch Pokemon %s: %s", id, e)
+                    continue
+                modified = entry is not None
+                entries[id] = entry if modified else cached[id]
+                validators[id] = validator
+                if log:
+                    # Only this thread writes, the workers just fetch
+                    log.write(json.dumps({"id": id, "entry": entries[id], "validator": validator}) + '\n')
+                    log.flush()
+                if progress:
+                    progress(id, entries[id], modified)
+    finally:
+        session.close()
+        if log:
+            log.close()
+    return entries, validators, failed
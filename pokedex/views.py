@@ -1,8 +1,31 @@
 from django.shortcuts import render
-import json
+from .data import get_data
+import urllib.parse
 
 def pokedex_view(request):
-    # Load cached Pokémon data
-    with open('pokedex/cache/pokemon.json', 'r') as f:
-        pokemon_data = json.load(f)
-    return render(request, 'pokedex.html', {'pokemon_data': pokemon_data})
\ No newline at end of file
+    # Loaded and indexed once per worker, see pokedex/data.py
+    data = get_data()
+    selected_type = request.GET.get('type', '').strip().lower()
+    query = request.GET.get('q', '').strip().lower()
+    try:
+        after = int(request.GET.get('after', 0))
+    except ValueError:
+        after = 0
+
+    ids, next_after = data.page(selected_type, query, after)
+    # The snapshot holds the rows too, whichever the source, so no queries here
+    pokemon_data = [data.by_id[id] for id in ids]
+
+    next_url = None
+    if next_after is not None:
+        params = {key: value for key, value in (('type', selected_type), ('q', query)) if value}
+        next_url = '?' + urllib.parse.urlencode(dict(params, after=next_after))
+
+    return render(request, 'pokedex.html', {
+        'pokemon_data': pokemon_data,
+        'types': data.types,
+        'selected_type': selected_type,
+        'query': query,
+        'next_url': next_url,
+        'first_page': not after,
+    })
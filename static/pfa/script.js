@@ -3,8 +3,15 @@
 document.addEventListener('DOMContentLoaded', function() {
     const dayDropDown = document.getElementById('id_day_of_week');
     const categoryButtons = document.querySelectorAll('.category-button');
+    const categoryInput = document.getElementById('id_category');
+    const classList = document.getElementById('class-list');
+    const cardTemplate = document.getElementById('class-card-template');
+    const scheduleData = document.getElementById('week-schedule');
     const selectedCategory = selectedCategoryGlobal; // Use a global variable
 
+    // The whole week is embedded in the page, so filtering never needs the server
+    const weekSchedule = scheduleData ? JSON.parse(scheduleData.textContent) : null;
+
     // Function to update the selected button
     function updateSelectedButton(selected) {
         categoryButtons.forEach(button => {
@@ -15,18 +22,47 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
-    dayDropDown.addEventListener('change', function() {
-        document.getElementById('filterForm').submit();
-    });
+    // Re-render the class cards for the selected day and category
+    function renderSchedule() {
+        const day = dayDropDown.value;
+        const category = categoryInput.value || 'all';
+        const classes = (weekSchedule[day] || []).filter(cls =>
+            category === 'all' || cls.categories.includes(category)
+        );
+
+        const cards = document.createDocumentFragment();
+        classes.forEach(cls => {
+            const card = cardTemplate.content.cloneNode(true);
+            card.querySelector('[data-field="name"]').textContent = ` ${cls.name} `;
+            card.querySelector('[data-field="time"]').textContent = ` ${cls.start} - ${cls.end} (${cls.span} Minutes)`;
+            cards.appendChild(card);
+        });
+        classList.replaceChildren(cards);
+
+        // Keep the URL shareable and in sync with what is shown
+        const params = new URLSearchParams({ day: day, category: category });
+        history.replaceState(null, '', `${window.location.pathname}?${params}`);
+        updateSelectedButton(category);
+    }
+
+    // Fall back to the server round trip if the payload is missing
+    function applyFilters() {
+        if (weekSchedule && cardTemplate) {
+            renderSchedule();
+        } else {
+            document.getElementById('filterForm').submit();
+        }
+    }
+
+    dayDropDown.addEventListener('change', applyFilters);
 
     categoryButtons.forEach(button => {
         button.addEventListener('click', function() {
-            const categoryInput = document.getElementById('id_category');
             categoryInput.value = button.dataset.category;
-            document.getElementById('filterForm').submit();
+            applyFilters();
         });
     });
 
     // Set the initial selected button based on the selectedCategory
     updateSelectedButton(selectedCategory || 'all');
-});
\ No newline at end of file
+});
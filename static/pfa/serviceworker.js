@@ -1,8 +1,9 @@
-const CACHE_NAME = 'V1.2.1';
+const CACHE_NAME = 'V1.3.0';
 const CACHE_URLS = [
     '/',
     '/pfa',
     '/pfa/',
+    '/pfa/api/schedule',
     '/static/pfa/style.css',
     '/static/pfa/manifest.json',
     '/static/pfa/pfa-app-logo.png',
@@ -24,28 +25,28 @@ const preLoad = async () => {
 
 self.addEventListener('fetch', (event) => {
     event.respondWith(checkResponse(event.request));
-    event.waitUntil(addToCache(event.request));
 });
 
+// Network first, caching the same response instead of fetching it a second time
 const checkResponse = async (request) => {
     try {
         const response = await fetch(request);
         if (response.status === 404) {
             throw new Error('Not found');
         }
+        if (request.method === 'GET' && response.status === 200) {
+            await addToCache(request, response.clone());
+        }
         return response;
     } catch (error) {
         return returnFromCache(request);
     }
 };
 
-const addToCache = async (request) => {
+const addToCache = async (request, response) => {
     const cache = await caches.open(CACHE_NAME);
-    const response = await fetch(request);
-    if (response.status === 200) {
-        console.log(`${response.url} was cached`);
-        await cache.put(request, response.clone());
-    }
+    console.log(`${response.url} was cached`);
+    await cache.put(request, response);
 };
 
 const returnFromCache = async (request) => {